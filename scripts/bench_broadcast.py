@@ -0,0 +1,97 @@
+# Microbenchmark for broadcasting a packet to a whole area.
+# Compares calling Client.send_command once per recipient with
+# ClientManager.broadcast, which encodes the packet once and shares the bytes.
+#
+# Usage: python scripts/bench_broadcast.py [rounds]
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from server.client_manager import ClientManager  # noqa: E402
+from server.metrics import Metrics  # noqa: E402
+
+FLOODGUARD = {"times_per_interval": 1,
+              "interval_length": 0, "mute_length": 0}
+
+MS = (
+    "1", "-", "Phoenix", "normal", "Hold it! Ça va très bien 🌍 #%$&", "def",
+    "1", 0, 3, 0, "0", 0, 0, 0, 0, "Nick", -1, "", "", 0, 0, 0, 0, "0", 0,
+    "-", "-", "-", 0, "-",
+)
+CT = ("<dollar>H", "The trial will begin shortly, please take your seats.", "1")
+
+
+class Transport:
+    """Counts what would have been written to the socket."""
+
+    def __init__(self):
+        self.written = 0
+
+    def write(self, data):
+        self.written += len(data)
+
+
+def make_server(recipients):
+    area = SimpleNamespace(last_ic_message=None, pos_lock=[])
+    hub = SimpleNamespace(default_area=lambda: area)
+    server = SimpleNamespace(
+        config={
+            "playerlimit": recipients,
+            "music_change_floodguard": FLOODGUARD,
+            "wtce_floodguard": FLOODGUARD,
+            "ooc_floodguard": FLOODGUARD,
+            "outbound_buffer": {},
+        },
+        hub_manager=SimpleNamespace(default_hub=lambda: hub),
+        metrics=Metrics(),
+        supported_features=[],
+    )
+    manager = ClientManager(server)
+    for i in range(recipients):
+        c = manager.Client(server, Transport(), i, i)
+        c.version = "2.10.0"
+        manager.clients.add(c)
+    return manager
+
+
+def per_client(manager, cmd, args):
+    for c in manager.clients:
+        c.send_command(cmd, *args)
+
+
+def broadcast(manager, cmd, args):
+    manager.broadcast(manager.clients, cmd, *args)
+
+
+def run(func, manager, rounds):
+    start = time.perf_counter()
+    for i in range(rounds):
+        func(manager, "MS", MS)
+        func(manager, "CT", CT)
+    elapsed = time.perf_counter() - start
+    written = sum(c.transport.written for c in manager.clients)
+    return elapsed, written
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    print(f"{rounds} rounds of one MS and one CT")
+    for recipients in (10, 100, 1000):
+        for name, func in (("per-client", per_client), ("broadcast", broadcast)):
+            manager = make_server(recipients)
+            # Let about half of them be in the middle of a case, so their
+            # evidence numbers differ and they need a variant of their own.
+            for c in list(manager.clients)[::2]:
+                c.evi_list = [0, 3]
+            elapsed, written = run(func, manager, rounds)
+            print(
+                f"{recipients:>5} recipients {name:>10}: {elapsed * 1000:9.2f} ms, "
+                f"{written / elapsed / 1024 / 1024:9.2f} MiB/s"
+            )
+
+
+if __name__ == "__main__":
+    main()
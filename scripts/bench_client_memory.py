@@ -0,0 +1,64 @@
+# Memory benchmark for ClientManager.Client.
+# Creates a few thousand clients the way new_client does and reports how many
+# bytes each one takes, as traced by tracemalloc.
+#
+# Usage: python scripts/bench_client_memory.py [clients]
+import os
+import sys
+import tracemalloc
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from server.client_manager import ClientManager  # noqa: E402
+from server.metrics import Metrics  # noqa: E402
+
+FLOODGUARD = {"times_per_interval": 3,
+              "interval_length": 10, "mute_length": 60}
+
+
+class Transport:
+    def write(self, data):
+        pass
+
+
+def make_server(clients):
+    area = SimpleNamespace(last_ic_message=None, pos_lock=[])
+    hub = SimpleNamespace(default_area=lambda: area)
+    return SimpleNamespace(
+        config={
+            "playerlimit": clients,
+            "music_change_floodguard": FLOODGUARD,
+            "wtce_floodguard": FLOODGUARD,
+            "ooc_floodguard": FLOODGUARD,
+            "outbound_buffer": {},
+        },
+        hub_manager=SimpleNamespace(default_hub=lambda: hub),
+        metrics=Metrics(),
+        supported_features=[],
+    )
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    server = make_server(count)
+    manager = ClientManager(server)
+    transports = [Transport() for _ in range(count)]
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    clients = [
+        manager.Client(server, transports[i], i, i) for i in range(count)
+    ]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    stats = after.compare_to(before, "filename")
+    total = sum(s.size_diff for s in stats)
+    print(f"{count} clients: {total / 1024:.0f} KiB, {total / len(clients):.0f} bytes per client")
+    for s in stats[:5]:
+        print(f"  {s.traceback[0].filename}: {s.size_diff / len(clients):.0f} bytes per client")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+# Microbenchmark for incoming packet framing.
+# Feeds thousands of pipelined MS/CT packets through the old str-based
+# splitting and through server.network.framing.FrameBuffer.
+#
+# Usage: python scripts/bench_framing.py [packets] [chunk size]
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from server.network.framing import FrameBuffer  # noqa: E402
+
+MS = (
+    "MS#chat#-#Phoenix#normal#Hold it! Ça va très bien 🌍#def#1#0#1#0#0#0#0#0#0#"
+    "#-1#0#0#0#0#-#-#-#0#-#%"
+)
+CT = "CT#Player#Hey everyone, what's the next case?#%"
+
+
+class LegacyBuffer:
+    """The framing that AOProtocol.data_received used to do."""
+
+    def __init__(self):
+        self.buffer = ""
+
+    def feed(self, data):
+        buf = self.buffer + data.decode("utf-8", "ignore")
+        self.buffer = buf.translate({ord(c): None for c in "\0"})
+        messages = []
+        while "#%" in self.buffer:
+            spl = self.buffer.split("#%", 1)
+            self.buffer = spl[1]
+            messages.append(spl[0])
+        return messages
+
+
+def make_stream(count):
+    return "".join(MS if i % 2 else CT for i in range(count)).encode("utf-8")
+
+
+def run(buffer, stream, chunk_size):
+    received = 0
+    start = time.perf_counter()
+    for i in range(0, len(stream), chunk_size):
+        received += len(buffer.feed(stream[i: i + chunk_size]))
+    return time.perf_counter() - start, received
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    chunk_size = int(sys.argv[2]) if len(sys.argv) > 2 else 65536
+    stream = make_stream(count)
+    print(f"{count} packets, {len(stream)} bytes, {chunk_size} byte chunks")
+    for name, buffer in (
+        ("legacy", LegacyBuffer()),
+        ("framebuffer", FrameBuffer(len(stream))),
+    ):
+        elapsed, received = run(buffer, stream, chunk_size)
+        print(
+            f"{name:>12}: {elapsed * 1000:9.2f} ms, {received} packets, "
+            f"{len(stream) / elapsed / 1024 / 1024:8.2f} MiB/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,329 @@
+# Load generator: a swarm of synthetic AO clients against a running server.
+#
+# Every client does the real handshake (HI, ID, askchaa, RC, RM, RD, CC) over
+# TCP or WebSocket, then keeps sending a mix of IC messages, OOC messages,
+# music changes and area/hub moves. At the end it reports how long connecting
+# and the handshake took, how long IC messages took to reach everyone else in
+# the area, and how much CPU the server used.
+#
+# The server sees every connection coming from the same IP, so for anything
+# but a handful of clients raise multiclient_limit and the ipid budgets of
+# ingress_limit (or disable it) in the config of the server under test.
+#
+# Usage: python scripts/loadgen.py [--tcp N] [--ws N] [--duration SECONDS]
+#            [--rate ACTIONS_PER_SECOND] [--mix ms=60,ct=20,mc=10,move=10]
+#            [--hubs N] [--areas N] [--server-pid PID]
+#            [--save baseline.json] [--compare baseline.json]
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+import websockets
+
+HANDSHAKE = ("askchaa", "RC", "RM", "RD")
+
+
+def percentiles(values):
+    """p50/p90/p99/max of a list of seconds, in milliseconds."""
+    if not values:
+        return {"count": 0}
+    values = sorted(values)
+
+    def pick(p):
+        return round(values[min(len(values) - 1, int(len(values) * p))] * 1000, 2)
+
+    return {
+        "count": len(values),
+        "p50": pick(0.5),
+        "p90": pick(0.9),
+        "p99": pick(0.99),
+        "max": round(values[-1] * 1000, 2),
+    }
+
+
+def cpu_seconds(pid):
+    """User and system CPU time used by a process so far, or None."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    # utime and stime are the 14th and 15th fields, counting the pid as 1st
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+class Swarm:
+    """State shared by every synthetic client."""
+
+    def __init__(self, args):
+        self.args = args
+        self.mix = []
+        for part in args.mix.split(","):
+            kind, weight = part.split("=")
+            self.mix.append((kind.strip(), int(weight)))
+        # message token -> (sender, time sent)
+        self.sent = {}
+        self.connect_times = []
+        self.handshake_times = []
+        self.fanout = []
+        self.actions = {}
+        self.refused = 0
+        self.failed = 0
+        self.spectators = 0
+        self.received = 0
+
+
+class SyntheticClient:
+    """One fake player, talking AO over TCP or WebSocket."""
+
+    def __init__(self, swarm, index, websocket):
+        self.swarm = swarm
+        self.index = index
+        self.websocket = websocket
+        self.name = f"load{index}"
+        self.char_list = []
+        self.char_id = -1
+        self.done = asyncio.Event()
+        self.chars = asyncio.Event()
+        self.taken = None
+        self.seq = 0
+        self.reader = None
+        self.writer = None
+        self.ws = None
+
+    async def open(self):
+        args = self.swarm.args
+        if self.websocket:
+            self.ws = await websockets.connect(
+                f"ws://{args.host}:{args.ws_port}", max_size=None)
+        else:
+            self.reader, self.writer = await asyncio.open_connection(
+                args.host, args.port)
+
+    def send(self, *packet):
+        msg = "#".join(str(a) for a in packet) + "#%"
+        if self.websocket:
+            asyncio.ensure_future(self.ws.send(msg))
+        else:
+            self.writer.write(msg.encode("utf-8"))
+
+    async def receive(self):
+        buf = ""
+        while True:
+            if self.websocket:
+                try:
+                    data = await self.ws.recv()
+                except websockets.ConnectionClosed:
+                    break
+            else:
+                data = await self.reader.read(65536)
+                if not data:
+                    break
+                data = data.decode("utf-8", "replace")
+            buf += data
+            *packets, buf = buf.split("#%")
+            now = time.perf_counter()
+            for packet in packets:
+                self.swarm.received += 1
+                self.handle(packet.split("#"), now)
+
+    def handle(self, packet, now):
+        cmd = packet[0]
+        if cmd == "MS" and len(packet) > 5:
+            entry = self.swarm.sent.get(packet[5])
+            if entry is not None and entry[0] is not self:
+                self.swarm.fanout.append(now - entry[1])
+        elif cmd == "SC":
+            self.char_list = [c.split("&")[0] for c in packet[1:]]
+        elif cmd == "CharsCheck":
+            self.taken = packet[1:]
+            self.chars.set()
+        elif cmd == "PV" and len(packet) > 3:
+            self.char_id = int(packet[3])
+        elif cmd == "DONE":
+            self.done.set()
+        elif cmd == "BD":
+            self.swarm.refused += 1
+
+    async def handshake(self):
+        self.send("HI", f"loadgen{self.index}")
+        self.send("ID", "AO2", "2.10.0")
+        for cmd in HANDSHAKE:
+            self.send(cmd)
+        await self.done.wait()
+        await self.chars.wait()
+        free = [i for i, t in enumerate(self.taken) if t == "0"]
+        if free:
+            self.send("CC", 0, random.choice(free), f"loadgen{self.index}")
+
+    def action(self):
+        swarm = self.swarm
+        kinds, weights = zip(*swarm.mix)
+        kind = random.choices(kinds, weights)[0]
+        if kind == "ms" and self.char_id == -1:
+            kind = "ct"
+        swarm.actions[kind] = swarm.actions.get(kind, 0) + 1
+        if kind == "ms":
+            self.seq += 1
+            token = f"lg{self.index}x{self.seq}"
+            name = self.char_list[self.char_id] if self.char_id < len(self.char_list) else "-"
+            self.send(
+                "MS", "chat", "-", name, "normal", token, "wit", "1", "0",
+                self.char_id, "0", "0", "0", "0", "0", "0", "", "-1", "0",
+                "0", "0", "0", "-", "-", "-", "0", "-",
+            )
+            swarm.sent[token] = (self, time.perf_counter())
+        elif kind == "ct":
+            self.send("CT", self.name, f"load test message {random.random()}")
+        elif kind == "mc":
+            self.send("MC", "~stop.mp3", self.char_id)
+        elif kind == "move":
+            args = swarm.args
+            if args.hubs > 1:
+                self.send("CT", self.name, f"/hub {random.randrange(args.hubs)}")
+            self.send("CT", self.name, f"/area {random.randrange(args.areas)}")
+
+    async def run(self, ready, start):
+        swarm = self.swarm
+        began = time.perf_counter()
+        try:
+            await self.open()
+        except OSError:
+            swarm.failed += 1
+            ready.set_result(None)
+            return
+        swarm.connect_times.append(time.perf_counter() - began)
+        receiver = asyncio.ensure_future(self.receive())
+        try:
+            await asyncio.wait_for(self.handshake(), 10)
+            swarm.handshake_times.append(time.perf_counter() - began)
+            # Give the server a moment to apply the character.
+            await asyncio.sleep(0.5)
+            if self.char_id == -1:
+                swarm.spectators += 1
+        except asyncio.TimeoutError:
+            swarm.failed += 1
+        if not ready.done():
+            ready.set_result(None)
+        await start.wait()
+        interval = 1 / swarm.args.rate
+        deadline = time.perf_counter() + swarm.args.duration
+        # Spread the clients out instead of having them all act at once.
+        await asyncio.sleep(random.random() * interval)
+        while time.perf_counter() < deadline and not receiver.done():
+            self.action()
+            await asyncio.sleep(random.expovariate(swarm.args.rate))
+        # Let the last messages arrive.
+        await asyncio.sleep(1)
+        receiver.cancel()
+        if self.websocket:
+            await self.ws.close()
+        else:
+            self.writer.close()
+
+
+async def run(args):
+    swarm = Swarm(args)
+    clients = [SyntheticClient(swarm, i, False) for i in range(args.tcp)]
+    clients += [SyntheticClient(swarm, args.tcp + i, True) for i in range(args.ws)]
+    start = asyncio.Event()
+    readies = []
+    tasks = []
+    for c in clients:
+        ready = asyncio.get_running_loop().create_future()
+        readies.append(ready)
+        tasks.append(asyncio.ensure_future(c.run(ready, start)))
+        # Don't open everything in the same instant.
+        await asyncio.sleep(args.connect_interval)
+    await asyncio.gather(*readies)
+
+    cpu_before = cpu_seconds(args.server_pid) if args.server_pid else None
+    began = time.perf_counter()
+    start.set()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    elapsed = time.perf_counter() - began
+    cpu_after = cpu_seconds(args.server_pid) if args.server_pid else None
+
+    cpu = None
+    if cpu_before is not None and cpu_after is not None:
+        cpu = round((cpu_after - cpu_before) / elapsed * 100, 1)
+    return {
+        "clients": {"tcp": args.tcp, "ws": args.ws},
+        "duration": round(elapsed, 2),
+        "rate": args.rate,
+        "mix": args.mix,
+        "refused": swarm.refused,
+        "failed": swarm.failed,
+        "spectators": swarm.spectators,
+        "actions": swarm.actions,
+        "packets_received": swarm.received,
+        "connect_ms": percentiles(swarm.connect_times),
+        "handshake_ms": percentiles(swarm.handshake_times),
+        "ms_fanout_ms": percentiles(swarm.fanout),
+        "server_cpu_percent": cpu,
+    }
+
+
+def compare(result, baseline):
+    """Print how the latencies and CPU use changed since the baseline."""
+    print("\nCompared to baseline:")
+    for key in ("connect_ms", "handshake_ms", "ms_fanout_ms"):
+        for p in ("p50", "p90", "p99", "max"):
+            old = baseline.get(key, {}).get(p)
+            new = result[key].get(p)
+            if old is None or new is None:
+                continue
+            change = (new - old) / old * 100 if old else 0
+            print(f"  {key} {p}: {old} -> {new} ({change:+.1f}%)")
+    old = baseline.get("server_cpu_percent")
+    new = result["server_cpu_percent"]
+    if old is not None and new is not None:
+        print(f"  server_cpu_percent: {old} -> {new}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=27016)
+    parser.add_argument("--ws-port", type=int, default=50001)
+    parser.add_argument("--tcp", type=int, default=10,
+                        help="number of TCP clients")
+    parser.add_argument("--ws", type=int, default=0,
+                        help="number of WebSocket clients")
+    parser.add_argument("--duration", type=float, default=30,
+                        help="seconds to keep sending after everyone is connected")
+    parser.add_argument("--rate", type=float, default=0.5,
+                        help="actions per second of each client")
+    parser.add_argument("--mix", default="ms=60,ct=20,mc=10,move=10",
+                        help="relative weights of ms, ct, mc and move actions")
+    parser.add_argument("--hubs", type=int, default=1,
+                        help="hubs to move between")
+    parser.add_argument("--areas", type=int, default=2,
+                        help="areas to move between in a hub")
+    parser.add_argument("--connect-interval", type=float, default=0.01,
+                        help="seconds between opening connections")
+    parser.add_argument("--server-pid", type=int,
+                        help="server process to measure CPU use of (Linux only)")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="compare against this JSON file")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    print(json.dumps(result, indent=2))
+    if args.compare:
+        with open(args.compare) as f:
+            compare(result, json.load(f))
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Saved to {args.save}")
+    if result["refused"] or result["failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
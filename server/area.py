@@ -22,56 +22,39 @@ from server import commands
 from server.evidence import EvidenceList
 from server.exceptions import ClientError, AreaError, ArgumentError, ServerError
 from server.constants import MusicEffect
+from server.population import Occupancy, Population
+from server.client_registry import AreaIndex
+from server.link_graph import Links
+from server.countdown import Countdown, TimerSync
+from server.music_catalog import EMPTY
 
 from collections import OrderedDict
 
-import asyncio
 import random
 import time
-import arrow
 
-import oyaml as yaml  # ordered yaml
-import os
-import datetime
 import logging
 
 logger = logging.getLogger("events")
 
 
 class Area:
-    class Timer:
+    class Timer(Countdown):
         """Represents a single instance of a timer in the area."""
 
-        def __init__(
-            self,
-            _id,
-            Set=False,
-            started=False,
-            static=None,
-            target=None,
-            area=None,
-            caller=None,
-        ):
+        def __init__(self, wheel, _id, area=None, caller=None):
+            # Timer ID 0 is the hub's, so area timers start at 1
+            super().__init__(wheel, _id + 1)
             self.id = _id
-            self.set = Set
-            self.started = started
-            self.static = static
-            self.target = target
             self.area = area
             self.caller = caller
-            self.schedule = None
             self.commands = []
 
         def timer_expired(self):
-            if self.schedule:
-                self.schedule.cancel()
             # Either the area or the hub was destroyed at some point
             if self.area is None or self is None:
                 return
 
-            self.static = datetime.timedelta(0)
-            self.started = False
-
             self.area.broadcast_ooc(f"Timer {self.id+1} has expired.")
             self.call_commands()
 
@@ -114,13 +97,66 @@ class Area:
                     # Even tho self.commands.clear() is going to break us out of the while loop, manually return anyway just to be safe.
                     return
 
+    class InviteList(set):
+        """IDs of the clients invited to an area.
+
+        Keeps ClientRegistry.invites in step, so a leaving client can be
+        taken off only the lists it's actually on. Once the area stops using
+        it (see Area.invite_list), it's just a set.
+        """
+
+        def __init__(self, area, ids=()):
+            super().__init__()
+            self.area = area
+            for client_id in ids:
+                self.add(client_id)
+
+        def add(self, client_id):
+            if client_id not in self:
+                super().add(client_id)
+                if self.area is not None:
+                    self.area.server.client_manager.registry.invite(
+                        client_id, self.area)
+
+        def discard(self, client_id):
+            if client_id in self:
+                super().discard(client_id)
+                if self.area is not None:
+                    self.area.server.client_manager.registry.uninvite(
+                        client_id, self.area)
+
+        def remove(self, client_id):
+            if client_id not in self:
+                raise KeyError(client_id)
+            self.discard(client_id)
+
+        def clear(self):
+            self.detach()
+            super().clear()
+
+        def detach(self):
+            """Take every ID on the list out of the registry."""
+            if self.area is not None:
+                registry = self.area.server.client_manager.registry
+                for client_id in self:
+                    registry.uninvite(client_id, self.area)
+
     """Represents a single instance of an area."""
 
     def __init__(self, area_manager, name):
         self.clients = set()
-        self.invite_list = set()
         self.area_manager = area_manager
+        self.occupancy = Occupancy()
+        # Clients in the area by player ID, character ID and pos
+        self.index = AreaIndex()
+        # Pending CharsCheck update, see broadcast_chars_check
+        self.chars_check_handle = None
+        self.population = Population(area_manager.population, self.occupancy)
+        self.invite_list = set()
         self._name = name
+        self._abbreviation = ""
+        # Index in the hub's areas, kept up to date by AreaManager.renumber
+        self._id = -1
 
         # Initialize prefs
         self.background = "default"
@@ -152,7 +188,7 @@ class Area:
         self.replace_music = False
         self.ambience = ""
         self.can_dj = True
-        self.hidden = False
+        self._hidden = False
         self.can_whisper = True
         self.can_wtce = True
         self.music_autoplay = False
@@ -220,8 +256,10 @@ class Area:
         self.blue_team = set()
         # Minigame name
         self.minigame = ""
-        # Minigame schedule
-        self.minigame_schedule = None
+        # Minigame countdown, shown as timer ID 2
+        self.minigame_timer = Countdown(
+            self.server.timers, 2, lambda: self.end_minigame("Timer expired!")
+        )
         # /end
 
         self.old_muted = False
@@ -255,16 +293,17 @@ class Area:
         self.jukebox_votes = []
         self.jukebox_prev_char_id = -1
 
-        self.music_list = []
+        self.music_list = EMPTY
 
         self._owners = set()
         self.afkers = []
 
         # Dictionary of dictionaries with further info, examine def link for more info
-        self.links = {}
+        self.links = Links(self)
 
         # Timers ID 1 thru 20, (indexes 0 to 19 in area), timer ID 0 is reserved for hubs.
-        self.timers = [self.Timer(x) for x in range(20)]
+        self.timers = [self.Timer(self.server.timers, x) for x in range(20)]
+        self.timer_sync = TimerSync(self)
 
         # Demo stuff
         self.demo = []
@@ -284,16 +323,55 @@ class Area:
 
     @name.setter
     def name(self, value):
+        old = self._name
         self._name = value.strip()
         while "<num>" in self._name or "<percent>" in self._name:
             self._name = self._name.replace(
                 "<num>", "").replace("<percent>", "")
+        self.area_manager.area_names.renamed(self, old, self._name)
         self.abbreviation = self.abbreviate()
 
+    @property
+    def abbreviation(self):
+        """Area's abbreviation, can be set apart from the name."""
+        return self._abbreviation
+
+    @abbreviation.setter
+    def abbreviation(self, value):
+        old = self._abbreviation
+        self._abbreviation = value
+        self.area_manager.area_names.reabbreviated(self, old, value)
+
+    @property
+    def hidden(self):
+        """Whether the area is left out of the area list of those who can't see hidden areas."""
+        return self._hidden
+
+    @hidden.setter
+    def hidden(self, value):
+        self._hidden = value
+        self.area_manager.link_graph.invalidate()
+
     @property
     def id(self):
         """Get area's index in the AreaManager's 'areas' list if present in its areas. Otherwise, return -1."""
-        return self.area_manager.areas.index(self) if self in self.area_manager.areas else -1
+        return self._id
+
+    @property
+    def invite_list(self):
+        """IDs of the clients that may enter despite a lock, or speak despite a mute."""
+        return self._invite_list
+
+    @invite_list.setter
+    def invite_list(self, value):
+        old = getattr(self, "_invite_list", None)
+        if value is old:
+            return
+        if old is not None:
+            # Whoever kept hold of the old list may still use it, leave it be
+            old.detach()
+            old.area = None
+        self._invite_list = self.InviteList(self, value)
 
     @property
     def server(self):
@@ -368,7 +446,9 @@ class Area:
             return self.name.upper()
 
     def load(self, area):
+        old = self._name
         self._name = area["area"]
+        self.area_manager.area_names.renamed(self, old, self._name)
         self.o_name = self._name
         self.o_abbreviation = self.abbreviation
         _pos_lock = ""
@@ -650,12 +730,17 @@ class Area:
         if len(self.evi_list.evidences) > 0:
             area["evidence"] = [e.to_dict() for e in self.evi_list.evidences]
         if len(self.links) > 0:
-            area["links"] = self.links
+            area["links"] = {key: dict(link) for key, link in self.links.items()}
         return area
 
     def new_client(self, client):
         """Add a client to the area."""
-        self.clients.add(client)
+        if client not in self.clients:
+            self.clients.add(client)
+            self.area_manager.members.add(client)
+            self.population.add(client)
+            client.counted_in = self.population
+            self.index.add(client)
         if client.char_id is not None:
             database.log_area("area.join", client, self)
 
@@ -700,48 +785,11 @@ class Area:
         client.send_command("JD", jd)
 
     def update_timers(self, client, running_only=False):
-        """Update the timers for the target client"""
+        """Update the timers for the target client, see TimerSync.update"""
         # this client didn't even pick char yet
         if client.char_id is None:
             return
-
-        # Hub timers
-        timer = client.area.area_manager.timer
-        if timer.set:
-            s = int(not timer.started)
-            current_time = timer.static
-            if timer.started:
-                current_time = timer.target - arrow.get()
-            int_time = int(current_time.total_seconds()) * 1000
-            # Unhide the timer
-            client.send_command("TI", 0, 2, int_time)
-            # Start the timer
-            client.send_command("TI", 0, s, int_time)
-        elif not running_only:
-            # Stop the timer
-            client.send_command("TI", 0, 3, 0)
-            # Hide the timer
-            client.send_command("TI", 0, 1, 0)
-
-        # Area timers
-        for timer_id, timer in enumerate(self.timers):
-            # Send static time if applicable
-            if timer.set:
-                s = int(not timer.started)
-                current_time = timer.static
-                if timer.started:
-                    current_time = timer.target - arrow.get()
-                int_time = int(current_time.total_seconds()) * 1000
-                # Start the timer
-                client.send_command("TI", timer_id + 1, s, int_time)
-                # Unhide the timer
-                client.send_command("TI", timer_id + 1, 2, int_time)
-                # client.send_ooc(f"Timer {timer_id+1} is at {current_time}")
-            elif not running_only:
-                # Stop the timer
-                client.send_command("TI", timer_id + 1, 1, 0)
-                # Hide the timer
-                client.send_command("TI", timer_id + 1, 3, 0)
+        self.timer_sync.update(client, running_only)
 
     def remove_client(self, client):
         """Remove a disconnected client from the area."""
@@ -761,8 +809,13 @@ class Area:
         self.trigger("leave", client)
         if client in self.clients:
             self.clients.remove(client)
+            self.area_manager.members.discard(client)
+            self.population.remove(client)
+            client.counted_in = None
+            self.index.remove(client)
         if client in self.afkers:
             self.afkers.remove(client)
+            self.population.count_afk(-1)
             self.server.client_manager.toggle_afk(client)
         if self.jukebox:
             self.remove_jukebox_vote(client, True)
@@ -774,9 +827,8 @@ class Area:
             self.area_manager.send_arup_players()
 
         # Update everyone's available characters list
-        # Commented out due to potentially causing clientside lag...
-        # self.send_command('CharsCheck',
-        #                     *client.get_available_char_list())
+        if client.char_id is not None and client.char_id >= 0:
+            self.broadcast_chars_check()
 
     def unlock(self):
         """Mark the area as unlocked."""
@@ -822,7 +874,7 @@ class Area:
         :param password: the password you need to input to pass through this link
 
         """
-        link = {
+        self.links[str(target)] = {
             "locked": locked,
             "hidden": hidden,
             "target_pos": target_pos,
@@ -830,8 +882,7 @@ class Area:
             "evidence": evidence,
             "password": password,
         }
-        self.links[str(target)] = link
-        return link
+        return self.links[str(target)]
 
     def unlink(self, target):
         try:
@@ -845,38 +896,71 @@ class Area:
         Check if a character is available for use.
         :param char_id: character ID
         """
-        return char_id not in [x.char_id for x in self.clients]
+        return self.occupancy.is_free(char_id)
 
     def get_rand_avail_char_id(self):
         """Get a random available character ID."""
-        avail_set = set(range(len(self.area_manager.char_list))) - {
-            x.char_id for x in self.clients
-        }
-        if len(avail_set) == 0:
+        avail = self.occupancy.free(len(self.area_manager.char_list))
+        if len(avail) == 0:
             raise AreaError("No available characters.")
-        return random.choice(tuple(avail_set))
+        return random.choice(avail)
+
+    def broadcast_chars_check(self):
+        """
+        Send everyone in the area the characters they can pick, shortly.
+        Changes within chars_check_delay of each other go out together.
+        """
+        if self.chars_check_handle is None:
+            self.chars_check_handle = self.server.timers.call_later(
+                self.server.config["chars_check_delay"], self.flush_chars_check
+            )
+
+    def flush_chars_check(self):
+        """Send CharsCheck to everyone in the area whose list changed since they got one."""
+        self.chars_check_handle = None
+        check = self.occupancy.chars_check(len(self.area_manager.char_list))
+        clients = []
+        skipped = 0
+        for c in self.clients:
+            if c.charcursed:
+                own = tuple(c.get_available_char_list())
+                if own == c.chars_check_sent:
+                    skipped += 1
+                    continue
+                c.chars_check_sent = own
+                c.send_command("CharsCheck", *own)
+            elif c.chars_check_sent is check or c.chars_check_sent == check:
+                skipped += 1
+            else:
+                c.chars_check_sent = check
+                clients.append(c)
+        self.server.client_manager.broadcast(clients, "CharsCheck", *check)
+        if skipped > 0:
+            self.server.metrics.count("charscheck.skipped", skipped)
 
     def send_command(self, cmd, *args):
         """
         Broadcast an AO-compatible command to all clients in the area.
         """
-        for c in self.clients:
-            c.send_command(cmd, *args)
+        self.server.client_manager.broadcast(self.clients, cmd, *args)
 
     def send_owner_command(self, cmd, *args):
         """
         Send an AO-compatible command to all owners of the area
         that are not currently in the area.
         """
-        for c in self.owners:
-            if c in self.clients:
-                continue
-            if (
+        targets = [
+            c
+            for c in self.owners
+            if c not in self.clients
+            and (
                 c.remote_listen == 3
                 or (cmd == "CT" and c.remote_listen == 2)
                 or (cmd == "MS" and c.remote_listen == 1)
-            ):
-                c.send_command(cmd, *args)
+            )
+        ]
+        if len(targets) > 0:
+            self.server.client_manager.broadcast(targets, cmd, *args)
 
     def send_owner_ic(self, bg, cmd, *args):
         """
@@ -980,16 +1064,17 @@ class Area:
                 try:
                     opponent = None
                     target = target.lower()
-                    if target != "":
+                    # We're @num so we're trying to grab a Client ID
+                    if target.strip().isnumeric():
+                        opponent = self.index.get(int(target))
+                        if opponent == client:
+                            opponent = None
+                    # Otherwise go by character names and shownames
+                    if target != "" and opponent is None:
                         for t in self.clients:
                             # Ignore ourselves
                             if t == client:
                                 continue
-                            # We're @num so we're trying to grab a Client ID, don't do shownames
-                            if target.strip().isnumeric():
-                                if t.id == int(target):
-                                    opponent = t
-                                    break
                             # Loop through the charnames if it's @text
                             if target in t.char_name.lower() or target.split()[0] in t.char_name.lower():
                                 opponent = t
@@ -1084,15 +1169,13 @@ class Area:
                             break
                 # If our pair opponent is found
                 if charid_pair != -1:
-                    # Search through clients in area
-                    for target in client.area.clients:
-                        # If we find our target char ID
-                        if target.char_id == charid_pair:
-                            # Set emote, flip and folder properly
-                            other_emote = target.last_sprite
-                            other_flip = target.flip
-                            other_folder = target.claimed_folder
-                            break
+                    # Search through clients in area with our target char ID
+                    for target in client.area.index.with_char_id(charid_pair):
+                        # Set emote, flip and folder properly
+                        other_emote = target.last_sprite
+                        other_flip = target.flip
+                        other_folder = target.claimed_folder
+                        break
                     # Speaker always goes in front
                     charid_pair = f"{charid_pair}^0"
 
@@ -1336,30 +1419,43 @@ class Area:
             return True
         return not self.server.char_emotes[char].validate(preanim, anim, sfx)
 
+    def music_layers(self):
+        """
+        Get the music lists making up this area's music, bottom one first.
+        :returns: list of MusicLists
+        """
+        # Server music list
+        layers = [self.server.music_list]
+
+        # Hub music list
+        if (
+            self.area_manager.music_ref != ""
+            and len(self.area_manager.music_list) > 0
+        ):
+            if self.area_manager.replace_music:
+                layers = [self.area_manager.music_list]
+            else:
+                layers.append(self.area_manager.music_list)
+
+        # Area music list
+        if (
+            self.music_ref != ""
+            and self.music_ref != self.area_manager.music_ref
+            and len(self.music_list) > 0
+        ):
+            if self.replace_music:
+                layers = [self.music_list]
+            else:
+                layers.append(self.music_list)
+        return layers
+
     def clear_music(self):
-        self.music_list.clear()
+        self.music_list = EMPTY
         self.music_ref = ""
 
     def load_music(self, path):
         try:
-            with open(path, "r", encoding="utf-8") as stream:
-                music_list = yaml.safe_load(stream)
-
-            prepath = ""
-            for item in music_list:
-                # deprecated, use 'replace_music' area pref instead
-                # if 'replace' in item:
-                #     self.replace_music = item['replace'] is True
-                if "use_unique_folder" in item and item["use_unique_folder"] is True:
-                    prepath = os.path.splitext(os.path.basename(path))[0] + "/"
-
-                if "category" not in item:
-                    continue
-
-                if "songs" in item:
-                    for song in item["songs"]:
-                        song["name"] = prepath + song["name"]
-            self.music_list = music_list
+            self.music_list = self.server.music_catalog.load(path)
         except ValueError:
             raise
         except AreaError:
@@ -1416,30 +1512,7 @@ class Area:
         if not self.jukebox:
             return
         if len(self.jukebox_votes) == 0:
-            # Server music list
-            song_list = self.server.music_list
-
-            # Hub music list
-            if (
-                self.area_manager.music_ref != ""
-                and len(self.area_manager.music_list) > 0
-            ):
-                if self.area_manager.replace_music:
-                    song_list = self.area_manager.music_list
-                else:
-                    song_list = song_list + self.area_manager.music_list
-
-            # Area music list
-            if (
-                self.music_ref != ""
-                and self.music_ref != self.area_manager.music_ref
-                and len(self.music_list) > 0
-            ):
-                if self.replace_music:
-                    song_list = self.music_list
-                else:
-                    song_list = song_list + self.music_list
-
+            song_list = self.server.music_catalog.compose(self.music_layers())
             songs = []
             for c in song_list:
                 if "category" in c:
@@ -1548,7 +1621,7 @@ class Area:
         if length <= 0:  # Length not defined
             length = 120.0  # Play each song for at least 2 minutes
 
-        self.music_looper = asyncio.get_running_loop().call_later(
+        self.music_looper = self.server.timers.call_later(
             max(5, length), lambda: self.start_jukebox()
         )
 
@@ -1719,7 +1792,7 @@ class Area:
         LE#<name>&<desc>&<img>#<name>
         """
         for client in self.clients:
-            client.send_command("LE", *self.get_evidence_list(client))
+            self.server.ui_sync.mark_evidence(client)
 
     def get_owners(self):
         """
@@ -1738,6 +1811,7 @@ class Area:
         Add a CM to the area.
         """
         self._owners.add(client)
+        client.owned_areas.add(self)
 
         # Make sure the client's available areas are updated
         self.broadcast_area_list(client)
@@ -1756,6 +1830,7 @@ class Area:
         Remove a CM from the area.
         """
         self._owners.remove(client)
+        client.owned_areas.discard(self)
         if not dc and len(client.broadcast_list) > 0:
             client.broadcast_list.clear()
             client.send_ooc("Your broadcast list has been cleared.")
@@ -1790,27 +1865,12 @@ class Area:
 
     def broadcast_area_list(self, client=None, refresh=False):
         """
-        Send the accessible and visible areas to the client.
+        Send the accessible and visible areas to the client, or everyone in
+        the area, at the end of the loop iteration. See UISync.
         """
-        clients = []
-        if client is None:
-            clients = list(self.clients)
-        else:
-            clients.append(client)
-
-        update_clients = []
+        clients = self.clients if client is None else (client,)
         for c in clients:
-            allowed = c.is_mod or c in self.owners
-            area_list = c.get_area_list(allowed, allowed)
-            if refresh or c.local_area_list != area_list:
-                update_clients.append(c)
-                c.reload_area_list(area_list)
-
-        # Update ARUP information only for those that need it
-        if len(update_clients) > 0:
-            self.area_manager.send_arup_status(update_clients)
-            self.area_manager.send_arup_lock(update_clients)
-            self.area_manager.send_arup_cms(update_clients)
+            self.server.ui_sync.mark_area_list(c, refresh)
 
     def time_until_move(self, client):
         """
@@ -1831,13 +1891,12 @@ class Area:
     @property
     def minigame_time_left(self):
         """Time left on the currently running minigame."""
-        if not self.minigame_schedule or self.minigame_schedule.cancelled():
+        if not self.minigame_timer.started:
             return 0
-        return self.minigame_schedule.when() - asyncio.get_running_loop().time()
+        return self.minigame_timer.remaining()
 
     def end_minigame(self, reason=""):
-        if self.minigame_schedule:
-            self.minigame_schedule.cancel()
+        self.minigame_timer.unset()
 
         self.muted = self.old_muted
         self.invite_list = self.old_invite_list
@@ -1943,8 +2002,7 @@ class Area:
                 team = "🔴red"
             else:
                 raise AreaError("Target is not part of the minigame!")
-            timeleft = self.minigame_schedule.when() - asyncio.get_running_loop().time()
-            self.minigame_schedule.cancel()
+            timeleft = self.minigame_timer.remaining()
             self.minigame = "Scrum Debate"
             timer = timeleft + self.scrum_debate_added_time
             self.broadcast_ooc(
@@ -2013,9 +2071,7 @@ class Area:
         # Timer ID 2 is used
         self.send_command("TI", 2, 2)
         self.send_command("TI", 2, 0, timer * 1000)
-        self.minigame_schedule = asyncio.get_running_loop().call_later(
-            timer, lambda: self.end_minigame("Timer expired!")
-        )
+        self.minigame_timer.run(timer)
 
         us = f"🔴[{client.id}] {client.showname} (Red)"
         them = f"🔵[{target.id}] {target.showname} (Blue)"
@@ -2061,7 +2117,7 @@ class Area:
         # It's a wait packet
         if header == "wait":
             secs = float(args[0]) / 1000
-            self.demo_schedule = asyncio.get_running_loop().call_later(
+            self.demo_schedule = self.server.timers.call_later(
                 secs, lambda: self.play_demo(client)
             )
             return
@@ -17,14 +17,19 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-from server import commands
+from server import arup, commands
 from server.exceptions import ClientError, AreaError, ArgumentError, ServerError
 from server.area import Area
+from server.countdown import Countdown
+from server.population import Population
+from server.link_graph import LinkGraph
+from server.name_index import NameIndex
+from server.music_catalog import EMPTY
 from collections import OrderedDict
+from operator import attrgetter
 
 import oyaml as yaml  # ordered yaml
 import os
-import datetime
 import logging
 
 logger = logging.getLogger("events")
@@ -33,37 +38,21 @@ logger = logging.getLogger("events")
 class AreaManager:
     """Holds the list of all areas."""
 
-    class Timer:
+    class Timer(Countdown):
         """Represents a single instance of a timer in the area."""
 
-        def __init__(
-            self,
-            Set=False,
-            started=False,
-            static=None,
-            target=None,
-            hub=None,
-            caller=None,
-        ):
-            self.set = Set
-            self.started = started
-            self.static = static
-            self.target = target
+        def __init__(self, wheel, hub=None, caller=None):
+            # Timer ID 0 is reserved for hubs
+            super().__init__(wheel, 0)
             self.hub = hub
             self.caller = caller
-            self.schedule = None
             self.commands = []
 
         def timer_expired(self):
-            if self.schedule:
-                self.schedule.cancel()
             # the hub was destroyed at some point
             if self.hub is None or self is None:
                 return
 
-            self.static = datetime.timedelta(0)
-            self.started = False
-
             self.hub.broadcast_ooc("Timer 0 has expired.")
             self.call_commands()
 
@@ -103,11 +92,21 @@ class AreaManager:
 
     def __init__(self, hub_manager, name):
         self.hub_manager = hub_manager
+        # Sum of the populations of every area
+        self.population = Population()
+        # Clients in any of the areas
+        self.members = set()
+        self.arup = arup.Arup(self)
+        self.link_graph = LinkGraph(self)
         self.areas = []
+        self.area_names = NameIndex()
         self.owners = set()
+        # Index in the HubManager's hubs, set by HubManager.add_hub
+        self._id = -1
 
         # prefs
         self._name = name
+        self._abbreviation = ""
         self.abbreviation = self.abbreviate()
         self.move_delay = 0
         self.arup_enabled = True
@@ -130,7 +129,7 @@ class AreaManager:
         self.o_name = self._name
         self.o_abbreviation = self.abbreviation
 
-        self.music_list = []
+        self.music_list = EMPTY
 
         # Save character information for character select screen ID's in the hub data
         # ex. {"1": {"keys": [1, 2, 3, 5], "fatigue": 100.0, "hunger": 34.0}, "2": {"keys": [4, 6, 8]}}
@@ -143,7 +142,7 @@ class AreaManager:
         # Subtheme for this hub
         self.subtheme = ""
 
-        self.timer = self.Timer()
+        self.timer = self.Timer(self.server.timers)
 
     @property
     def name(self):
@@ -152,16 +151,35 @@ class AreaManager:
 
     @name.setter
     def name(self, value):
+        old = self._name
         self._name = value.strip()
         while "<num>" in self._name or "<percent>" in self._name:
             self._name = self._name.replace(
                 "<num>", "").replace("<percent>", "")
+        self.hub_manager.hub_names.renamed(self, old, self._name)
         self.abbreviation = self.abbreviate()
 
+    @property
+    def abbreviation(self):
+        """Hub's abbreviation, can be set apart from the name."""
+        return self._abbreviation
+
+    @abbreviation.setter
+    def abbreviation(self, value):
+        old = self._abbreviation
+        self._abbreviation = value
+        self.hub_manager.hub_names.reabbreviated(self, old, value)
+
     @property
     def id(self):
         """Get area's index in the HubManager's 'hubs' list."""
-        return self.hub_manager.hubs.index(self)
+        return self._id
+
+    def renumber(self):
+        """Give the areas their IDs again after the area list changed."""
+        for i, area in enumerate(self.areas):
+            area._id = i
+        self.link_graph.invalidate()
 
     @property
     def server(self):
@@ -170,10 +188,15 @@ class AreaManager:
 
     @property
     def clients(self):
-        clients = set()
-        for area in self.areas:
-            clients = clients | area.clients
-        return clients
+        """Copy of the clients in any of the areas, safe to change areas while going through."""
+        return set(self.members)
+
+    @property
+    def count(self):
+        """Players shown next to the hub in the hub list."""
+        return sum(
+            area.population.visible for area in self.areas if not area.hide_clients
+        )
 
     def abbreviate(self):
         """Abbreviate our name."""
@@ -275,7 +298,9 @@ class AreaManager:
                 client.char_select()
 
     def send_characters(self, client):
-        client.send_command("SC", *self.char_list)
+        char_list = self.char_list
+        client.send_cached(("SC", id(char_list)), "SC",
+                           lambda: char_list, char_list, skippable=True)
 
     def is_valid_char_id(self, char_id):
         """
@@ -332,7 +357,7 @@ class AreaManager:
         return hub
 
     def clear_music(self):
-        self.music_list.clear()
+        self.music_list = EMPTY
         self.music_ref = ""
         self.replace_music = False
 
@@ -341,24 +366,7 @@ class AreaManager:
             if not os.path.isfile(path):
                 raise AreaError(
                     f"Hub {self.name} trying to load music list: File path {path} is invalid!")
-            with open(path, "r", encoding="utf-8") as stream:
-                music_list = yaml.safe_load(stream)
-
-            prepath = ""
-            for item in music_list:
-                # deprecated, use 'replace_music' hub pref instead
-                # if 'replace' in item:
-                #    self.replace_music = item['replace'] is True
-                if "use_unique_folder" in item and item["use_unique_folder"] is True:
-                    prepath = os.path.splitext(os.path.basename(path))[0] + "/"
-
-                if "category" not in item:
-                    continue
-
-                if "songs" in item:
-                    for song in item["songs"]:
-                        song["name"] = prepath + song["name"]
-            self.music_list = music_list
+            self.music_list = self.server.music_catalog.load(path)
         except ValueError:
             raise
         except AreaError:
@@ -440,6 +448,9 @@ class AreaManager:
             raise AreaError(f"Area limit reached! ({self.max_areas})")
         area = Area(self, f"Area {idx}")
         self.areas.append(area)
+        self.area_names.add(area)
+        area._id = idx
+        self.link_graph.invalidate()
         return area
 
     def remove_area(self, area):
@@ -472,6 +483,9 @@ class AreaManager:
                 elif link == str(area.id):
                     del ar.links[link]
         self.areas.remove(area)
+        self.area_names.remove(area)
+        area._id = -1
+        self.renumber()
 
     def swap_area(self, area1, area2, fix_links=True):
         """
@@ -490,6 +504,7 @@ class AreaManager:
 
         # Swap 'em good
         self.areas[a], self.areas[b] = self.areas[b], self.areas[a]
+        self.renumber()
 
         if fix_links:
             # Turn indexes to string
@@ -567,33 +582,49 @@ class AreaManager:
 
     def get_area_by_name(self, name, case_sensitive=False):
         """Get an area by name."""
-        for area in self.areas:
-            a_name = area.name.lower() if case_sensitive else area.name
-            name = name.lower() if case_sensitive else name
-            if a_name == name:
+        for area in self.area_names.named(name):
+            # case_sensitive has always meant the opposite of its name
+            if case_sensitive or area.name == name:
                 return area
         raise AreaError("Area not found.")
 
     def get_area_by_id(self, num):
         """Get an area by ID."""
-        for area in self.areas:
-            if area.id == num:
-                return area
+        if isinstance(num, int) and 0 <= num < len(self.areas):
+            return self.areas[num]
         raise AreaError("Area not found.")
 
+    def find_area(self, arg):
+        """
+        Find the area meant by "[id]", a name, an abbreviation or an ID.
+        :param arg: what was typed
+        :returns: matching area, the one with the lowest ID if there's several
+        """
+        found = self.area_names.named(arg) + self.area_names.abbreviated(arg)
+        a = arg.split(" ")[0]
+        aid = a.strip("[]")
+        if a.startswith("[") and a.endswith("]") and aid.isdigit():
+            found.append(self.areas[int(aid)] if int(aid) < len(self.areas) else None)
+        if arg.isdigit():
+            found.append(self.areas[int(arg)] if int(arg) < len(self.areas) else None)
+        found = [area for area in found if area is not None]
+        if len(found) == 0:
+            raise AreaError("Targeted area not found!")
+        return min(found, key=attrgetter("id"))
+
     def get_area_by_abbreviation(self, abbr):
         """Get an area by abbreviation."""
-        for area in self.areas:
-            if area.abbreviation == abbr:
-                return area
+        for area in self.area_names.abbreviated(abbr):
+            return area
         raise AreaError("Area not found.")
 
     def send_command(self, cmd, *args):
         """
         Broadcast an AO-compatible command to all areas and all clients in those areas.
         """
-        for area in self.areas:
-            area.send_command(cmd, *args)
+        self.server.client_manager.broadcast(
+            [c for area in self.areas for c in area.clients], cmd, *args
+        )
 
     def send_remote_command(self, area_list, cmd, *args):
         """
@@ -614,87 +645,20 @@ class AreaManager:
 
     def broadcast_ooc(self, msg):
         """Broadcast an OOC message to all areas in this hub."""
-        for area in self.areas:
-            area.send_command("CT", area.server.config["hostname"], msg, "1")
+        self.send_command("CT", self.server.config["hostname"], msg, "1")
 
     def send_arup_players(self, clients=None):
         """Broadcast ARUP packet containing player counts."""
-        if not self.arup_enabled:
-            return
-        players_list = [0]
-        if len(self.server.hub_manager.hubs) > 1:
-            players_list = [0, -1]
-        if clients is None:
-            clients = self.clients
-        for client in clients:
-            for area in client.local_area_list:
-                playercount = -1
-                if not self.hide_clients and not area.hide_clients:
-                    playercount = len(
-                        [c for c in area.clients if not c.hidden])
-                players_list.append(playercount)
-                playerhubcount = 0
-                for area in client.local_area_list:
-                    for c in area.clients:
-                        if (
-                            not self.hide_clients
-                            and not area.hide_clients
-                            and not c.hidden
-                        ):
-                            playerhubcount = playerhubcount + 1
-                if len(self.server.hub_manager.hubs) > 1:
-                    players_list[1] = playerhubcount
-            self.server.send_arup(client, players_list)
+        self.server.ui_sync.mark_arup(self, arup.PLAYERS, clients)
 
     def send_arup_status(self, clients=None):
         """Broadcast ARUP packet containing area statuses."""
-        if not self.arup_enabled:
-            return
-        status_list = [1]
-        if len(self.server.hub_manager.hubs) > 1:
-            status_list = [1, "GAMING"]
-        if clients is None:
-            clients = self.clients
-        for client in clients:
-            for area in client.local_area_list:
-                status = area.status
-                if status == "IDLE":
-                    status = ""
-                status_list.append(status)
-            self.server.send_arup(client, status_list)
+        self.server.ui_sync.mark_arup(self, arup.STATUS, clients)
 
     def send_arup_cms(self, clients=None):
         """Broadcast ARUP packet containing area CMs."""
-        if not self.arup_enabled:
-            return
-        cms_list = [2]
-        if len(self.server.hub_manager.hubs) > 1:
-            cms_list = [2, "Double-Click for Hubs"]
-        if clients is None:
-            clients = self.clients
-        for client in clients:
-            for area in client.local_area_list:
-                cm = ""
-                if len(area.owners) > 0:
-                    cm = area.get_owners()
-                cms_list.append(cm)
-            self.server.send_arup(client, cms_list)
+        self.server.ui_sync.mark_arup(self, arup.CMS, clients)
 
     def send_arup_lock(self, clients=None):
         """Broadcast ARUP packet containing the lock status of each area."""
-        if not self.arup_enabled:
-            return
-        lock_list = [3]
-        if len(self.server.hub_manager.hubs) > 1:
-            lock_list = [3, ""]
-        if clients is None:
-            clients = self.clients
-        for client in clients:
-            for area in client.local_area_list:
-                state = ""
-                if area.locked:
-                    state = "LOCKED"
-                elif area.muted:
-                    state = "SPECTATABLE"
-                lock_list.append(state)
-            self.server.send_arup(client, lock_list)
+        self.server.ui_sync.mark_arup(self, arup.LOCK, clients)
@@ -0,0 +1,121 @@
+# KFO-Server, an Attorney Online server
+#
+# Copyright (C) 2020 Crystalwarrior <varsash@gmail.com>
+#
+# Derivative of tsuserver3, an Attorney Online server. Copyright (C) 2016 argoneus <argoneuscze@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+# ARUP types, see TsuServer3.send_arup
+PLAYERS, STATUS, CMS, LOCK = range(4)
+
+# What goes between the type and the areas when there's more than one hub,
+# standing in for the hub entry at the top of the area list. Player counts
+# put the sum of the areas there instead.
+HUB_FIELDS = {PLAYERS: None, STATUS: "GAMING", CMS: "Double-Click for Hubs", LOCK: ""}
+
+
+class Arup:
+    """Builds and sends the ARUP packets of a hub.
+
+    Every area's field is rendered once per update, and every distinct area
+    list once, so an update costs about as much as the areas plus the
+    clients no matter how many of them share a list. Clients are only sent
+    the types whose contents changed since they last got them.
+    """
+
+    def __init__(self, hub):
+        """
+        :param hub: AreaManager to build the packets of
+        """
+        self.hub = hub
+
+    def field(self, kind, area):
+        """
+        Render what an area shows for one ARUP type.
+        :param kind: PLAYERS, STATUS, CMS or LOCK
+        :param area: area to render
+        """
+        if kind == PLAYERS:
+            if self.hub.hide_clients or area.hide_clients:
+                return -1
+            return area.population.visible
+        if kind == STATUS:
+            return "" if area.status == "IDLE" else area.status
+        if kind == CMS:
+            return area.get_owners() if len(area.owners) > 0 else ""
+        if area.locked:
+            return "LOCKED"
+        if area.muted:
+            return "SPECTATABLE"
+        return ""
+
+    def vector(self, kind, areas, fields):
+        """
+        Build the arguments of an ARUP packet.
+        :param kind: ARUP type
+        :param areas: area list of the client it's for
+        :param fields: area -> rendered field, filled in as needed
+        :returns: tuple
+        """
+        values = []
+        for area in areas:
+            value = fields.get(area)
+            if value is None:
+                value = fields[area] = self.field(kind, area)
+            values.append(value)
+        if len(self.hub.server.hub_manager.hubs) <= 1:
+            return (kind, *values)
+        header = HUB_FIELDS[kind]
+        if kind == PLAYERS:
+            header = sum(v for v in values if v != -1)
+        return (kind, header, *values)
+
+    def send(self, kind, clients=None):
+        """
+        Send an ARUP type to clients whose copy of it is out of date.
+        :param kind: ARUP type
+        :param clients: clients to update, everyone in the hub by default
+        """
+        hub = self.hub
+        if not hub.arup_enabled:
+            return
+        if clients is None:
+            clients = hub.members
+        fields = {}
+        # area list -> (vector, clients to send it to)
+        groups = {}
+        skipped = 0
+        for client in clients:
+            key = tuple(client.local_area_list)
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = (self.vector(kind, key, fields), [])
+            vector = group[0]
+            sent = client.arup_sent
+            if sent is None:
+                sent = client.arup_sent = [None] * 4
+            elif sent[kind] == vector:
+                skipped += 1
+                continue
+            sent[kind] = vector
+            group[1].append(client)
+        broadcast = hub.server.client_manager.broadcast
+        for vector, targets in groups.values():
+            # A type with nothing after it isn't worth sending
+            if targets and len(vector) > 1:
+                broadcast(targets, "ARUP", *vector)
+        if skipped > 0:
+            hub.server.metrics.count("arup.skipped", skipped)
@@ -21,15 +21,24 @@ import re
 import string
 import time
 import math
-import os
 from heapq import heappop, heappush
 
 
 from server import database
-from server.constants import TargetType, encode_ao_packet, contains_URL
+from server.constants import TargetType, compose_ao_command, pack_ao_command, contains_URL
 from server.exceptions import ClientError, AreaError, ServerError
-
-import oyaml as yaml  # ordered yaml
+from server.network.profiles import ClientProfile
+from server.network.outbound import OutboundQueue
+from server.client_registry import ClientRegistry, indexed
+from server.music_catalog import EMPTY
+from server.client_state import (
+    AudioEditing,
+    CasingPrefs,
+    ChatEffects,
+    RemoteListening,
+    grouped,
+    lazy,
+)
 
 
 class ClientManager:
@@ -41,9 +50,116 @@ class ClientManager:
         Clients may only belong to a single area.
         """
 
+        # Looked up through ClientManager.registry
+        hdid = indexed("hdid")
+        ipid = indexed("ipid")
+        name = indexed("name")
+        is_mod = indexed("is_mod")
+        char_id = indexed("char_id", counted=True, local=True)
+        # Looked up through Area.index
+        pos = indexed("pos", registered=False, local=True)
+
+        # Casing stuff
+        casing_cm = grouped("_casing", CasingPrefs, "casing_cm")
+        casing_cases = grouped("_casing", CasingPrefs, "casing_cases")
+        casing_def = grouped("_casing", CasingPrefs, "casing_def")
+        casing_pro = grouped("_casing", CasingPrefs, "casing_pro")
+        casing_jud = grouped("_casing", CasingPrefs, "casing_jud")
+        casing_jur = grouped("_casing", CasingPrefs, "casing_jur")
+        casing_steno = grouped("_casing", CasingPrefs, "casing_steno")
+        case_call_time = grouped("_casing", CasingPrefs, "case_call_time")
+
+        edit_ambience = grouped("_audio_editing", AudioEditing, "edit_ambience")
+        # if we're currently trying to set a song for the minigame
+        editing_minigame_song = grouped(
+            "_audio_editing", AudioEditing, "editing_minigame_song")
+        editing_minigame_song_condition = grouped(
+            "_audio_editing", AudioEditing, "editing_minigame_song_condition")
+
+        remote_listen = grouped(
+            "_remote_listening", RemoteListening, "remote_listen")
+        listen_pos = grouped("_remote_listening", RemoteListening, "listen_pos")
+
+        disemvowel = grouped("_chat_effects", ChatEffects, "disemvowel")
+        shaken = grouped("_chat_effects", ChatEffects, "shaken")
+        # rainbowtext hell
+        rainbow = grouped("_chat_effects", ChatEffects, "rainbow")
+
+        # flood-guard timestamps
+        mus_change_time = lazy(
+            "_mus_change_time",
+            lambda c: c.floodguard_times("music_change_floodguard"))
+        wtce_time = lazy(
+            "_wtce_time", lambda c: c.floodguard_times("wtce_floodguard"))
+        ooc_time = lazy(
+            "_ooc_time", lambda c: c.floodguard_times("ooc_floodguard"))
+
+        # Characters this client is cursed to
+        charcurse = lazy("_charcurse", lambda c: [])
+        # list of areas to broadcast the message, music and judge buttons to
+        broadcast_list = lazy("_broadcast_list", lambda c: [])
+        # Clients following this one around
+        followers = lazy("_followers", lambda c: set())
+        # areas this client is a CM of
+        owned_areas = lazy("_owned_areas", lambda c: set())
+
+        # There can be thousands of clients, so don't give each one a __dict__.
+        # Every attribute needs a slot here, or a descriptor above.
+        __slots__ = (
+            "registry", "counted_in", "is_checked", "transport", "outbound",
+            "id", "area", "server", "mod_profile_name", "is_dj", "can_wtce",
+            "indexed_in", "muted_global", "muted_adverts", "is_muted", "is_ooc_muted",
+            "pm_mute", "mod_call_time", "version", "profile", "charid_pair",
+            "charid_pair_override", "pair_order", "offset_pair", "last_sprite",
+            "flip", "claimed_folder", "mus_counter", "mus_mute_time",
+            "wtce_counter", "wtce_mute_time", "ooc_counter", "ooc_mute_time",
+            "gm_save_time", "last_demo_call", "last_move_time", "autogetarea",
+            "blinded", "hidden_in", "sneaking", "forced_to_follow",
+            "presenting", "narrator", "blankpost", "firstperson",
+            "local_area_list", "local_music_list", "music_ref", "music_list",
+            "replace_music",
+            "viewing_hub_list", "used_showname_command", "subtheme",
+            "playing_audio", "list_hashes", "chars_check_sent", "arup_sent",
+            "timers_synced",
+            # set by /ability_dice, unset until then
+            "ability_dice_set",
+            # backing the properties and indexed attributes
+            "_hdid", "_ipid", "_name", "_is_mod", "_char_id", "_pos",
+            "_following",
+            "_evi_list", "_evi_index", "_showname", "_hidden",
+            # ClientState groups, None until needed
+            "_casing", "_audio_editing", "_remote_listening", "_chat_effects",
+            # lazy attributes, unset until needed
+            "_mus_change_time", "_wtce_time", "_ooc_time", "_charcurse",
+            "_broadcast_list", "_followers", "_owned_areas",
+        )
+
+        @property
+        def following(self):
+            """Client this client follows around, or None."""
+            return self._following
+
+        @following.setter
+        def following(self, target):
+            old = getattr(self, "_following", None)
+            if old is not None:
+                old.followers.discard(self)
+            self._following = target
+            if target is not None:
+                target.followers.add(self)
+
         def __init__(self, server, transport, user_id, ipid):
+            # Set by the ClientRegistry once this client is in it
+            self.registry = None
+            # Population and AreaIndex of the area this client is in, see
+            # Area.new_client
+            self.counted_in = None
+            self.indexed_in = None
             self.is_checked = False
             self.transport = transport
+            self.outbound = OutboundQueue(
+                transport, server.metrics, **server.config["outbound_buffer"]
+            )
             self.hdid = ""
             self.id = user_id
             self.char_id = None
@@ -56,9 +172,6 @@ class ClientManager:
             self.can_wtce = True
             self.pos = ""
             self.evi_list = []
-            self.disemvowel = False
-            self.shaken = False
-            self.charcurse = []
             self.muted_global = False
             self.muted_adverts = False
             self.is_muted = False
@@ -67,6 +180,9 @@ class ClientManager:
             self.mod_call_time = 0
             self.ipid = ipid
             self.version = ""
+            # What this client's software can handle, set once it sends its version
+            self.profile = ClientProfile.get(
+                "", "", server.supported_features)
 
             # Pairing character ID
             self.charid_pair = -1
@@ -81,44 +197,20 @@ class ClientManager:
             self.flip = 0
             self.claimed_folder = ""
 
-            # Casing stuff
-            self.casing_cm = False
-            self.casing_cases = ""
-            self.casing_def = False
-            self.casing_pro = False
-            self.casing_jud = False
-            self.casing_jur = False
-            self.casing_steno = False
-            self.case_call_time = 0
-
-            # flood-guard stuff
+            # Rarely used state, see the ClientState groups
+            self._casing = None
+            self._audio_editing = None
+            self._remote_listening = None
+            self._chat_effects = None
+
+            # flood-guard stuff, the timestamp lists are only made when needed
             self.mus_counter = 0
             self.mus_mute_time = 0
-            self.mus_change_time = [
-                x *
-                self.server.config["music_change_floodguard"]["interval_length"]
-                for x in range(
-                    self.server.config["music_change_floodguard"]["times_per_interval"]
-                )
-            ]
             self.wtce_counter = 0
             self.wtce_mute_time = 0
-            self.wtce_time = [
-                x * self.server.config["wtce_floodguard"]["interval_length"]
-                for x in range(
-                    self.server.config["wtce_floodguard"]["times_per_interval"]
-                )
-            ]
             self.ooc_counter = 0
             self.ooc_mute_time = 0
-            self.ooc_time = [
-                x * self.server.config["ooc_floodguard"]["interval_length"]
-                for x in range(
-                    self.server.config["ooc_floodguard"]["times_per_interval"]
-                )
-            ]
             # security stuff
-            self.clientscon = 0
             self.gm_save_time = 0
             self.last_demo_call = 0
 
@@ -133,25 +225,11 @@ class ClientManager:
             self._hidden = False
             self.hidden_in = None
             self.sneaking = False
-            self.listen_pos = None
             self.following = None
             self.forced_to_follow = False
-            self.edit_ambience = False
-            # if we're currently trying to set a song for the minigame
-            self.editing_minigame_song = ""
-            # 0 = start
-            # 1 = end
-            # 2 = concede
-            self.editing_minigame_song_condition = 0
             # If we are presenting evidence through a command (/evidence_present)
             self.presenting = 0
 
-            # 0 = listen to NONE
-            # 1 = listen to IC
-            # 2 = listen to OOC
-            # 3 = Listen to ALL
-            self.remote_listen = 2
-
             # if True, this char's msg will be narrating over current IC visuals without showing a character (AO2.9.1+)
             self.narrator = False
             # if True, this char's msg will be replaced with ../misc/blank
@@ -161,16 +239,14 @@ class ClientManager:
 
             # a list of all areas the client can currently see
             self.local_area_list = []
-            # a list of all songs the client can currently see
-            self.local_music_list = []
+            # the music the client can currently see, a MusicView once it's sent
+            self.local_music_list = EMPTY
             # reference to the storage/musiclists/ref.yaml for displaying purposes
             self.music_ref = ""
             # a music list that was loaded manually by the client
-            self.music_list = []
+            self.music_list = EMPTY
             # whether or not to replace music list with ours
             self.replace_music = False
-            # list of areas to broadcast the message, music and judge buttons to
-            self.broadcast_list = []
             # Whether we're viewing hub list or not in the A/M area list
             self.viewing_hub_list = False
             # Whether or not the client used the /showname command
@@ -179,30 +255,49 @@ class ClientManager:
             # Currently requested subtheme of this client
             self.subtheme = ""
 
-            # Compatibility stuff
-            # Determine if this client can support multi-layered audio (such as ambience)
-            self.has_multilayer_audio = False
-
             # The currently playing audio for this client. Keeping track so we don't replay the same audio erroneously
             # (such as in the case of music_autoplay areas)
             self.playing_audio = ["", ""]
-            
-            # rainbowtext hell
-            self.rainbow = False
 
-        def send_raw_message(self, msg):
+            # Hashes of the SC and SM this client has, if it opted in to
+            # list caching. See AOProtocol.net_cmd_lh
+            self.list_hashes = None
+            # The last CharsCheck this client got, see Area.flush_chars_check
+            self.chars_check_sent = None
+            # The last ARUP of each type this client got, see Arup.send
+            self.arup_sent = None
+            # (area, loop time) of the last timer sync, see TimerSync.update
+            self.timers_synced = None
+
+        def floodguard_times(self, guard):
+            """
+            Build the list of recent action timestamps for a flood-guard.
+            :param guard: name of the flood-guard section of the config
+            """
+            config = self.server.config[guard]
+            return [
+                x * config["interval_length"]
+                for x in range(config["times_per_interval"])
+            ]
+
+        def send_raw_message(self, msg, command=None):
             """
             Send a raw packet over TCP.
-            :param msg: string to send
+            :param msg: string or UTF-8 bytes to send
+            :param command: command name, decides how the packet is queued
+            if the client falls behind
             """
-            self.transport.write(msg.encode("utf-8"))
+            if isinstance(msg, str):
+                msg = msg.encode("utf-8")
+            self.outbound.write(msg, command)
 
-        def send_command(self, command, *args):
+        def prepare_command(self, command, args):
             """
-            Compose and send an AO-compatible message, with arguments
-            delimited by `#` and ending with `#%`.
+            Adjust a command's arguments to what this client should see.
             :param command: command name
-            :param *args: list of arguments
+            :param args: tuple of arguments
+            :returns: args itself if nothing had to change, a new tuple if
+            it did, or None if the command shouldn't be sent to this client
             """
             if args:
                 # Music packet
@@ -210,7 +305,7 @@ class ClientManager:
                     # If this MC packet is using multilayer audio and the client doesn't support it
                     if args[4] != "" and int(args[4]) > 0 and not self.has_multilayer_audio:
                         # Ignore the packet, don't send the music
-                        return
+                        return None
                     self.playing_audio[args[4]] = args[0]
                 # IC Message packet
                 if command == "MS":
@@ -226,28 +321,65 @@ class ClientManager:
                             if len(self.area.pos_lock) > 0:
                                 lst[5] = self.area.pos_lock[0]
                         args = tuple(lst)
-                    for evi_num in range(len(self.evi_list)):
-                        if self.evi_list[evi_num] == args[11]:
-                            lst = list(args)
-                            lst[11] = evi_num
-                            args = tuple(lst)
-                            break
-                    # If we have someone using the DRO 1.1.0 Client
-                    if self.version.startswith("1.1.0"):
+                    evi_num = self._evi_index.get(args[11])
+                    if evi_num is not None:
                         lst = list(args)
-                        lst[16] = ""  # No video support :(
-                        lst[17] = 0  # no hiding character
-                        lst[18] = self.id  # sender character id
+                        lst[11] = evi_num
                         args = tuple(lst)
-            command, *args = encode_ao_packet([command] + list(args))
-            message = f"{command}#"
-            for arg in args:
-                # Evidence packet uses tuples to construct its evidence entries
-                if type(arg) is tuple:
-                    # AO2 evidence packet uses & to separate pieces of evidence
-                    arg = "&".join(arg)
-                message += f"{arg}#"
-            self.send_raw_message(message + "%")
+                    args = self.profile.adapt_ms(args, self.id)
+            return args
+
+        def send_command(self, command, *args):
+            """
+            Compose and send an AO-compatible message, with arguments
+            delimited by `#` and ending with `#%`.
+            :param command: command name
+            :param *args: list of arguments
+            """
+            args = self.prepare_command(command, args)
+            if args is None:
+                return
+            if self.outbound.text:
+                # WebSocket, don't bother encoding it
+                self.send_raw_message(
+                    compose_ao_command(command, args), command)
+            else:
+                self.send_raw_message(pack_ao_command(command, args), command)
+
+        def send_cached(self, key, command, build, source=None, skippable=False):
+            """
+            Send a packet that's the same for many clients, encoding it only once.
+            See HandshakeCache.payload.
+            :param key: hashable key deciding the packet's contents
+            :param command: command name
+            :param build: called without arguments to get the arguments
+            :param source: object the key was made from the id() of, if any
+            :param skippable: leave the packet out if the client opted in to
+            list caching and already has it, see AOProtocol.net_cmd_lh
+            """
+            cache = self.server.handshake_cache
+            payload = cache.payload(
+                key, command, build, source, self.outbound.text)
+            if skippable and self.list_hashes is not None:
+                digest = cache.digest(key)
+                self.send_command("LH", command, digest)
+                if self.list_hashes.get(command) == digest:
+                    saved = cache.size(key) - len(f"LH#{command}#{digest}#%")
+                    self.server.metrics.count("handshake.lists_skipped")
+                    self.server.metrics.count("handshake.bytes_saved", saved)
+                    return
+                # From now on this is the one the client has
+                self.list_hashes[command] = digest
+            self.send_raw_message(payload, command)
+
+        def send_feature_list(self, arup):
+            """
+            Tell the client which features the server supports.
+            :param arup: whether the ARUP area list is in use
+            """
+            features = self.profile.feature_list(arup)
+            self.send_cached(("FL", id(features)), "FL",
+                             lambda: features, features)
 
         def send_ooc(self, msg):
             """
@@ -290,7 +422,7 @@ class ClientManager:
                 return False
             if not set(name_ws).issubset(printset):  # illegal chars in ooc name
                 return False
-            for client in self.server.client_manager.clients:
+            for client in self.server.client_manager.registry.with_name(name):
                 # Unless they're our multiclient, we may only have a unique name
                 if self.ipid != client.ipid and client.name == name:
                     return False
@@ -298,7 +430,7 @@ class ClientManager:
 
         def disconnect(self):
             """Disconnect the client gracefully."""
-            self.transport.close()
+            self.outbound.close()
 
         def change_character(self, char_id, force=False):
             """
@@ -314,15 +446,14 @@ class ClientManager:
                 if not self.area.area_manager.is_valid_char_id(char_id):
                     raise ClientError("Invalid character ID.")
                 if not self.is_mod and self not in self.area.owners:
-                    if len(self.charcurse) > 0:
+                    if self.charcursed:
                         if char_id not in self.charcurse:
                             raise ClientError("Character not available.")
                         force = True
                     if not self.area.is_char_available(char_id):
                         if force:
-                            for client in self.area.clients:
-                                if client.char_id == char_id:
-                                    client.char_select()
+                            for client in list(self.area.index.with_char_id(char_id)):
+                                client.char_select()
                         else:
                             raise ClientError("Character not available.")
             # We're trying to spectate out of our own accord and either hub or area does not allow spectating.
@@ -342,9 +473,8 @@ class ClientManager:
             self.char_id = char_id
             self.pos = ""
             self.send_command("PV", self.id, "CID", self.char_id)
-            # Commented out due to potentially causing clientside lag...
-            # self.area.send_command('CharsCheck',
-            #                        *self.get_available_char_list())
+            # Update everyone's available characters list
+            self.area.broadcast_chars_check()
             if arup:
                 self.area.area_manager.send_arup_players()
             new_char = self.char_name
@@ -416,14 +546,15 @@ class ClientManager:
                 .replace("<dollar>", "$") \
                 .replace("<and>", "&")
             try:
+                music_list = self.construct_music_list()
                 if song == "~stop.mp3" or self.server.get_song_is_category(
-                    self.construct_music_list(), song
+                    music_list, song
                 ):
                     name, length = "~stop.mp3", 0
                 else:
                     try:
                         name, length = self.server.get_song_data(
-                            self.construct_music_list(), song
+                            music_list, song
                         )
                     except ServerError:
                         if self.is_mod or self in self.area.owners:
@@ -479,7 +610,7 @@ class ClientManager:
                             )
                             continue
                         else:
-                            self.edit_ambinece = False
+                            self.edit_ambience = False
                     elif self.editing_minigame_song != "":
                         if self.is_mod or self in area.owners:
                             condition_str = ""
@@ -639,30 +770,12 @@ class ClientManager:
 
         def clear_music(self):
             self.music_ref = ""
-            self.music_list.clear()
+            self.music_list = EMPTY
 
         def load_music(self, path):
             """Load a music list from a path. Use it for the local music list and reload it."""
-            # TODO: Move the musiclist parsing function to tsuserver3.py or something
             try:
-                with open(path, "r", encoding="utf-8") as stream:
-                    music_list = yaml.safe_load(stream)
-
-                prepath = ""
-                for item in music_list:
-                    if (
-                        "use_unique_folder" in item
-                        and item["use_unique_folder"] is True
-                    ):
-                        prepath = os.path.splitext(
-                            os.path.basename(path))[0] + "/"
-
-                    if "category" not in item:
-                        continue
-
-                    for song in item["songs"]:
-                        song["name"] = prepath + song["name"]
-                self.music_list = music_list
+                self.music_list = self.server.music_catalog.load(path)
             except ValueError:
                 raise
             except AreaError:
@@ -671,31 +784,9 @@ class ClientManager:
         def construct_music_list(self):
             """
             Obtain the most relevant music list for the client.
-            :param client_music: when True, include the client's music in the equation.
+            :returns: MusicView of the server, hub, area and client music lists
             """
-            # Server music list
-            song_list = self.server.music_list
-
-            # Hub music list
-            if (
-                self.area.area_manager.music_ref != ""
-                and len(self.area.area_manager.music_list) > 0
-            ):
-                if self.area.area_manager.replace_music:
-                    song_list = self.area.area_manager.music_list
-                else:
-                    song_list = song_list + self.area.area_manager.music_list
-
-            # Area music list
-            if (
-                self.area.music_ref != ""
-                and self.area.music_ref != self.area.area_manager.music_ref
-                and len(self.area.music_list) > 0
-            ):
-                if self.area.replace_music:
-                    song_list = self.area.music_list
-                else:
-                    song_list = song_list + self.area.music_list
+            layers = self.area.music_layers()
 
             # Client music list
             if (
@@ -709,21 +800,26 @@ class ClientManager:
                 and len(self.music_list) > 0
             ):
                 if self.replace_music:
-                    song_list = self.music_list
+                    layers = [self.music_list]
                 else:
-                    song_list = song_list + self.music_list
+                    layers.append(self.music_list)
 
-            return song_list
+            return self.server.music_catalog.compose(layers)
 
         def refresh_music(self):
             """
             Rebuild the client's music list, updating the local music list if there was a change.
             """
             song_list = self.construct_music_list()
-            if self.local_music_list != song_list:
-                self.reload_music_list(song_list)
+            if self.local_music_list.version == song_list.version:
+                return
+            if self.local_music_list.names == song_list.names:
+                # Different lists, same songs
+                self.local_music_list = song_list
+                return
+            self.reload_music_list(song_list)
 
-        def reload_music_list(self, music=[]):
+        def reload_music_list(self, music=EMPTY):
             """
             Rebuild the music list with the provided array, or the server music list as a whole.
             """
@@ -739,6 +835,20 @@ class ClientManager:
             # KEEP THE ASTERISK
             self.send_command("FM", *song_list)
 
+        def sync_area_list(self, refresh=False):
+            """
+            Send the client its area list if it changed.
+            :param refresh: send it even if it didn't
+            :returns: whether it was sent
+            """
+            allowed = self.is_mod or self in self.area.owners
+            area_list = self.get_area_list(allowed, allowed)
+            if not refresh and (self.local_area_list is area_list
+                                or self.local_area_list == area_list):
+                return False
+            self.reload_area_list(area_list)
+            return True
+
         def reload_area_list(self, areas=[]):
             """
             Rebuild the area list according to provided areas list.
@@ -762,6 +872,8 @@ class ClientManager:
                     area_list.append(a)
 
             self.local_area_list = areas
+            # FA clears the ARUP info of the client
+            self.arup_sent = None
             # If we're currently viewing hub list, just update our local area list
             if self.viewing_hub_list:
                 return
@@ -813,30 +925,10 @@ class ClientManager:
             self.area.broadcast_area_list(self)
 
             self.area.area_manager.send_arup_players()
+            self.server.ui_sync.mark_hub_list()
 
-            for hub in self.server.hub_manager.hubs:
-                count = 0
-                for c in hub.clients:
-                    if not c.area.hide_clients and not c.hidden:
-                        count = count + 1
-                hub.count = count
-            for c in self.server.client_manager.clients:
-                if c.viewing_hub_list:
-                    c.send_command(
-                        "FA",
-                        *[
-                            "🌐 Hubs 🌐\n Double-Click me to see Areas\n  _______",
-                            *[
-                                f"[{hub.id}] {hub.name} (users: {hub.count})"
-                                for hub in self.server.hub_manager.hubs
-                            ],
-                        ],
-                    )
-
-            # Update everyone's available characters list
-            # Commented out due to potentially causing clientside lag...
-            # self.area.send_command('CharsCheck',
-            #                        *self.get_available_char_list())
+            # Update everyone's available characters list, including ours
+            self.area.broadcast_chars_check()
             # Get defense HP bar
             self.send_command("HP", 1, self.area.hp_def)
             # Get prosecution HP bar
@@ -852,10 +944,10 @@ class ClientManager:
                 # set that juicy pos dropdown
                 self.send_command("SD", "*".join(self.area.pos_lock))
             # Send the evidence information
-            self.send_command("LE", *self.area.get_evidence_list(self))
+            self.server.ui_sync.mark_evidence(self)
             # Update our judge buttons
             self.area.update_judge_buttons(self)
-            self.refresh_music()
+            self.server.ui_sync.mark_music(self)
             msg = f"🚶Changed to area: {self.get_area_info(self.area.id)}"
             if self.area.desc != "" and not self.blinded:
                 desc = self.area.desc[:128]
@@ -878,16 +970,8 @@ class ClientManager:
             self.area.trigger("join", self)
 
         def can_access_area(self, area):
-            return (
-                self.area == area
-                or len(self.area.links) <= 0
-                or (
-                    str(area.id) in self.area.links
-                    and (
-                        len(self.area.links[str(area.id)]["evidence"]) <= 0
-                        or self.hidden_in in self.area.links[str(area.id)]["evidence"]
-                    )
-                )
+            return self.area.area_manager.link_graph.can_access(
+                self.area, area, self.hidden_in
             )
 
         def try_access_area(self, area, peek=False):
@@ -899,21 +983,19 @@ class ClientManager:
                 raise ClientError("Current area is locked!")
 
             if len(self.area.links) > 0:
-                if str(area.id) not in self.area.links:
+                link = self.area.area_manager.link_graph.get_link(self.area, area)
+                if link is None:
                     raise ClientError("Area is inaccessible!")
+                # Link requires us to be inside a piece of evidence
+                if len(link["evidence"]) > 0:
+                    if self.hidden_in not in link["evidence"]:
+                        raise ClientError("Area is inaccessible!")
+                # Our path is locked :(
+                if link["locked"]:
+                    raise ClientError("Path is locked!")
 
-                if str(area.id) in self.area.links:
-                    link = self.area.links[str(area.id)]
-                    # Link requires us to be inside a piece of evidence
-                    if len(link["evidence"]) > 0:
-                        if self.hidden_in not in link["evidence"]:
-                            raise ClientError("Area is inaccessible!")
-                    # Our path is locked :(
-                    if link["locked"]:
-                        raise ClientError("Path is locked!")
-
-                    if peek and not link["can_peek"]:
-                        raise ClientError("Can't peek through this path!")
+                if peek and not link["can_peek"]:
+                    raise ClientError("Can't peek through this path!")
 
             if area.locked and self.id not in area.invite_list:
                 raise ClientError("Area is locked!")
@@ -963,11 +1045,11 @@ class ClientManager:
                         f"Failed to enter [{area.id}] {area.name}: {ex}")
                     return
 
+                link = self.area.area_manager.link_graph.get_link(self.area, area)
                 if (area.password != "" and password != area.password) or (
-                    len(self.area.links) > 0
-                    and str(area.id) in self.area.links
-                    and self.area.links[str(area.id)]["password"] != ""
-                    and password != self.area.links[str(area.id)]["password"]
+                    link is not None
+                    and link["password"] != ""
+                    and password != link["password"]
                 ):
                     raise ClientError(
                         f"Failed to enter [{area.id}] {area.name}: Incorrect password! Use /pw <id> [password]"
@@ -988,15 +1070,13 @@ class ClientManager:
                 )
 
             target_pos = ""
-            if len(self.area.links) > 0:
-                if str(area.id) in self.area.links:
-                    # Get that link reference
-                    link = self.area.links[str(area.id)]
-
-                    if self.hidden_in in link["evidence"]:
-                        self.hide(False, hidden=True)
+            # Get that link reference
+            link = self.area.area_manager.link_graph.get_link(self.area, area)
+            if link is not None:
+                if self.hidden_in in link["evidence"]:
+                    self.hide(False, hidden=True)
 
-                    target_pos = link["target_pos"]
+                target_pos = link["target_pos"]
 
             if self.hidden_in is not None:
                 # You gotta unhide first lol
@@ -1163,31 +1243,16 @@ class ClientManager:
                 )
 
         def get_area_list(self, hidden=False, unlinked=False):
-            area_list = []
-            for area in self.area.area_manager.areas:
-                if self.area != area:
-                    if not hidden and area.hidden:
-                        continue
-                    if len(self.area.links) > 0:
-                        if not (str(area.id) in self.area.links):
-                            if not unlinked:
-                                continue
-                        if (
-                            not hidden
-                            and self.area.links[str(area.id)]["hidden"] is True
-                        ):
-                            continue
-                        if (
-                            not hidden
-                            and len(self.area.links[str(area.id)]["evidence"]) > 0
-                            and self.hidden_in
-                            not in self.area.links[str(area.id)]["evidence"]
-                        ):
-                            continue
-
-                area_list.append(area)
-
-            return area_list
+            """
+            Get the areas the client can see from its area.
+            :param hidden: include hidden areas and links
+            :param unlinked: include areas there's no link to
+            Mods and CMs get both at once, so either one shows everything.
+            :returns: tuple of areas, shared, don't change it
+            """
+            return self.area.area_manager.link_graph.visible_from(
+                self.area, hidden or unlinked, self.hidden_in
+            )
 
         def check_char_taken(self, area):
             try:
@@ -1226,12 +1291,8 @@ class ClientManager:
                 owner = f"[CM(s): {area.get_owners()}]"
             hidden = "📦" if area.hidden else ""
             locked = "🔒" if area.locked else ""
-            pathlocked = (
-                "🚧"
-                if str(area.id) in self.area.links
-                and self.area.links[str(area.id)]["locked"]
-                else ""
-            )
+            link = self.area.area_manager.link_graph.get_link(self.area, area)
+            pathlocked = "🚧" if link is not None and link["locked"] else ""
             passworded = "🔑" if area.password != "" else ""
             muted = "🔇" if area.muted else ""
             dark = "🌑" if area.dark else ""
@@ -1248,8 +1309,7 @@ class ClientManager:
                     users = ''
                 else:
                     # We exclude hidden players here because we don't want them to count for the user count
-                    player_list = [c for c in area.clients if not c.hidden]
-                    users = f' (users: {len(player_list)}) '
+                    users = f' (users: {area.population.visible}) '
                 if area.hidden:
                     return ""
             else:
@@ -1415,7 +1475,7 @@ class ClientManager:
                     msg += " ◽ "
                 else:
                     msg += " ◾ "
-                msg += f"[{hub.id}] {hub.name} (users: {len([c for c in hub.clients if not c.hidden])}) GM(s): {owner}"
+                msg += f"[{hub.id}] {hub.name} (users: {hub.population.visible}) GM(s): {owner}"
             self.send_ooc(msg)
 
         def send_done(self):
@@ -1424,8 +1484,26 @@ class ClientManager:
             This unconditionally causes the client to show the character
             selection screen, even if the client has already joined.
             """
+            old_char_id = self.char_id
             self.char_id = -1
-            self.send_command("CharsCheck", *self.get_available_char_list())
+            if old_char_id is not None and old_char_id >= 0:
+                # Let everyone else know the character is free again
+                self.area.broadcast_chars_check()
+            if self.charcursed:
+                self.chars_check_sent = tuple(self.get_available_char_list())
+                self.send_command("CharsCheck", *self.chars_check_sent)
+            else:
+                # Everyone in the area without a charcurse sees the same
+                char_list = self.area.area_manager.char_list
+                self.chars_check_sent = self.area.occupancy.chars_check(
+                    len(char_list))
+                self.send_cached(
+                    ("CharsCheck", self.area, self.area.occupancy.version,
+                     id(char_list)),
+                    "CharsCheck",
+                    self.get_available_char_list,
+                    char_list,
+                )
             self.send_command("HP", 1, self.area.hp_def)
             self.send_command("HP", 2, self.area.hp_pro)
             if self.area.dark:
@@ -1451,17 +1529,13 @@ class ClientManager:
 
         def get_available_char_list(self):
             """Get a list of character IDs that the client can select."""
-            if len(self.charcurse) > 0:
-                avail_char_ids = set(range(len(self.area.area_manager.char_list))) and set(
-                    self.charcurse
-                )
-            else:
-                avail_char_ids = set(range(len(self.area.area_manager.char_list))) - {
-                    x.char_id for x in self.area.clients
-                }
-            char_list = [-1] * len(self.area.area_manager.char_list)
-            for x in avail_char_ids:
-                char_list[x] = 0
+            size = len(self.area.area_manager.char_list)
+            if not self.charcursed:
+                return list(self.area.occupancy.chars_check(size))
+            char_list = [-1] * size
+            for x in self.charcurse:
+                if 0 <= x < size:
+                    char_list[x] = 0
             return char_list
 
         def auth_mod(self, password):
@@ -1490,11 +1564,44 @@ class ClientManager:
             else:
                 raise ClientError("Invalid password.")
 
+        @property
+        def has_multilayer_audio(self):
+            """Whether this client can play multi-layered audio (such as ambience)."""
+            return self.profile.multilayer_audio
+
+        @property
+        def evi_list(self):
+            """Evidence IDs of the area, in the order this client was sent them."""
+            return self._evi_list
+
+        @evi_list.setter
+        def evi_list(self, value):
+            self._evi_list = value
+            # Reverse lookup, used to renumber evidence in MS packets
+            self._evi_index = {}
+            for evi_num, evi_id in enumerate(value):
+                self._evi_index.setdefault(evi_id, evi_num)
+
+        @property
+        def charcursed(self):
+            """Whether the client may only pick the characters of its charcurse."""
+            try:
+                return len(self._charcurse) > 0
+            except AttributeError:
+                return False
+
         @property
         def ip(self):
             """Get an anonymized version of the IP address."""
             return self.ipid
 
+        @property
+        def clientscon(self):
+            """Number of connections from this client's IPID, itself included."""
+            if self.registry is None:
+                return 0
+            return len(self.registry.with_ipid(self.ipid))
+
         @property
         def char_name(self):
             """Get the name of the character that the client is using."""
@@ -1602,7 +1709,11 @@ class ClientManager:
                         # Impose all move delays as if we moved an area when unhiding so people have to be smart about it
                         self.last_move_time = round(time.time() * 1000.0)
 
+            if self.counted_in is not None:
+                self.counted_in.remove(self)
             self._hidden = tog
+            if self.counted_in is not None:
+                self.counted_in.add(self)
             self.send_ooc(f"You are {msg} from /getarea and playercounts.")
             self.area.area_manager.send_arup_players()
 
@@ -1710,16 +1821,19 @@ class ClientManager:
 
     def __init__(self, server):
         self.clients = set()
+        # Lookups by ID, IPID, HDID, name, character and mod status
+        self.registry = ClientRegistry()
         self.server = server
         self.cur_id = [i for i in range(self.server.config["playerlimit"])]
+        server.metrics.gauge("outbound.buffered_bytes", lambda: sum(
+            c.outbound.buffered for c in self.clients))
+        server.metrics.gauge("outbound.paused_clients", lambda: sum(
+            c.outbound.paused for c in self.clients))
+        server.metrics.gauge("outbound.largest", self.largest_buffers)
 
     def new_client_preauth(self, client):
         maxclients = self.server.config["multiclient_limit"]
-        for c in self.server.client_manager.clients:
-            if c.ipid == client.ipid:
-                if c.clientscon > maxclients:
-                    return False
-        return True
+        return client.clientscon <= maxclients
 
     def new_client(self, transport):
         """
@@ -1737,10 +1851,7 @@ class ClientManager:
         c = self.Client(self.server, transport, user_id,
                         database.ipid(peername))
         self.clients.add(c)
-        temp_ipid = c.ipid
-        for client in self.server.client_manager.clients:
-            if client.ipid == temp_ipid:
-                client.clientscon += 1
+        self.registry.add(c)
         return c
 
     def remove_client(self, client):
@@ -1750,40 +1861,72 @@ class ClientManager:
         """
         if client in client.area.area_manager.owners:
             client.area.area_manager.owners.remove(client)
-        for hub in self.server.hub_manager.hubs:
-            for a in hub.areas:
-                if client in a._owners:
-                    a.remove_owner(client, dc=True)
-                # This discards the client's ID from any of the area invite lists
-                # as that ID will no longer refer to this specific player.
-                if client.id in a.invite_list:
-                    a.invite_list.discard(client.id)
+        for a in list(client.owned_areas):
+            a.remove_owner(client, dc=True)
+        # This discards the client's ID from any of the area invite lists
+        # as that ID will no longer refer to this specific player.
+        for a in list(self.registry.invited_to(client.id)):
+            a.invite_list.discard(client.id)
         heappush(self.cur_id, client.id)
-        temp_ipid = client.ipid
-        for c in self.server.client_manager.clients:
-            if c.ipid == temp_ipid:
-                c.clientscon -= 1
-            if c.following == client:
-                c.unfollow()
+        for c in list(client.followers):
+            c.unfollow()
         self.clients.remove(client)
-        for hub in self.server.hub_manager.hubs:
-            count = 0
-            for c in hub.clients:
-                if not c.area.hide_clients and not c.hidden:
-                    count = count + 1
-            hub.count = count
-        for c in self.server.client_manager.clients:
-            if c.viewing_hub_list:
-                c.send_command(
-                    "FA",
-                    *[
-                        "🌐 Hubs 🌐\n Double-Click me to see Areas\n  _______",
-                        *[
-                            f"[{hub.id}] {hub.name} (users: {hub.count})"
-                            for hub in self.server.hub_manager.hubs
-                        ],
-                    ],
-                )
+        self.registry.remove(client)
+        self.server.ui_sync.mark_hub_list()
+
+    def broadcast(self, clients, command, *args):
+        """
+        Send the same AO-compatible command to a group of clients.
+        The packet is only encoded once and the resulting bytes are shared by
+        every client that gets it as-is. Clients that need their own variant
+        of it (see Client.prepare_command) get one encoded per distinct variant.
+        :param clients: iterable of clients to send to
+        :param command: command name
+        :param *args: list of arguments
+        """
+        shared = None
+        variants = {}
+        # payload -> the same payload as a str, for WebSocket clients
+        texts = {}
+        sent = 0
+        for c in clients:
+            c_args = c.prepare_command(command, args)
+            if c_args is None:
+                continue
+            if c_args is args:
+                if shared is None:
+                    shared = pack_ao_command(command, args)
+                payload = shared
+            else:
+                try:
+                    payload = variants.get(c_args)
+                    if payload is None:
+                        payload = variants[c_args] = pack_ao_command(
+                            command, c_args)
+                except TypeError:
+                    # Unhashable arguments, can't share these
+                    payload = pack_ao_command(command, c_args)
+                    self.server.metrics.count("broadcast.encoded")
+            if c.outbound.text:
+                text = texts.get(payload)
+                if text is None:
+                    text = texts[payload] = payload.decode("utf-8")
+                payload = text
+            c.send_raw_message(payload, command)
+            sent += 1
+        if sent > 0:
+            encoded = len(variants) + (shared is not None)
+            self.server.metrics.count("broadcast.encoded", encoded)
+            self.server.metrics.count("broadcast.sent", sent)
+
+    def largest_buffers(self, count=3):
+        """
+        Describe the clients with the most outgoing data waiting.
+        :param count: how many clients to list
+        """
+        largest = sorted(
+            self.clients, key=lambda c: c.outbound.buffered, reverse=True)[:count]
+        return ", ".join(f"[{c.id}] {c.outbound.buffered}B" for c in largest)
 
     def get_targets(self, client, key, value, local=False, single=False):
         """
@@ -1806,23 +1949,36 @@ class ClientManager:
         if key == TargetType.ALL:
             for nkey in range(6):
                 targets += self.get_targets(client, nkey, value, local)
+
+        # Look the rest up in the registry, then keep whoever is in range
+        found = None
+        hub = client.area.area_manager
+        if key == TargetType.OOC_NAME:
+            found = self.registry.named_in(value)
+        elif key == TargetType.CHAR_NAME:
+            found = [
+                c
+                for char_id in self.registry.char_ids_in(hub.char_list, value)
+                for c in self.registry.with_char_id(char_id)
+            ]
+        elif key == TargetType.ID:
+            found = [self.registry.get(value)] if value in self.registry.by_id else []
+        elif key == TargetType.IPID:
+            found = self.registry.with_ipid(value)
+        if found is not None:
+            for c in sorted(found, key=lambda c: c.id):
+                # Clients still joining aren't in their area yet
+                if c not in c.area.clients:
+                    continue
+                if c.area is client.area if local else c.area.area_manager is hub:
+                    targets.append(c)
+            return targets
+
         for area in areas:
             for client in area.clients:
                 if key == TargetType.IP:
                     if value.lower().startswith(client.ip.lower()):
                         targets.append(client)
-                elif key == TargetType.OOC_NAME:
-                    if value.lower().startswith(client.name.lower()) and client.name:
-                        targets.append(client)
-                elif key == TargetType.CHAR_NAME:
-                    if value.lower().startswith(client.char_name.lower()):
-                        targets.append(client)
-                elif key == TargetType.ID:
-                    if client.id == value:
-                        targets.append(client)
-                elif key == TargetType.IPID:
-                    if client.ipid == value:
-                        targets.append(client)
                 elif key == TargetType.AFK:
                     if client in area.afkers:
                         targets.append(client)
@@ -1852,10 +2008,12 @@ class ClientManager:
                 "You are no longer AFK. Welcome back!"
             )  # Making the server a bit friendly wouldn't hurt, right?
             client.area.afkers.remove(client)
+            client.area.population.count_afk(-1)
         else:
             client.area.broadcast_ooc("{} is now AFK.".format(client.showname))
             client.send_ooc("You are now AFK. Have a good day!")
             client.area.afkers.append(client)
+            client.area.population.count_afk()
 
     def refresh_music(self, clients=None):
         """
@@ -1866,10 +2024,10 @@ class ClientManager:
         if clients is None:
             clients = self.clients
         for client in clients:
-            client.refresh_music()
+            self.server.ui_sync.mark_music(client)
 
     def get_multiclients(self, ipid=-1, hdid=""):
-        return [c for c in self.clients if c.ipid == ipid or c.hdid == hdid]
+        return list(self.registry.with_ipid(ipid) | self.registry.with_hdid(hdid))
 
     def get_mods(self):
-        return [c for c in self.clients if c.is_mod]
+        return list(self.registry.mods)
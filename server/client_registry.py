@@ -0,0 +1,339 @@
+# KFO-Server, an Attorney Online server
+#
+# Copyright (C) 2020 Crystalwarrior <varsash@gmail.com>
+#
+# Derivative of tsuserver3, an Attorney Online server. Copyright (C) 2016 argoneus <argoneuscze@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from operator import attrgetter
+
+EMPTY = frozenset()
+
+
+def file_under(index, key, entry):
+    """Add an entry to the set an index keeps under a key."""
+    members = index.get(key)
+    if members is None:
+        members = index[key] = set()
+    members.add(entry)
+
+
+def unfile_from(index, key, entry):
+    """Take an entry out of the set under a key, dropping the set once it's empty."""
+    members = index.get(key)
+    if members is None:
+        return
+    members.discard(entry)
+    if not members:
+        del index[key]
+
+
+class PrefixIndex:
+    """Trie of strings, answering "which keys does this value start with?".
+
+    That's the question get_targets asks when someone types a name followed by
+    whatever else, e.g. "/pm John Doe hey there".
+    """
+
+    # Key of the entries of a node, can't clash with a single character.
+    ENTRIES = ""
+
+    def __init__(self):
+        self.root = {}
+
+    def add(self, key, entry):
+        """
+        :param key: string to file the entry under
+        :param entry: hashable entry
+        """
+        node = self.root
+        for ch in key:
+            node = node.setdefault(ch, {})
+        node.setdefault(self.ENTRIES, set()).add(entry)
+
+    def remove(self, key, entry):
+        """
+        :param key: string the entry was filed under
+        :param entry: entry to remove
+        """
+        path = [self.root]
+        for ch in key:
+            node = path[-1].get(ch)
+            if node is None:
+                return
+            path.append(node)
+        entries = path[-1].get(self.ENTRIES)
+        if entries is None:
+            return
+        entries.discard(entry)
+        if entries:
+            return
+        del path[-1][self.ENTRIES]
+        # Prune the branch that's now empty
+        for i in range(len(key), 0, -1):
+            if path[i]:
+                break
+            del path[i - 1][key[i - 1]]
+
+    def prefixes_of(self, value):
+        """
+        Find every entry whose key is a prefix of value (or value itself).
+        :param value: string to match against
+        :returns: list of entries
+        """
+        found = []
+        node = self.root
+        if self.ENTRIES in node:
+            found.extend(node[self.ENTRIES])
+        for ch in value:
+            node = node.get(ch)
+            if node is None:
+                break
+            if self.ENTRIES in node:
+                found.extend(node[self.ENTRIES])
+        return found
+
+
+class ClientRegistry:
+    """Indexes of the connected clients, kept up to date as they change.
+
+    The Client attributes that are indexed tell the registry themselves
+    whenever they are set, see Client.registry.
+    """
+
+    # Attributes indexed as a plain exact-value lookup
+    KEYED = ("ipid", "hdid", "char_id")
+
+    def __init__(self):
+        self.by_id = {}
+        self.keyed = {attr: {} for attr in self.KEYED}
+        # lowercase OOC name -> clients
+        self.by_name = {}
+        self.names = PrefixIndex()
+        self.mods = set()
+        # id(char list) -> (char list, PrefixIndex of its lowercase names)
+        self.char_tries = {}
+        # client ID -> areas whose invite list has it, see Area.InviteList.
+        # Kept for IDs that aren't connected too, as invites outlive clients
+        # until they disconnect.
+        self.invites = {}
+
+    def add(self, client):
+        """
+        Start indexing a client.
+        :param client: client to add
+        """
+        self.by_id[client.id] = client
+        for attr in self.KEYED:
+            file_under(self.keyed[attr], getattr(client, attr), client)
+        self._add_name(client, client.name)
+        if client.is_mod:
+            self.mods.add(client)
+        client.registry = self
+
+    def remove(self, client):
+        """
+        Stop indexing a client.
+        :param client: client to remove
+        """
+        client.registry = None
+        if self.by_id.get(client.id) is client:
+            del self.by_id[client.id]
+        for attr in self.KEYED:
+            unfile_from(self.keyed[attr], getattr(client, attr), client)
+        self._remove_name(client, client.name)
+        self.mods.discard(client)
+
+    def update(self, client, attr, old, new):
+        """
+        Move a client around after one of its indexed attributes changed.
+        :param client: client that changed
+        :param attr: name of the attribute
+        :param old: previous value
+        :param new: current value
+        """
+        if attr == "name":
+            self._remove_name(client, old)
+            self._add_name(client, new)
+        elif attr == "is_mod":
+            if new:
+                self.mods.add(client)
+            else:
+                self.mods.discard(client)
+        else:
+            index = self.keyed[attr]
+            unfile_from(index, old, client)
+            file_under(index, new, client)
+
+    def invite(self, client_id, area):
+        """Note that an area's invite list has a client ID on it."""
+        file_under(self.invites, client_id, area)
+
+    def uninvite(self, client_id, area):
+        """Note that an area's invite list no longer has a client ID on it."""
+        unfile_from(self.invites, client_id, area)
+
+    def invited_to(self, client_id):
+        """Get the areas whose invite list has a client ID on it."""
+        return self.invites.get(client_id, EMPTY)
+
+    def get(self, client_id):
+        """Get the client with this player ID, or None."""
+        return self.by_id.get(client_id)
+
+    def with_ipid(self, ipid):
+        """Get the clients connected from an IPID."""
+        return self.keyed["ipid"].get(ipid, EMPTY)
+
+    def with_hdid(self, hdid):
+        """Get the clients using a HDID."""
+        return self.keyed["hdid"].get(hdid, EMPTY)
+
+    def with_char_id(self, char_id):
+        """Get the clients playing a character ID, in any hub."""
+        return self.keyed["char_id"].get(char_id, EMPTY)
+
+    def with_name(self, name):
+        """Get the clients with this OOC name, ignoring case."""
+        return self.by_name.get(name.lower(), EMPTY)
+
+    def named_in(self, value):
+        """
+        Get the clients whose OOC name starts value, ignoring case.
+        :param value: text that might begin with someone's name
+        """
+        return self.names.prefixes_of(value.lower())
+
+    def char_ids_in(self, char_list, value):
+        """
+        Get the character IDs whose name starts value, ignoring case.
+        :param char_list: character list of a hub
+        :param value: text that might begin with a character name
+        """
+        cached = self.char_tries.get(id(char_list))
+        if cached is None or cached[0] is not char_list:
+            trie = PrefixIndex()
+            for char_id, name in enumerate(char_list):
+                trie.add(name.lower(), char_id)
+            # See Client.char_name
+            trie.add("spectator", -1)
+            trie.add("connection", None)
+            # Character lists are only ever replaced, never changed in place.
+            if len(self.char_tries) > 64:
+                self.char_tries.clear()
+            cached = self.char_tries[id(char_list)] = (char_list, trie)
+        return cached[1].prefixes_of(value.lower())
+
+    def _add_name(self, client, name):
+        if not name:
+            return
+        file_under(self.by_name, name.lower(), client)
+        self.names.add(name.lower(), client)
+
+    def _remove_name(self, client, name):
+        if not name:
+            return
+        unfile_from(self.by_name, name.lower(), client)
+        self.names.remove(name.lower(), client)
+
+
+class AreaIndex:
+    """Indexes of the clients in a single area.
+
+    Clients are added and removed by the area as they come and go, and the
+    Client attributes that are indexed here tell it themselves whenever
+    they are set, see Client.indexed_in.
+    """
+
+    # Attributes indexed as a plain exact-value lookup
+    KEYED = ("char_id", "pos")
+
+    def __init__(self):
+        self.by_id = {}
+        self.keyed = {attr: {} for attr in self.KEYED}
+
+    def add(self, client):
+        """
+        Start indexing a client that entered the area.
+        :param client: client to add
+        """
+        self.by_id[client.id] = client
+        for attr in self.KEYED:
+            file_under(self.keyed[attr], getattr(client, attr), client)
+        client.indexed_in = self
+
+    def remove(self, client):
+        """
+        Stop indexing a client that left the area.
+        :param client: client to remove
+        """
+        client.indexed_in = None
+        if self.by_id.get(client.id) is client:
+            del self.by_id[client.id]
+        for attr in self.KEYED:
+            unfile_from(self.keyed[attr], getattr(client, attr), client)
+
+    def update(self, client, attr, old, new):
+        """
+        Move a client around after one of its indexed attributes changed.
+        :param client: client that changed
+        :param attr: name of the attribute
+        :param old: previous value
+        :param new: current value
+        """
+        index = self.keyed[attr]
+        unfile_from(index, old, client)
+        file_under(index, new, client)
+
+    def get(self, client_id):
+        """Get the client in the area with this player ID, or None."""
+        return self.by_id.get(client_id)
+
+    def with_char_id(self, char_id):
+        """Get the clients in the area playing a character ID."""
+        return self.keyed["char_id"].get(char_id, EMPTY)
+
+    def at_pos(self, pos):
+        """Get the clients in the area standing at a position."""
+        return self.keyed["pos"].get(pos, EMPTY)
+
+
+def indexed(attr, counted=False, registered=True, local=False):
+    """
+    Make a Client attribute tell the indexes it's in whenever it is set.
+    :param attr: attribute name, stored as _<attr>
+    :param counted: whether it matters to the client's area Population
+    :param registered: whether the ClientRegistry indexes it
+    :param local: whether the AreaIndex of the client's area indexes it
+    """
+    private = "_" + attr
+
+    def setter(self, value):
+        old = getattr(self, private, None)
+        if old == value:
+            setattr(self, private, value)
+            return
+        population = self.counted_in if counted else None
+        if population is not None:
+            population.remove(self)
+        setattr(self, private, value)
+        if population is not None:
+            population.add(self)
+        if registered and self.registry is not None:
+            self.registry.update(self, attr, old, value)
+        if local and self.indexed_in is not None:
+            self.indexed_in.update(self, attr, old, value)
+
+    return property(attrgetter(private), setter)
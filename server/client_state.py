@@ -0,0 +1,147 @@
+# KFO-Server, an Attorney Online server
+#
+# Copyright (C) 2020 Crystalwarrior <varsash@gmail.com>
+#
+# Derivative of tsuserver3, an Attorney Online server. Copyright (C) 2016 argoneus <argoneuscze@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+class ClientState:
+    """A group of Client attributes that most clients never touch.
+
+    Clients start without one. Reading the attributes gives the defaults,
+    and the group only gets allocated once one of them is set to something
+    else. See grouped().
+    """
+
+    __slots__ = ()
+    DEFAULTS = {}
+
+    def __init__(self):
+        for attr, value in self.DEFAULTS.items():
+            setattr(self, attr, value)
+
+
+class CasingPrefs(ClientState):
+    """Which case announcements a client wants, see /setcase."""
+
+    DEFAULTS = {
+        "casing_cm": False,
+        "casing_cases": "",
+        "casing_def": False,
+        "casing_pro": False,
+        "casing_jud": False,
+        "casing_jur": False,
+        "casing_steno": False,
+        "case_call_time": 0,
+    }
+    __slots__ = tuple(DEFAULTS)
+
+
+class AudioEditing(ClientState):
+    """Music list clicks that set an area's ambience or minigame songs instead."""
+
+    DEFAULTS = {
+        "edit_ambience": False,
+        "editing_minigame_song": "",
+        # 0 = start
+        # 1 = end
+        # 2 = concede
+        "editing_minigame_song_condition": 0,
+    }
+    __slots__ = tuple(DEFAULTS)
+
+
+class RemoteListening(ClientState):
+    """What a client hears from elsewhere, or doesn't hear in its own area."""
+
+    DEFAULTS = {
+        # 0 = listen to NONE
+        # 1 = listen to IC
+        # 2 = listen to OOC
+        # 3 = Listen to ALL
+        "remote_listen": 2,
+        # positions whose IC messages the client still hears
+        "listen_pos": None,
+    }
+    __slots__ = tuple(DEFAULTS)
+
+
+class ChatEffects(ClientState):
+    """Fun commands messing with what a client says."""
+
+    DEFAULTS = {
+        "disemvowel": False,
+        "shaken": False,
+        "rainbow": False,
+    }
+    __slots__ = tuple(DEFAULTS)
+
+
+class grouped:
+    """Client attribute kept in a ClientState group."""
+
+    def __init__(self, slot, group, attr):
+        """
+        :param slot: Client slot holding the group, None until it's needed
+        :param group: ClientState subclass
+        :param attr: attribute of the group
+        """
+        self.slot = slot
+        self.group = group
+        self.attr = attr
+        self.default = group.DEFAULTS[attr]
+
+    def __get__(self, client, owner=None):
+        if client is None:
+            return self
+        state = getattr(client, self.slot)
+        if state is None:
+            return self.default
+        return getattr(state, self.attr)
+
+    def __set__(self, client, value):
+        state = getattr(client, self.slot)
+        if state is None:
+            if value == self.default:
+                return
+            state = self.group()
+            setattr(client, self.slot, state)
+        setattr(state, self.attr, value)
+
+
+class lazy:
+    """Client attribute built the first time it's used."""
+
+    def __init__(self, slot, factory):
+        """
+        :param slot: Client slot holding the value
+        :param factory: called with the client to build the value
+        """
+        self.slot = slot
+        self.factory = factory
+
+    def __get__(self, client, owner=None):
+        if client is None:
+            return self
+        try:
+            return getattr(client, self.slot)
+        except AttributeError:
+            value = self.factory(client)
+            setattr(client, self.slot, value)
+            return value
+
+    def __set__(self, client, value):
+        setattr(client, self.slot, value)
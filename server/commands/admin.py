@@ -32,6 +32,7 @@ __all__ = [
     "ooc_cmd_whois",
     "ooc_cmd_restart",
     "ooc_cmd_myid",
+    "ooc_cmd_metrics",
 ]
 
 
@@ -543,3 +544,21 @@ def ooc_cmd_myid(client, arg):
     if client.name != "":
         info += f": {client.name}"
     client.send_ooc(info)
+
+
+@mod_only()
+def ooc_cmd_metrics(client, arg):
+    """
+    Show server performance counters, such as how long each packet takes to parse and handle.
+    Pass a prefix to only show some of them, or "reset" to clear them.
+    Usage: /metrics [prefix|reset]
+    """
+    metrics = client.server.metrics
+    if arg == "reset":
+        metrics.reset()
+        client.send_ooc("Metrics have been reset.")
+        return
+    lines = metrics.report(arg)
+    if len(lines) == 0:
+        raise ArgumentError(f"No metrics found starting with '{arg}'.")
+    client.send_ooc("\n".join(["Server metrics:", *lines]))
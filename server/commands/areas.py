@@ -122,23 +122,7 @@ def ooc_cmd_area(client, arg):
         return
 
     try:
-        for area in client.area.area_manager.areas:
-            a = arg.split(" ")[0]
-            aid = a.strip("[]")
-            if (
-                (
-                    a.startswith("[")
-                    and a.endswith("]")
-                    and aid.isdigit()
-                    and area.id == int(aid)
-                )
-                or area.name.lower() == arg.lower()
-                or area.abbreviation == arg
-                or (arg.isdigit() and area.id == int(arg))
-            ):
-                client.change_area(area)
-                return
-        raise AreaError("Targeted area not found!")
+        client.change_area(client.area.area_manager.find_area(arg))
     except ValueError:
         raise ArgumentError(
             "Area ID must be a name, abbreviation or a number.")
@@ -511,24 +495,11 @@ def ooc_cmd_knock(client, arg):
 
         allowed = client.is_mod or client in area.owners or client in client.area.owners
         if not allowed and area != client.area:
-            if len(client.area.links) > 0:
-                if not str(area.id) in client.area.links:
-                    raise ClientError(
-                        f"Failed to knock on [{area.id}] {area.name}: That area is inaccessible!"
-                    )
-
-                if str(area.id) in client.area.links:
-                    # Get that link reference
-                    link = client.area.links[str(area.id)]
-
-                    # Link requires us to be inside a piece of evidence
-                    if (
-                        len(link["evidence"]) > 0
-                        and client.hidden_in not in link["evidence"]
-                    ):
-                        raise ClientError(
-                            f"Failed to knock on [{area.id}] {area.name}: That area is inaccessible!"
-                        )
+            # No link there, or one we'd have to be inside a piece of evidence for
+            if not client.can_access_area(area):
+                raise ClientError(
+                    f"Failed to knock on [{area.id}] {area.name}: That area is inaccessible!"
+                )
             if client.area.locked and client.id not in client.area.invite_list:
                 raise ClientError(
                     f"Failed to knock on [{area.id}] {area.name}: Current area is locked!"
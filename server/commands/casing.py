@@ -807,26 +807,21 @@ def ooc_cmd_cs(client, arg):
     Usage: /cs <id>
     """
     if arg == "":
-        if (
-            client.area.minigame_schedule
-            and not client.area.minigame_schedule.cancelled()
-        ):
+        if client.area.minigame_timer.started:
             msg = f"Current minigame is {client.area.minigame}!\n"
             red = []
             for cid in client.area.red_team:
                 name = client.area.area_manager.char_list[cid]
-                for c in client.area.clients:
-                    if c.char_id == cid:
-                        name = f"[{c.id}] {c.showname}"
+                for c in client.area.index.with_char_id(cid):
+                    name = f"[{c.id}] {c.showname}"
                 red.append(f"🔴{name} (Red)")
             msg += "\n".join(red)
             msg += "\n⚔VERSUS⚔\n"
             blue = []
             for cid in client.area.blue_team:
                 name = client.area.area_manager.char_list[cid]
-                for c in client.area.clients:
-                    if c.char_id == cid:
-                        name = f"[{c.id}] {c.showname}"
+                for c in client.area.index.with_char_id(cid):
+                    name = f"[{c.id}] {c.showname}"
                 blue.append(f"🔵{name} (Blue)")
             msg += "\n".join(blue)
             msg += f"\n⏲{int(client.area.minigame_time_left)} seconds left."
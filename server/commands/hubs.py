@@ -59,35 +59,18 @@ def ooc_cmd_hub(client, arg):
         return
 
     try:
-        for hub in client.server.hub_manager.hubs:
-            h = arg.split(" ")[0]
-            hid = h.strip("[]")
-            if (
-                (
-                    h.startswith("[")
-                    and h.endswith("]")
-                    and hid.isdigit()
-                    and hub.id == int(hid)
-                )
-                or hub.name.lower() == arg.lower()
-                or hub.abbreviation == arg
-                or (arg.isdigit() and hub.id == int(arg))
-            ):
-                if hub == client.area.area_manager:
-                    raise ClientError("User already in specified hub.")
-                preflist = client.server.supported_features.copy()
-                if not hub.arup_enabled or client.viewing_hub_list:
-                    preflist.remove("arup")
-                client.send_command("FL", *preflist)
-                client.send_ooc(f"Changed to hub [{hub.id}] {hub.name}.")
-                client.change_area(hub.default_area())
-                client.area.area_manager.send_arup_players([client])
-                client.area.area_manager.send_arup_status([client])
-                client.area.area_manager.send_arup_cms([client])
-                client.area.area_manager.send_arup_lock([client])
-                client.send_hub_info()
-                return
-        raise AreaError("Targeted hub not found!")
+        hub = client.server.hub_manager.find_hub(arg)
+        if hub == client.area.area_manager:
+            raise ClientError("User already in specified hub.")
+        client.send_feature_list(
+            hub.arup_enabled and not client.viewing_hub_list)
+        client.send_ooc(f"Changed to hub [{hub.id}] {hub.name}.")
+        client.change_area(hub.default_area())
+        client.area.area_manager.send_arup_players([client])
+        client.area.area_manager.send_arup_status([client])
+        client.area.area_manager.send_arup_cms([client])
+        client.area.area_manager.send_arup_lock([client])
+        client.send_hub_info()
     except ValueError:
         raise ArgumentError("Hub ID must be a name, abbreviation or a number.")
     except (AreaError, ClientError):
@@ -583,7 +566,7 @@ def ooc_cmd_arup_enable(client, arg):
         )
     client.area.area_manager.arup_enabled = True
     client.area.area_manager.send_command(
-        "FL", client.server.supported_features)
+        "FL", *client.profile.feature_list(arup=True))
     client.area.area_manager.broadcast_area_list(refresh=True)
     client.area.area_manager.broadcast_ooc(
         "ARUP system has been enabled for this hub.")
@@ -600,9 +583,8 @@ def ooc_cmd_arup_disable(client, arg):
             "ARUP system is already disabled! Use /arup_enable to enable it."
         )
     client.area.area_manager.arup_enabled = False
-    preflist = client.server.supported_features.copy()
-    preflist.remove("arup")
-    client.area.area_manager.send_command("FL", *preflist)
+    client.area.area_manager.send_command(
+        "FL", *client.profile.feature_list(arup=False))
     client.area.area_manager.broadcast_area_list(refresh=True)
     client.area.area_manager.broadcast_ooc(
         "ARUP system has been disabled for this hub."
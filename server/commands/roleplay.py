@@ -1,9 +1,6 @@
 import random
 
-import asyncio
-import arrow
 import time
-import datetime
 import pytimeparse
 
 from server import database
@@ -519,17 +516,11 @@ def ooc_cmd_timer(client, arg):
         # Hub timer
         timer = client.area.area_manager.timer
         if timer.set:
-            if timer.started:
-                msg += f"\nTimer 0 is at {timer.target - arrow.get()}"
-            else:
-                msg += f"\nTimer 0 is at {timer.static}"
+            msg += f"\nTimer 0 is at {timer.time_left()}"
         # Area timers
         for timer_id, timer in enumerate(client.area.timers):
             if timer.set:
-                if timer.started:
-                    msg += f"\nTimer {timer_id+1} is at {timer.target - arrow.get()}"
-                else:
-                    msg += f"\nTimer {timer_id+1} is at {timer.static}"
+                msg += f"\nTimer {timer_id+1} is at {timer.time_left()}"
         client.send_ooc(msg)
         return
     # TI packet specification:
@@ -549,11 +540,7 @@ def ooc_cmd_timer(client, arg):
         timer = client.area.timers[timer_id - 1]
     if len(arg) < 2:
         if timer.set:
-            if timer.started:
-                client.send_ooc(
-                    f"Timer {timer_id} is at {timer.target - arrow.get()}")
-            else:
-                client.send_ooc(f"Timer {timer_id} is at {timer.static}")
+            client.send_ooc(f"Timer {timer_id} is at {timer.time_left()}")
         else:
             client.send_ooc(f"Timer {timer_id} is unset.")
         return
@@ -572,18 +559,10 @@ def ooc_cmd_timer(client, arg):
     duration = pytimeparse.parse("".join(arg[1:]))
     if duration is not None:
         if timer.set:
-            if timer.started:
-                if not (arg[1] == "+" or arg[1][0] == "+" or duration < 0):
-                    timer.target = arrow.get()
-                timer.target = timer.target.shift(seconds=duration)
-                timer.static = timer.target - arrow.get()
-            else:
-                if not (arg[1] == "+" or arg[1][0] == "+" or duration < 0):
-                    timer.static = datetime.timedelta(0)
-                timer.static += datetime.timedelta(seconds=duration)
+            relative = arg[1] == "+" or arg[1][0] == "+" or duration < 0
+            timer.adjust(duration, relative)
         else:
-            timer.static = datetime.timedelta(seconds=abs(duration))
-            timer.set = True
+            timer.show(duration)
             if timer_id == 0:
                 client.area.area_manager.send_command("TI", timer_id, 2)
             else:
@@ -594,21 +573,14 @@ def ooc_cmd_timer(client, arg):
         return
 
     if arg[1] == "start" and not timer.started:
-        timer.target = timer.static + arrow.get()
-        timer.started = True
+        timer.start()
         client.send_ooc(f"Starting timer {timer_id}.")
     elif arg[1] in ("pause", "stop") and timer.started:
-        timer.static = timer.target - arrow.get()
-        timer.started = False
+        timer.pause()
         client.send_ooc(f"Stopping timer {timer_id}.")
     elif arg[1] in ("unset", "hide"):
-        timer.set = False
-        timer.started = False
-        timer.static = None
-        timer.target = None
+        timer.unset()
         timer.commands.clear()
-        if timer.schedule:
-            timer.schedule.cancel()
         client.send_ooc(f"Timer {timer_id} unset and hidden.")
         if timer_id == 0:
             client.area.area_manager.send_command("TI", timer_id, 3)
@@ -646,14 +618,11 @@ def ooc_cmd_timer(client, arg):
 
     # Send static time if applicable
     if timer.set:
-        s = int(not timer.started)
-        static_time = int(timer.static.total_seconds()) * 1000
         if timer_id == 0:
-            client.area.area_manager.send_command(
-                "TI", timer_id, s, static_time)
+            client.area.area_manager.send_command("TI", *timer.ti_args())
         else:
-            client.area.send_command("TI", timer_id, s, static_time)
-        client.send_ooc(f"Timer {timer_id} is at {timer.static}")
+            client.area.send_command("TI", *timer.ti_args())
+        client.send_ooc(f"Timer {timer_id} is at {timer.time_left()}")
 
         if timer_id == 0:
             timer.hub = client.area.area_manager
@@ -661,12 +630,6 @@ def ooc_cmd_timer(client, arg):
             timer.area = client.area
 
         timer.caller = client
-        if timer.schedule:
-            timer.schedule.cancel()
-        if timer.started:
-            timer.schedule = asyncio.get_running_loop().call_later(
-                int(timer.static.total_seconds()), timer.timer_expired
-            )
 
 
 @mod_only(area_owners=True)
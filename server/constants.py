@@ -119,3 +119,32 @@ def encode_ao_packet(params):
                 .replace("&", "<and>")
             )
     return new_params
+
+
+def compose_ao_command(command, args):
+    """
+    Compose an AO-compatible message, with arguments delimited by `#`
+    and ending with `#%`.
+    :param command: command name
+    :param args: list of arguments
+    :returns: the message as a str
+    """
+    command, *args = encode_ao_packet([command, *args])
+    message = f"{command}#"
+    for arg in args:
+        # Evidence packet uses tuples to construct its evidence entries
+        if type(arg) is tuple:
+            # AO2 evidence packet uses & to separate pieces of evidence
+            arg = "&".join(arg)
+        message += f"{arg}#"
+    return message + "%"
+
+
+def pack_ao_command(command, args):
+    """
+    Compose an AO-compatible message, see compose_ao_command.
+    :param command: command name
+    :param args: list of arguments
+    :returns: the message encoded as UTF-8 bytes
+    """
+    return compose_ao_command(command, args).encode("utf-8")
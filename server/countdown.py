@@ -0,0 +1,241 @@
+# KFO-Server, an Attorney Online server
+#
+# Copyright (C) 2020 Crystalwarrior <varsash@gmail.com>
+#
+# Derivative of tsuserver3, an Attorney Online server. Copyright (C) 2016 argoneus <argoneuscze@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import datetime
+from itertools import count
+
+from server.constants import pack_ao_command
+
+# Every change to a countdown gets a fresh number from here, see Countdown.version
+_versions = count(1)
+
+# Seconds a client may go without a resync of the timers that are running,
+# see TimerSync.update
+RESYNC_INTERVAL = 60
+
+
+class Countdown:
+    """A timer shown to clients through the TI packet.
+
+    Runs on the monotonic clock of the event loop, same as the TimerWheel
+    that fires it when it runs out, so the time left is a subtraction away.
+
+    TI packet specification:
+    TI#TimerID#Type#Value#%
+    Type 0 = start/resume/sync timer at time
+    Type 1 = pause timer at time
+    Type 2 = show timer
+    Type 3 = hide timer
+    Value = Time to set on the timer, in milliseconds
+    """
+
+    def __init__(self, wheel, ti_id, on_expire=None):
+        """
+        :param wheel: TimerWheel to time it with
+        :param ti_id: timer ID the clients know it by
+        :param on_expire: called without arguments when it runs out
+        """
+        self.wheel = wheel
+        self.ti_id = ti_id
+        self.on_expire = on_expire
+        self.set = False
+        self.started = False
+        # Seconds left as of the last pause
+        self.left = 0
+        # Loop time it runs out at, while started
+        self.deadline = 0
+        self.schedule = None
+        # Changes whenever anything the clients are shown does
+        self.version = next(_versions)
+
+    def remaining(self):
+        """Seconds left, never below zero."""
+        if self.started:
+            return max(self.deadline - self.wheel.time(), 0)
+        return max(self.left, 0)
+
+    def time_left(self):
+        """Time left as a timedelta, for showing it to people."""
+        return datetime.timedelta(seconds=self.remaining())
+
+    def show(self, seconds):
+        """
+        Set the timer, paused.
+        :param seconds: time to show on it
+        """
+        self._stop()
+        self.set = True
+        self.left = abs(seconds)
+        self._changed()
+
+    def adjust(self, seconds, relative=False):
+        """
+        Change the time on the timer, running or not.
+        :param seconds: seconds to set it to, or to add if relative
+        :param relative: add to the time left instead of replacing it
+        """
+        if self.started:
+            base = self.deadline if relative else self.wheel.time()
+            self.deadline = base + seconds
+            self.schedule.reschedule(self.remaining())
+        else:
+            self.left = (self.left if relative else 0) + seconds
+        self._changed()
+
+    def start(self):
+        """Start or resume the timer."""
+        if self.started:
+            return
+        self.started = True
+        self.deadline = self.wheel.time() + self.left
+        if self.schedule is None:
+            self.schedule = self.wheel.call_later(
+                self.remaining(), self._expire)
+        else:
+            self.schedule.reschedule(self.remaining())
+        self._changed()
+
+    def pause(self):
+        """Pause the timer, keeping the time it has left."""
+        if not self.started:
+            return
+        self.left = self.remaining()
+        self._stop()
+        self._changed()
+
+    def run(self, seconds):
+        """
+        Set the timer and start it right away.
+        :param seconds: time to count down from
+        """
+        self.show(seconds)
+        self.start()
+
+    def unset(self):
+        """Stop the timer and take it off the screen."""
+        self._stop()
+        self.set = False
+        self.left = 0
+        self._changed()
+
+    def ti_args(self):
+        """Arguments of the TI packet putting the timer in its current state."""
+        return (self.ti_id, int(not self.started), round(self.remaining() * 1000))
+
+    def packets(self):
+        """The encoded TI packets that show the timer in its current state."""
+        if not self.set:
+            return pack_ao_command("TI", (self.ti_id, 1, 0)) + pack_ao_command(
+                "TI", (self.ti_id, 3, 0)
+            )
+        args = self.ti_args()
+        return pack_ao_command("TI", (self.ti_id, 2, args[2])) + pack_ao_command(
+            "TI", args
+        )
+
+    def timer_expired(self):
+        """Called once the timer runs out."""
+        if self.on_expire is not None:
+            self.on_expire()
+
+    def _stop(self):
+        self.started = False
+        if self.schedule is not None:
+            self.schedule.cancel()
+
+    def _changed(self):
+        self.version = next(_versions)
+
+    def _expire(self):
+        self.started = False
+        self.left = 0
+        self._changed()
+        self.timer_expired()
+
+
+class TimerSync:
+    """Keeps the timers clients see in an area in sync with the server.
+
+    The TI packets of every timer, up to 42 of them, go out as a single
+    payload. The parts of it that don't depend on the clock are encoded
+    once for as long as no timer changes.
+    """
+
+    def __init__(self, area):
+        self.area = area
+        # (versions of the timers, running_only) -> list of encoded packets,
+        # with the running countdowns left in to encode as they're sent
+        self.bursts = {}
+        self.versions = None
+
+    def countdowns(self):
+        """Every countdown the area's clients can see, in TI order."""
+        area = self.area
+        timers = [area.area_manager.timer, *area.timers]
+        # The minigame countdown borrows timer ID 2 while area timer 2 is unset
+        if area.minigame_timer.set and not timers[2].set:
+            timers[2] = area.minigame_timer
+        return timers
+
+    def burst(self, running_only=False):
+        """
+        The TI packets showing the timers as they are now.
+        :param running_only: leave out the timers that aren't set
+        :returns: bytes, empty if there's nothing to send
+        """
+        countdowns = self.countdowns()
+        versions = tuple(timer.version for timer in countdowns)
+        if versions != self.versions:
+            self.bursts.clear()
+            self.versions = versions
+        parts = self.bursts.get(running_only)
+        if parts is None:
+            parts = []
+            for timer in countdowns:
+                if timer.started:
+                    parts.append(timer)
+                elif timer.set or not running_only:
+                    packets = timer.packets()
+                    if parts and isinstance(parts[-1], bytes):
+                        parts[-1] += packets
+                    else:
+                        parts.append(packets)
+            self.bursts[running_only] = parts
+        return b"".join(
+            part if isinstance(part, bytes) else part.packets() for part in parts
+        )
+
+    def update(self, client, running_only=False):
+        """
+        Send a client the state of the area's timers.
+        :param client: client to update
+        :param running_only: only resync the timers that are set, and only
+        if the client hasn't been sent them in a while. The ones that
+        change are broadcast to the area as they do.
+        """
+        now = self.area.server.timers.time()
+        if running_only and client.timers_synced is not None:
+            area, synced_at = client.timers_synced
+            if area is self.area and now - synced_at < RESYNC_INTERVAL:
+                self.area.server.metrics.count("ti.skipped")
+                return
+        payload = self.burst(running_only)
+        client.timers_synced = (self.area, now)
+        if payload:
+            client.send_raw_message(payload, "TI")
@@ -1,7 +1,10 @@
+from operator import attrgetter
+
 import oyaml as yaml  # ordered yaml
 
 from server.area_manager import AreaManager
 from server.exceptions import AreaError
+from server.name_index import NameIndex
 
 
 class HubManager:
@@ -10,14 +13,12 @@ class HubManager:
     def __init__(self, server):
         self.server = server
         self.hubs = []
+        self.hub_names = NameIndex(fold_abbreviations=True)
         self.load()
 
     @property
     def clients(self):
-        clients = set()
-        for hub in self.hubs:
-            clients = clients | hub.clients
-        return clients
+        return set().union(*(hub.members for hub in self.hubs))
 
     def load(self, path="config/areas.yaml", hub_id=-1):
         try:
@@ -39,7 +40,7 @@ class HubManager:
         if "area" in hubs[0]:
             # Legacy support triggered! Abort operation
             if len(self.hubs) <= 0:
-                self.hubs.append(AreaManager(self, "Hub 0"))
+                self.add_hub()
             self.hubs[0].load_areas(hubs)
 
             is_dr_hub = False
@@ -74,13 +75,16 @@ class HubManager:
         for hub in hubs:
             while len(self.hubs) < len(hubs):
                 # Make sure that the hub manager contains enough hubs to update with new information
-                self.hubs.append(AreaManager(self, f"Hub {len(self.hubs)}"))
+                self.add_hub()
             while len(self.hubs) > len(hubs):
                 # Clean up excess hubs
-                h = self.hubs.pop()
+                h = self.hubs[-1]
                 clients = h.clients.copy()
                 for client in clients:
                     client.set_area(self.default_hub().default_area())
+                self.hubs.pop()
+                self.hub_names.remove(h)
+                h._id = -1
 
             self.hubs[i].load(hub)
             self.hubs[i].o_name = self.hubs[i].name
@@ -98,27 +102,59 @@ class HubManager:
             raise AreaError(
                 f"Trying to save Hub list: File path {path} is invalid!")
 
+    def add_hub(self):
+        """Create a new hub at the end of the hub list and return it."""
+        hub = AreaManager(self, f"Hub {len(self.hubs)}")
+        hub._id = len(self.hubs)
+        self.hubs.append(hub)
+        self.hub_names.add(hub)
+        return hub
+
+    def hub_list(self):
+        """Get the FA shown to clients viewing the list of hubs."""
+        return [
+            "🌐 Hubs 🌐\n Double-Click me to see Areas\n  _______",
+            *[f"[{hub.id}] {hub.name} (users: {hub.count})" for hub in self.hubs],
+        ]
+
     def default_hub(self):
         """Get the default hub."""
         return self.hubs[0]
 
     def get_hub_by_name(self, name):
         """Get a hub by name."""
-        for hub in self.hubs:
-            if hub.name.lower() == name.lower():
-                return hub
+        for hub in self.hub_names.named(name):
+            return hub
         raise AreaError("Hub not found.")
 
     def get_hub_by_id(self, num):
         """Get a hub by ID."""
-        for hub in self.hubs:
-            if hub.id == num:
-                return hub
+        if isinstance(num, int) and 0 <= num < len(self.hubs):
+            return self.hubs[num]
         raise AreaError("Hub not found.")
 
+    def find_hub(self, arg):
+        """
+        Find the hub meant by "[id]", a name, an abbreviation or an ID.
+        :param arg: what was typed
+        :returns: matching hub, the one with the lowest ID if there's several
+        """
+        found = self.hub_names.named(arg) + [
+            hub for hub in self.hub_names.abbreviated(arg) if hub.abbreviation == arg
+        ]
+        h = arg.split(" ")[0]
+        hid = h.strip("[]")
+        if h.startswith("[") and h.endswith("]") and hid.isdigit():
+            found.append(self.hubs[int(hid)] if int(hid) < len(self.hubs) else None)
+        if arg.isdigit():
+            found.append(self.hubs[int(arg)] if int(arg) < len(self.hubs) else None)
+        found = [hub for hub in found if hub is not None]
+        if len(found) == 0:
+            raise AreaError("Targeted hub not found!")
+        return min(found, key=attrgetter("id"))
+
     def get_hub_by_abbreviation(self, abbr):
         """Get a hub by abbreviation."""
-        for hub in self.hubs:
-            if hub.abbreviation.lower() == abbr.lower():
-                return hub
+        for hub in self.hub_names.abbreviated(abbr):
+            return hub
         raise AreaError("Hub not found.")
@@ -0,0 +1,223 @@
+# KFO-Server, an Attorney Online server
+#
+# Copyright (C) 2020 Crystalwarrior <varsash@gmail.com>
+#
+# Derivative of tsuserver3, an Attorney Online server. Copyright (C) 2016 argoneus <argoneuscze@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+class Link(dict):
+    """A one-way link from an area to another, see Area.link.
+
+    Still a plain dict of the link's settings, but changing it tells the
+    hub's LinkGraph that it has to compile the links again.
+    """
+
+    __slots__ = ("links",)
+
+    def __init__(self, links, *args, **kwargs):
+        """
+        :param links: Links this link is in
+        """
+        super().__init__(*args, **kwargs)
+        self.links = links
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.links.changed()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.links.changed()
+
+
+class Links(dict):
+    """The links of an area, str of the target area ID -> Link.
+
+    Any change to it, or to the links in it, tells the hub's LinkGraph that
+    it has to compile the links again.
+    """
+
+    __slots__ = ("area",)
+
+    def __init__(self, area):
+        """
+        :param area: area the links go from
+        """
+        super().__init__()
+        self.area = area
+
+    def changed(self):
+        """Let the hub know its links changed."""
+        self.area.area_manager.link_graph.invalidate()
+
+    def __setitem__(self, key, link):
+        if not isinstance(link, Link) or link.links is not self:
+            link = Link(self, link)
+        super().__setitem__(key, link)
+        self.changed()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.changed()
+
+    def pop(self, *args):
+        link = super().pop(*args)
+        self.changed()
+        return link
+
+    def popitem(self):
+        item = super().popitem()
+        self.changed()
+        return item
+
+    def clear(self):
+        super().clear()
+        self.changed()
+
+    def update(self, *args, **kwargs):
+        for key, link in dict(*args, **kwargs).items():
+            self[key] = link
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+
+class LinkGraph:
+    """The links between the areas of a hub, compiled for quick lookups.
+
+    Which areas a client sees from an area only depends on the area, on
+    whether the client is privileged and on the evidence it's hiding in, so
+    each such list is worked out once and kept until links, hidden areas or
+    the hub's areas change.
+    """
+
+    def __init__(self, hub):
+        """
+        :param hub: AreaManager the areas are in
+        """
+        self.hub = hub
+        # area -> {target area: Link}, for areas that have any links
+        self.adjacency = None
+        # areas with links only usable from inside some evidence
+        self.gated = frozenset()
+        # (area, privileged, evidence) -> tuple of visible areas
+        self.visible = {}
+
+    def invalidate(self):
+        """
+        Forget everything compiled, as the links or areas changed, and have
+        the area lists of everyone in the hub checked again.
+        """
+        if self.adjacency is None and not self.visible:
+            # Nothing was worked out since the last change
+            return
+        self.adjacency = None
+        self.visible.clear()
+        ui_sync = self.hub.server.ui_sync
+        for client in self.hub.members:
+            ui_sync.mark_area_list(client)
+
+    def compile(self):
+        """Turn the links of every area into lookups by Area."""
+        areas = self.hub.areas
+        adjacency = {}
+        for area in areas:
+            if len(area.links) <= 0:
+                continue
+            targets = adjacency[area] = {}
+            for key, link in area.links.items():
+                try:
+                    target = int(key)
+                except ValueError:
+                    continue
+                if str(target) != key:
+                    continue
+                # Links to areas that don't exist lead nowhere
+                if 0 <= target < len(areas):
+                    targets[areas[target]] = link
+        self.adjacency = adjacency
+        self.gated = frozenset(
+            area for area, targets in adjacency.items()
+            if any(len(link["evidence"]) > 0 for link in targets.values())
+        )
+        return adjacency
+
+    def links_of(self, area):
+        """
+        Get the links going out of an area.
+        :param area: area the links go from
+        :returns: dict of target area -> Link, None if it has no links at all
+        """
+        adjacency = self.adjacency
+        if adjacency is None:
+            adjacency = self.compile()
+        return adjacency.get(area)
+
+    def get_link(self, area, target):
+        """
+        Get the link from an area to another.
+        :returns: Link, or None if there isn't one
+        """
+        links = self.links_of(area)
+        if links is None:
+            return None
+        return links.get(target)
+
+    def visible_from(self, area, privileged=False, hidden_in=None):
+        """
+        Get the areas shown in the area list of someone in an area.
+        :param area: area they are in
+        :param privileged: whether they see hidden areas and links, and
+        unlinked areas, like mods and CMs do
+        :param hidden_in: evidence they're hiding in, if any
+        :returns: tuple of areas, the area itself included
+        """
+        links = self.links_of(area)
+        if privileged or area not in self.gated:
+            # The evidence doesn't change anything
+            hidden_in = None
+        key = (area, privileged, hidden_in)
+        visible = self.visible.get(key)
+        if visible is not None:
+            return visible
+        found = []
+        for target in self.hub.areas:
+            if target is not area and not privileged:
+                if target.hidden:
+                    continue
+                if links is not None:
+                    link = links.get(target)
+                    if link is None or link["hidden"] is True:
+                        continue
+                    if len(link["evidence"]) > 0 and hidden_in not in link["evidence"]:
+                        continue
+            found.append(target)
+        visible = self.visible[key] = tuple(found)
+        return visible
+
+    def can_access(self, area, target, hidden_in=None):
+        """
+        Whether someone in an area may go to another as far as links go.
+        :param hidden_in: evidence they're hiding in, if any
+        """
+        if target is area or len(area.links) <= 0:
+            return True
+        link = self.get_link(area, target)
+        return link is not None and (
+            len(link["evidence"]) <= 0 or hidden_in in link["evidence"]
+        )
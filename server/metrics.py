@@ -0,0 +1,108 @@
+# KFO-Server, an Attorney Online server
+#
+# Copyright (C) 2020 Crystalwarrior <varsash@gmail.com>
+#
+# Derivative of tsuserver3, an Attorney Online server. Copyright (C) 2016 argoneus <argoneuscze@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import time
+from collections import defaultdict
+
+
+class Metrics:
+    """In-process counters, timings and gauges, reported through /metrics."""
+
+    class Timing:
+        """Running totals for a single timed operation."""
+
+        __slots__ = ("count", "total", "max")
+
+        def __init__(self):
+            self.count = 0
+            self.total = 0
+            self.max = 0
+
+        def add(self, ns):
+            self.count += 1
+            self.total += ns
+            if ns > self.max:
+                self.max = ns
+
+        @property
+        def mean(self):
+            if self.count == 0:
+                return 0
+            return self.total / self.count
+
+    def __init__(self):
+        self.counters = defaultdict(int)
+        self.timings = defaultdict(self.Timing)
+        # name -> callable returning the current value
+        self.gauges = {}
+        # when counting started, to turn counters into rates
+        self.started = time.monotonic()
+
+    def count(self, name, amount=1):
+        """
+        Increment a counter.
+        :param name: name of the counter
+        :param amount: how much to add to it
+        """
+        self.counters[name] += amount
+
+    def observe(self, name, ns):
+        """
+        Record how long something took.
+        :param name: name of the timing
+        :param ns: duration in nanoseconds
+        """
+        self.timings[name].add(ns)
+
+    def gauge(self, name, func):
+        """
+        Register a value that is read when the metrics are reported.
+        :param name: name of the gauge
+        :param func: callable taking no arguments
+        """
+        self.gauges[name] = func
+
+    def reset(self):
+        """Clear all counters and timings. Gauges are kept."""
+        self.counters.clear()
+        self.timings.clear()
+        self.started = time.monotonic()
+
+    def report(self, prefix=""):
+        """
+        Build a human readable report.
+        :param prefix: only include metrics whose name starts with this
+        :returns: list of lines
+        """
+        lines = []
+        elapsed = max(time.monotonic() - self.started, 1)
+        for name in sorted(self.gauges):
+            if name.startswith(prefix):
+                lines.append(f"{name}: {self.gauges[name]()}")
+        for name in sorted(self.counters):
+            if name.startswith(prefix):
+                count = self.counters[name]
+                lines.append(f"{name}: {count} ({count / elapsed:.1f}/s)")
+        for name in sorted(self.timings):
+            if name.startswith(prefix):
+                t = self.timings[name]
+                lines.append(
+                    f"{name}: {t.count}x, avg {t.mean / 1000:.1f}us, max {t.max / 1000:.1f}us"
+                )
+        return lines
@@ -0,0 +1,184 @@
+# KFO-Server, an Attorney Online server
+#
+# Copyright (C) 2020 Crystalwarrior <varsash@gmail.com>
+#
+# Derivative of tsuserver3, an Attorney Online server. Copyright (C) 2016 argoneus <argoneuscze@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import os
+from itertools import chain, count
+
+import oyaml as yaml  # ordered yaml
+
+# Every compiled list gets a version of its own, so a composed view can tell
+# whether any of its layers changed just by comparing versions.
+_versions = count(1)
+
+
+class MusicList:
+    """A music list, compiled once into lookups and never changed afterwards.
+
+    Iterating it still gives the items of the YAML list it came from, so code
+    that walks categories and their songs keeps working.
+    """
+
+    __slots__ = ("items", "version", "names", "songs", "categories")
+
+    def __init__(self, items=()):
+        """
+        :param items: music list as loaded from YAML
+        """
+        self.items = tuple(items)
+        self.version = next(_versions) if self.items else 0
+        names = []
+        # name -> (name, length), first match wins like the old linear scans
+        songs = {}
+        categories = set()
+        for item in self.items:
+            if "category" not in item:  # skip settings n stuff
+                continue
+            category = item["category"]
+            names.append(category)
+            categories.add(category)
+            songs.setdefault(category, (category, 0))
+            for song in item.get("songs", ()):
+                names.append(song["name"])
+                songs.setdefault(song["name"], (song["name"], song.get("length", -1)))
+        self.names = tuple(names)
+        self.songs = songs
+        self.categories = frozenset(categories)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def get(self, name):
+        """Get (name, length) of a track or category, or None."""
+        return self.songs.get(name)
+
+    def is_category(self, name):
+        """Whether name is one of the categories."""
+        return name in self.categories
+
+
+EMPTY = MusicList()
+
+
+class MusicView:
+    """Music lists layered on top of each other, read as if concatenated.
+
+    The version is made of the versions of the layers, so two views with the
+    same version show the exact same songs.
+    """
+
+    __slots__ = ("layers", "version", "_names")
+
+    def __init__(self, layers):
+        """
+        :param layers: MusicLists, in the order they're shown
+        """
+        self.layers = layers
+        self.version = tuple(layer.version for layer in layers)
+        self._names = None
+
+    @property
+    def names(self):
+        """Categories and song names of every layer, as sent in FM and SM."""
+        if self._names is None:
+            if len(self.layers) == 1:
+                self._names = self.layers[0].names
+            else:
+                self._names = tuple(
+                    chain.from_iterable(layer.names for layer in self.layers))
+        return self._names
+
+    def __iter__(self):
+        return chain.from_iterable(self.layers)
+
+    def __len__(self):
+        return sum(len(layer) for layer in self.layers)
+
+    def get(self, name):
+        """Get (name, length) of a track or category, or None."""
+        for layer in self.layers:
+            song = layer.songs.get(name)
+            if song is not None:
+                return song
+        return None
+
+    def is_category(self, name):
+        """Whether name is a category of any layer."""
+        return any(name in layer.categories for layer in self.layers)
+
+
+class MusicCatalog:
+    """Compiles music lists and hands out shared views of layered ones."""
+
+    # Composed views to keep around, plenty for every hub/area/client combination in use
+    MAX_VIEWS = 256
+
+    def __init__(self):
+        self.views = {}
+
+    def compile(self, items):
+        """
+        Compile a music list loaded from YAML.
+        :param items: music list
+        :returns: MusicList
+        """
+        if not items:
+            return EMPTY
+        return MusicList(items)
+
+    def load(self, path):
+        """
+        Load and compile a music list from a YAML file.
+        Songs of lists with use_unique_folder are prefixed with the file name.
+        :param path: path to the YAML file
+        :returns: MusicList
+        """
+        with open(path, "r", encoding="utf-8") as stream:
+            items = yaml.safe_load(stream)
+
+        prepath = ""
+        for item in items:
+            if "use_unique_folder" in item and item["use_unique_folder"] is True:
+                prepath = os.path.splitext(os.path.basename(path))[0] + "/"
+
+            if "category" not in item:
+                continue
+
+            if "songs" in item:
+                for song in item["songs"]:
+                    song["name"] = prepath + song["name"]
+        return self.compile(items)
+
+    def compose(self, layers):
+        """
+        Get the view of several music lists on top of each other.
+        :param layers: MusicLists, in the order they're shown
+        :returns: MusicView, the same one for as long as none of the layers change
+        """
+        layers = tuple(layer for layer in layers if len(layer) > 0)
+        key = tuple(layer.version for layer in layers)
+        view = self.views.get(key)
+        if view is None:
+            if len(self.views) >= self.MAX_VIEWS:
+                self.views.clear()
+            view = self.views[key] = MusicView(layers)
+        return view
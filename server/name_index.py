@@ -0,0 +1,94 @@
+# KFO-Server, an Attorney Online server
+#
+# Copyright (C) 2020 Crystalwarrior <varsash@gmail.com>
+#
+# Derivative of tsuserver3, an Attorney Online server. Copyright (C) 2016 argoneus <argoneuscze@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+from operator import attrgetter
+
+from server.client_registry import file_under, unfile_from
+
+EMPTY = ()
+
+
+class NameIndex:
+    """Areas or hubs by lowercase name and by abbreviation.
+
+    The owner adds and removes them as they come and go, and their name and
+    abbreviation setters tell it whenever they change. Lookups give every
+    match ordered by ID, as several may share a name.
+    """
+
+    def __init__(self, fold_abbreviations=False):
+        """
+        :param fold_abbreviations: look abbreviations up ignoring case too
+        """
+        self.fold_abbreviations = fold_abbreviations
+        self.members = set()
+        # lowercase name -> members
+        self.names = {}
+        # abbreviation, lowercase if folded -> members
+        self.abbreviations = {}
+
+    def add(self, member):
+        """
+        Start indexing an area or hub.
+        :param member: area or hub to add
+        """
+        self.members.add(member)
+        file_under(self.names, member.name.lower(), member)
+        file_under(self.abbreviations, self._fold(member.abbreviation), member)
+
+    def remove(self, member):
+        """
+        Stop indexing an area or hub.
+        :param member: area or hub to remove
+        """
+        if member not in self.members:
+            return
+        self.members.discard(member)
+        unfile_from(self.names, member.name.lower(), member)
+        unfile_from(self.abbreviations, self._fold(member.abbreviation), member)
+
+    def renamed(self, member, old, new):
+        """Move a member around after its name changed."""
+        if member in self.members:
+            unfile_from(self.names, old.lower(), member)
+            file_under(self.names, new.lower(), member)
+
+    def reabbreviated(self, member, old, new):
+        """Move a member around after its abbreviation changed."""
+        if member in self.members:
+            unfile_from(self.abbreviations, self._fold(old), member)
+            file_under(self.abbreviations, self._fold(new), member)
+
+    def named(self, name):
+        """Get the members with a name, ignoring case, ordered by ID."""
+        return self._sorted(self.names.get(name.lower(), EMPTY))
+
+    def abbreviated(self, abbreviation):
+        """Get the members with an abbreviation, ordered by ID."""
+        return self._sorted(self.abbreviations.get(self._fold(abbreviation), EMPTY))
+
+    def _fold(self, abbreviation):
+        return abbreviation.lower() if self.fold_abbreviations else abbreviation
+
+    @staticmethod
+    def _sorted(members):
+        if len(members) <= 1:
+            return list(members)
+        return sorted(members, key=attrgetter("id"))
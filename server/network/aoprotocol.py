@@ -21,13 +21,17 @@ from .. import commands
 from server.constants import dezalgo, censor, contains_URL
 from server.exceptions import ClientError, AreaError, ArgumentError, ServerError
 from server import database
+from server.network.framing import FrameBuffer
+from server.network.ingress import ConnectionIngress
+from server.network import packets
+from server.network.profiles import ClientProfile
 import time
 import arrow
-from enum import Enum
 import asyncio
 import re
 import unicodedata
 import traceback
+from itertools import chain
 import logging
 
 logger_debug = logging.getLogger("debug")
@@ -37,20 +41,19 @@ logger = logging.getLogger("events")
 class AOProtocol(asyncio.Protocol):
     """The main class that deals with the AO protocol."""
 
-    class ArgType(Enum):
-        """Represents the data type of an argument for a network command."""
-
-        STR = (1,)
-        STR_OR_EMPTY = (2,)
-        INT = (3,)
-        INT_OR_STR = 3
+    ArgType = packets.ArgType
 
     def __init__(self, server):
         super().__init__()
         self.server = server
         self.client = None
-        self.buffer = ""
+        packet_size = 1024  # in bits
+        if "packet_size" in self.server.config:
+            packet_size = self.server.config["packet_size"]
+        # convert bits to bytes
+        self.buffer = FrameBuffer(packet_size * 8)
         self.ping_timeout = None
+        self.ingress = None
 
     def data_received(self, data):
         """Handles any data received from the network.
@@ -61,42 +64,36 @@ class AOProtocol(asyncio.Protocol):
         :param data: bytes of data
 
         """
-        buf = data
         ipid = self.client.ipid
 
-        if buf is None:
-            buf = b""
-
-        if not isinstance(buf, str):
-            # try to decode as utf-8, ignore any erroneous characters
-            buf = self.buffer + buf.decode("utf-8", "ignore")
-
-        buf = buf.translate({ord(c): None for c in "\0"})
-
-        packet_size = 1024  # in bits
-        if "packet_size" in self.server.config:
-            packet_size = self.server.config["packet_size"]
-
-        if len(buf) > packet_size * 8:  # convert bits to bytes
+        messages = self.buffer.feed(data)
+        if self.buffer.overflow:
             self.client.send_ooc(
                 "Your last action was dropped because it was too big! Contact the server administrator for more information."
             )
-            logger_debug.debug(f"Buffer overflow from {ipid} with {len(buf)}")
-            return
-        self.buffer = buf
-        for msg in self.get_messages():
+            logger_debug.debug(f"Buffer overflow from {ipid}")
+        for msg in messages:
             if len(msg) < 2:
                 continue
-            try:
-                cmd, *args = msg.split("#")
-                self.net_cmd_dispatcher[cmd](self, args)
-            except KeyError:
-                logger_debug.debug(
-                    f"Unknown incoming message from {ipid}: {msg}")
-            except Exception:
-                print(traceback.format_exc())
-                self.client.disconnect()
-                raise
+            # Over budget messages might be held back, dropped or get us disconnected
+            self.ingress.feed(msg)
+
+    def handle_message(self, msg):
+        """Dispatches a single message that made it past the ingress limiter.
+
+        :param msg: decoded message without its terminator
+
+        """
+        try:
+            cmd, *args = msg.split("#")
+            self.dispatch(cmd, args)
+        except KeyError:
+            logger_debug.debug(
+                f"Unknown incoming message from {self.client.ipid}: {msg}")
+        except Exception:
+            print(traceback.format_exc())
+            self.client.disconnect()
+            raise
 
     def connection_made(self, transport):
         """Called upon a new client connecting
@@ -108,6 +105,9 @@ class AOProtocol(asyncio.Protocol):
         except ClientError:
             transport.close()
             return
+        self.ingress = ConnectionIngress(
+            self.server.ingress, self.client.ipid, self.handle_message, self.client.disconnect
+        )
 
         if not self.server.client_manager.new_client_preauth(self.client):
             self.client.send_command(
@@ -119,7 +119,7 @@ class AOProtocol(asyncio.Protocol):
 
         # Client needs to send CHECK#% within the timeout - otherwise,
         # it will be automatically dropped.
-        self.ping_timeout = asyncio.get_running_loop().call_later(
+        self.ping_timeout = self.server.timers.call_later(
             self.server.config["timeout"], self.client.disconnect
         )
 
@@ -134,62 +134,62 @@ class AOProtocol(asyncio.Protocol):
         """
         if self.client is not None:
             logger.debug(f"{self.client.ipid} disconnected.")
+            self.client.outbound.clear()
             self.server.remove_client(self.client)
         if self.ping_timeout is not None:
             self.ping_timeout.cancel()
+        if self.ingress is not None:
+            self.ingress.close()
 
-    def get_messages(self):
-        """Parses out full messages from the buffer.
-
-        :return: yields messages
+    def pause_writing(self):
+        """Called by the transport when the client isn't reading fast enough."""
+        if self.client is not None:
+            self.client.outbound.pause()
 
-        """
-        while "#%" in self.buffer:
-            spl = self.buffer.split("#%", 1)
-            self.buffer = spl[1]
-            yield spl[0]
+    def resume_writing(self):
+        """Called by the transport when the client caught up again."""
+        if self.client is not None:
+            self.client.outbound.resume()
 
-    def validate_net_cmd(self, args, *types, needs_auth=True):
-        """Makes sure the net command's arguments match expectations.
+    def dispatch(self, cmd, args):
+        """Parses a net command with its schema and passes it to its handler.
 
+        :param cmd: name of the net command
         :param args: actual arguments to the net command
-        :param types: what kind of data types are expected
-        :param needs_auth: whether you need to have chosen a character (Default value = True)
-        :param *types: list of types corresponding to each argument in the command
-        :returns: returns True if message was validated
+        :raises KeyError: if the net command is unknown
 
         """
-        if needs_auth and (self.client.char_id is None or self.client.char_id == -1):
-            return False
-        if len(args) != len(types):
-            return False
-        for i, arg in enumerate(args):
-            if len(str(arg)) == 0 and types[i] != self.ArgType.STR_OR_EMPTY:
-                return False
-            if types[i] == self.ArgType.INT:
-                try:
-                    args[i] = int(arg)
-                except ValueError:
-                    return False
-        return True
-
-    def net_cmd_hi(self, args):
+        schema = packets.schemas[cmd]
+        handler = self.net_cmd_dispatcher[cmd]
+        metrics = self.server.metrics
+        if schema.needs_auth and (self.client.char_id is None or self.client.char_id == -1):
+            metrics.count(f"packets.unauthorized.{cmd}")
+            return
+        start = time.perf_counter_ns()
+        packet = schema.parse(args)
+        parsed = time.perf_counter_ns()
+        metrics.observe(f"parse.{cmd}", parsed - start)
+        if packet is None:
+            metrics.count(f"packets.rejected.{cmd}")
+            return
+        handler(self, packet)
+        metrics.observe(f"handler.{cmd}", time.perf_counter_ns() - parsed)
+
+    def net_cmd_hi(self, packet):
         """Handshake.
 
         HI#<hdid:string>#%
 
-        :param args: a list containing all the arguments
+        :param packet: a packets.HI record
 
         """
-        if not self.validate_net_cmd(args, self.ArgType.STR, needs_auth=False):
-            return
         # We already got an assigned hdid by the server
         if self.client.hdid != "":
             self.client.send_command(
                 "KB", "Your HDID was sent a second time by your client.")
             self.client.disconnect()
             return
-        hdid = self.client.hdid = args[0]
+        hdid = self.client.hdid = packet.hdid
         ipid = self.client.ipid
 
         database.add_hdid(ipid, hdid)
@@ -222,10 +222,10 @@ class AOProtocol(asyncio.Protocol):
             "PN", self.server.player_count, self.server.config["playerlimit"]
         )
 
-    def net_cmd_id(self, args):
-        """Client version and PV
+    def net_cmd_id(self, packet):
+        """Client software and version
 
-        ID#<pv:int>#<software:string>#<version:string>#%
+        ID#<software:string>#<version:string>#%
         """
         # We already got an assigned version by the server
         if self.client.version != "":
@@ -233,22 +233,13 @@ class AOProtocol(asyncio.Protocol):
                 "KB", "Your client version was sent a second time by your client.")
             self.client.disconnect()
             return
-        self.client.version = args[1]
-        preflist = self.client.server.supported_features.copy()
-        if not self.client.area.area_manager.arup_enabled and "arup" in preflist:
-            preflist.remove("arup")
-        self.client.send_command("FL", *preflist)
-
-        # Get the list of version vars, making sure the size of the least is at least 3 args
-        verlist = self.client.version.split('.')
-        if len(verlist) == 3:
-            # Get the version string
-            release, major, minor = verlist
-
-            # If we have someone joining with clients 2.8 and above
-            if int(release) >= 2 and int(major) >= 8:
-                # Let them hear ambience
-                self.client.has_multilayer_audio = True
+        self.client.version = packet.version
+        # Work out everything we need to know about their client in one go
+        self.client.profile = ClientProfile.get(
+            packet.software, packet.version, self.server.supported_features
+        )
+        self.client.send_feature_list(
+            self.client.area.area_manager.arup_enabled)
 
         # If we have someone using the DRO 1.1.0 Client joining
         # if self.client.version.startswith("1.1.0"):
@@ -265,10 +256,7 @@ class AOProtocol(asyncio.Protocol):
         CHECK#%
         """
         self.client.send_command("CHECK")
-        self.ping_timeout.cancel()
-        self.ping_timeout = asyncio.get_running_loop().call_later(
-            self.server.config["timeout"], self.client.disconnect
-        )
+        self.ping_timeout.reschedule(self.server.config["timeout"])
 
         # Update the timers thru handshake as well to make sure they're always in sync
         self.client.area.update_timers(self.client, running_only=True)
@@ -283,6 +271,17 @@ class AOProtocol(asyncio.Protocol):
         music_cnt = 0
         self.client.send_command("SI", char_cnt, evi_cnt, music_cnt)
 
+    def net_cmd_lh(self, packet):
+        """Lists the client has cached from an earlier connection
+
+        LH#<sc_hash:string_or_empty>#<sm_hash:string_or_empty>#%
+
+        Opts in to list caching: from then on the client is sent
+        LH#<SC or SM>#<hash>#% before each of those lists, and the list itself
+        is left out when it's the one the client already has.
+        """
+        self.client.list_hashes = {"SC": packet.sc_hash, "SM": packet.sm_hash}
+
     def net_cmd_rc(self, _):
         """Asks for the whole character list (AO2)
 
@@ -321,9 +320,14 @@ class AOProtocol(asyncio.Protocol):
             songs = self.client.local_music_list
         else:
             songs = self.server.music_list
-        song_list += self.server.build_music_list(songs)
 
-        self.client.send_command("SM", *song_list)
+        # Clients seeing the same areas and music get the same packet
+        self.client.send_cached(
+            ("SM", tuple(song_list), songs.version),
+            "SM",
+            lambda: song_list + list(self.server.build_music_list(songs)),
+            skippable=True,
+        )
 
     def net_cmd_rd(self, _):
         """Asks for server metadata(charscheck, motd etc.) and a DONE#% signal(also best packet)
@@ -347,29 +351,25 @@ class AOProtocol(asyncio.Protocol):
                 self.client.area.music_effects,
             )
 
-    def net_cmd_cc(self, args):
+    def net_cmd_cc(self, packet):
         """Character selection.
 
         CC#<client_id:int>#<char_id:int>#<hdid:string>#%
 
         """
-        if not self.validate_net_cmd(
-            args, self.ArgType.INT, self.ArgType.INT, self.ArgType.STR, needs_auth=False
-        ):
-            return
-        elif not self.client.is_checked:
+        if not self.client.is_checked:
             return
 
-        cid = args[1]
+        cid = packet.char_id
         try:
             self.client.change_character(cid)
         except ClientError:
             return
 
-    def net_cmd_ms(self, args):
+    def net_cmd_ms(self, packet):
         """IC message.
 
-        Refer to the implementation for details.
+        Refer to packets.MS for the layouts.
 
         """
         if not self.client.is_checked:
@@ -378,200 +378,39 @@ class AOProtocol(asyncio.Protocol):
             self.client.send_ooc("You are muted by a moderator.")
             return
 
-        showname = ""
-        charid_pair = -1
-        offset_pair = 0
-        nonint_pre = 0
-        sfx_looping = "0"
-        screenshake = 0
-        frames_shake = ""
-        frames_realization = ""
-        frames_sfx = ""
-        additive = 0
-        effect = ""
+        (
+            msg_type,
+            pre,
+            folder,
+            anim,
+            text,
+            pos,
+            sfx,
+            emote_mod,
+            cid,
+            sfx_delay,
+            button,
+            evidence,
+            flip,
+            ding,
+            color,
+            showname,
+            charid_pair,
+            offset_pair,
+            nonint_pre,
+            sfx_looping,
+            screenshake,
+            frames_shake,
+            frames_realization,
+            frames_sfx,
+            additive,
+            effect,
+            video,
+            blankpost,
+        ) = packet
         pair_order = 0
-        if self.validate_net_cmd(
-            args,
-            self.ArgType.STR,  # msg_type
-            self.ArgType.STR_OR_EMPTY,
-            self.ArgType.STR,  # pre, folder
-            self.ArgType.STR_OR_EMPTY,
-            self.ArgType.STR_OR_EMPTY,  # anim, text
-            self.ArgType.STR,
-            self.ArgType.STR,  # pos, sfx
-            self.ArgType.INT,
-            self.ArgType.INT,  # emote_mod, cid
-            self.ArgType.INT,
-            self.ArgType.INT_OR_STR,  # sfx_delay, button
-            self.ArgType.INT,
-            self.ArgType.INT,  # evidence, flip
-            self.ArgType.INT,
-            self.ArgType.INT,  # ding, color
-        ):
-            # Pre-2.6 validation monstrosity.
-            (
-                msg_type,
-                pre,
-                folder,
-                anim,
-                text,
-                pos,
-                sfx,
-                emote_mod,
-                cid,
-                sfx_delay,
-                button,
-                evidence,
-                flip,
-                ding,
-                color,
-            ) = args
-        elif self.validate_net_cmd(
-            args,
-            self.ArgType.STR,  # msg_type
-            self.ArgType.STR_OR_EMPTY,
-            self.ArgType.STR,  # pre, folder
-            self.ArgType.STR_OR_EMPTY,
-            self.ArgType.STR_OR_EMPTY,  # anim, text
-            self.ArgType.STR,
-            self.ArgType.STR,  # pos, sfx
-            self.ArgType.INT,
-            self.ArgType.INT,  # emote_mod, cid
-            self.ArgType.INT,
-            self.ArgType.INT_OR_STR,  # sfx_delay, button
-            self.ArgType.INT,
-            self.ArgType.INT,  # evidence, flip
-            self.ArgType.INT,
-            self.ArgType.INT,  # ding, color
-            self.ArgType.STR_OR_EMPTY,  # DRO Showname
-            self.ArgType.STR_OR_EMPTY,  # DRO Video
-            self.ArgType.INT,  # 0 or 1, DRO hide_character
-        ):
-            # DRO1.1.0 validation monstrosity.
-            (
-                msg_type,
-                pre,
-                folder,
-                anim,
-                text,
-                pos,
-                sfx,
-                emote_mod,
-                cid,
-                sfx_delay,
-                button,
-                evidence,
-                flip,
-                ding,
-                color,
-                showname,
-                video,
-                blankpost,
-            ) = args
-            if ding != 1:
-                ding = 0
-        elif self.validate_net_cmd(
-            args,
-            self.ArgType.STR,
-            self.ArgType.STR_OR_EMPTY,  # msg_type, pre
-            self.ArgType.STR,
-            self.ArgType.STR_OR_EMPTY,
-            self.ArgType.STR_OR_EMPTY,  # folder, anim, text
-            self.ArgType.STR,
-            self.ArgType.STR,
-            self.ArgType.INT,  # pos, sfx, emote_mod
-            self.ArgType.INT,
-            self.ArgType.INT,
-            self.ArgType.INT_OR_STR,  # cid, sfx_delay, button
-            self.ArgType.INT,
-            self.ArgType.INT,
-            self.ArgType.INT,  # evidence, flip, ding
-            self.ArgType.INT,
-            self.ArgType.STR_OR_EMPTY,
-            self.ArgType.INT,  # color, showname, charid_pair
-            self.ArgType.INT,
-            self.ArgType.INT,  # offset_pair, nonint_pre
-        ):
-            # 2.6 validation monstrosity.
-            (
-                msg_type,
-                pre,
-                folder,
-                anim,
-                text,
-                pos,
-                sfx,
-                emote_mod,
-                cid,
-                sfx_delay,
-                button,
-                evidence,
-                flip,
-                ding,
-                color,
-                showname,
-                charid_pair,
-                offset_pair,
-                nonint_pre,
-            ) = args
-        elif self.validate_net_cmd(
-            args,
-            self.ArgType.STR,
-            self.ArgType.STR_OR_EMPTY,  # msg_type, pre
-            self.ArgType.STR,
-            self.ArgType.STR_OR_EMPTY,
-            self.ArgType.STR_OR_EMPTY,  # folder, anim, text
-            self.ArgType.STR,
-            self.ArgType.STR,
-            self.ArgType.INT,  # pos, sfx, emote_mod
-            self.ArgType.INT,
-            self.ArgType.INT,
-            self.ArgType.INT_OR_STR,  # cid, sfx_delay, button
-            self.ArgType.INT,
-            self.ArgType.INT,
-            self.ArgType.INT,  # evidence, flip, ding
-            self.ArgType.INT,
-            self.ArgType.STR_OR_EMPTY,
-            self.ArgType.STR,  # color, showname, charid_pair
-            self.ArgType.STR,
-            self.ArgType.INT,
-            self.ArgType.STR,  # offset_pair, nonint_pre, sfx_looping
-            self.ArgType.INT,
-            self.ArgType.STR,
-            self.ArgType.STR,  # screenshake, frames_shake, frames_realization
-            self.ArgType.STR,
-            self.ArgType.INT,
-            self.ArgType.STR,  # frames_sfx, additive, effect
-        ):
-            # 2.8 validation monstrosity. (rip 2.7)
-            (
-                msg_type,
-                pre,
-                folder,
-                anim,
-                text,
-                pos,
-                sfx,
-                emote_mod,
-                cid,
-                sfx_delay,
-                button,
-                evidence,
-                flip,
-                ding,
-                color,
-                showname,
-                charid_pair,
-                offset_pair,
-                nonint_pre,
-                sfx_looping,
-                screenshake,
-                frames_shake,
-                frames_realization,
-                frames_sfx,
-                additive,
-                effect,
-            ) = args
+        # 2.8 sends the pair order along with the pair, e.g. 5^1
+        if isinstance(charid_pair, str):
             try:
                 pair_args = charid_pair.split("^")
                 charid_pair = int(pair_args[0])
@@ -581,8 +420,6 @@ class AOProtocol(asyncio.Protocol):
                 self.client.send_ooc(
                     "Something went wrong! Please report the issue to the developers.")
                 return
-        else:
-            return
 
         # Targets for whispering
         whisper_clients = None
@@ -614,7 +451,7 @@ class AOProtocol(asyncio.Protocol):
                 f"Iniswap/custom emotes are blocked in this area for character {folder}, pre {pre} anim {anim}."
             )
             return
-        if len(self.client.charcurse) > 0 and folder != self.client.char_name:
+        if self.client.charcursed and folder != self.client.char_name:
             self.client.send_ooc(
                 "You may not iniswap while you are charcursed!")
             return
@@ -706,9 +543,11 @@ class AOProtocol(asyncio.Protocol):
                         self.client.send_ooc(f"You don't own {area.name}!")
                         return
                 if len(target_area) <= 0:
-                    for a in self.client.area.area_manager.areas:
-                        if self.client in a.owners:
-                            target_area.append(a)
+                    hub = self.client.area.area_manager
+                    target_area = sorted(
+                        (a for a in self.client.owned_areas if a.area_manager == hub),
+                        key=lambda a: a.id,
+                    )
                     part = part[1:]
                 else:
                     part = part[2:]
@@ -879,15 +718,17 @@ class AOProtocol(asyncio.Protocol):
 
                 if len(clients) > 0:
                     part = part[1:]
+                    index = self.client.area.index
                     whisper_clients = [
-                        c for c in self.client.area.clients if str(c.id) in clients and not c == self.client
+                        c for c in map(index.get, dict.fromkeys(map(int, clients)))
+                        if c is not None and not c == self.client
                     ]
                     clients = ",".join(clients)
                 else:
                     whisper_clients = [
                         c
-                        for c in self.client.area.clients
-                        if c.pos == self.client.pos and not c == self.client
+                        for c in self.client.area.index.at_pos(self.client.pos)
+                        if not c == self.client
                     ]
                     clients = ""
                 text = " ".join(part)
@@ -967,10 +808,9 @@ class AOProtocol(asyncio.Protocol):
 
         confirmed = False
         if charid_pair > -1:
-            for target in self.client.area.clients:
+            for target in self.client.area.index.with_char_id(self.client.charid_pair):
                 if (
                     not confirmed
-                    and target.char_id == self.client.charid_pair
                     and target.charid_pair == self.client.char_id
                     and target != self.client
                     and target.pos == self.client.pos
@@ -987,20 +827,19 @@ class AOProtocol(asyncio.Protocol):
         if not confirmed:
             charid_pair = -1
 
-        ver = self.client.version.split('.')
-        if len(ver) >= 2:
-            # Client versions 2.9 or less need to get their SFX corrected due to 2.10 changes
-            if ver[0].isnumeric() and int(ver[0]) <= 2 and ver[1].isnumeric() and int(ver[1]) <= 9:
-                if emote_mod not in (1, 6):
-                    sfx = ''
+        # Client versions 2.9 or less need to get their SFX corrected due to 2.10 changes
+        if self.client.profile.legacy_sfx and emote_mod not in (1, 6):
+            sfx = ''
 
         if whisper_clients is not None:
             whisper_clients.insert(0, self.client)
-            for client in self.client.area.clients:
-                if client in whisper_clients:
+            # Mods and CMs of the area overhear every whisper
+            index = self.client.area.index
+            for client in chain(self.server.client_manager.registry.mods,
+                                self.client.area.owners):
+                if client in whisper_clients or index.get(client.id) is not client:
                     continue
-                if client.is_mod or client in self.client.area.owners:
-                    whisper_clients.append(client)
+                whisper_clients.append(client)
 
         if len(target_area) > 0:
             try:
@@ -1238,7 +1077,7 @@ class AOProtocol(asyncio.Protocol):
             effect,
         )
 
-    def net_cmd_ct(self, args):
+    def net_cmd_ct(self, packet):
         """OOC Message
 
         CT#<name:string>#<message:string>#%
@@ -1252,16 +1091,13 @@ class AOProtocol(asyncio.Protocol):
         ):  # Checks to see if the client has been muted by a mod
             self.client.send_ooc("You are muted by a moderator.")
             return
-        if not self.validate_net_cmd(
-            args, self.ArgType.STR_OR_EMPTY, self.ArgType.STR, needs_auth=False
-        ):
-            return
-        args[0] = args[0].strip()
-        if args[0] == "":
+        ooc_name = packet.name.strip()
+        message = packet.message
+        if ooc_name == "":
             self.client.send_ooc(
                 "You must insert your OOC Name into 'Name' before you can speak.")
             return
-        if len(args[0]) > 30:
+        if len(ooc_name) > 30:
             self.client.send_ooc(
                 "Your OOC name is too long! Limit it to 30 characters."
             )
@@ -1271,15 +1107,15 @@ class AOProtocol(asyncio.Protocol):
                 f"You are using OOC too fast. Please try again after {int(self.client.ooc_mute())} seconds."
             )
             return
-        for c in args[0]:
+        for c in ooc_name:
             if unicodedata.category(c) == "Cf":
                 self.client.send_ooc(
                     "You cannot use format characters in your name!")
                 return
         if (
-            args[0].startswith(self.server.config["hostname"])
-            or args[0].startswith("<dollar>G")
-            or args[0].startswith("<dollar>M")
+            ooc_name.startswith(self.server.config["hostname"])
+            or ooc_name.startswith("<dollar>G")
+            or ooc_name.startswith("<dollar>M")
         ):
             self.client.send_ooc("That name is reserved!")
             return
@@ -1291,49 +1127,49 @@ class AOProtocol(asyncio.Protocol):
             and len(self.server.censors) > 0
         ):
             # Censor the name
-            args[0] = censor(
-                args[0],
+            ooc_name = censor(
+                ooc_name,
                 self.server.censors["whole"],
                 self.server.censors["replace"],
                 True,
             )
-            args[0] = censor(
-                args[0],
+            ooc_name = censor(
+                ooc_name,
                 self.server.censors["partial"],
                 self.server.censors["replace"],
                 False,
             )
 
             # Censor the text
-            args[1] = censor(
-                args[1],
+            message = censor(
+                message,
                 self.server.censors["whole"],
                 self.server.censors["replace"],
                 True,
             )
-            args[1] = censor(
-                args[1],
+            message = censor(
+                message,
                 self.server.censors["partial"],
                 self.server.censors["replace"],
                 False,
             )
 
-        if not self.client.is_valid_name(args[0]):
+        if not self.client.is_valid_name(ooc_name):
             self.client.send_ooc(
                 "Your OOC name is invalid!"
             )
             return
 
-        self.client.name = args[0]
-        if args[1].lstrip() != args[1] and args[1].lstrip().startswith("/"):
+        self.client.name = ooc_name
+        if message.lstrip() != message and message.lstrip().startswith("/"):
             self.client.send_ooc(
                 "Your message was not sent for safety reasons: you left space before that slash."
             )
             return
         database.log_area("chat.ooc", self.client,
-                          self.client.area, message=args[1])
-        if args[1].startswith("/"):
-            spl = args[1][1:].split(" ", 1)
+                          self.client.area, message=message)
+        if message.startswith("/"):
+            spl = message[1:].split(" ", 1)
             cmd = spl[0].lower()
             arg = ""
             if len(spl) == 2:
@@ -1354,7 +1190,7 @@ class AOProtocol(asyncio.Protocol):
             max_char = int(self.server.config["max_chars"])
         except Exception:
             max_char = 256
-        if len(args[1]) > max_char:
+        if len(message) > max_char:
             self.client.send_ooc("Your message is too long!")
             return
 
@@ -1367,17 +1203,17 @@ class AOProtocol(asyncio.Protocol):
             name = "[CM]"
 
         name = f"{prefix}{self.client.name}"
-        args[1] = dezalgo(args[1], self.server.zalgo_tolerance)
+        message = dezalgo(message, self.server.zalgo_tolerance)
         if self.client.shaken:
-            args[1] = self.client.shake_message(args[1])
+            message = self.client.shake_message(message)
         if self.client.disemvowel:
-            args[1] = self.client.disemvowel_message(args[1])
-        self.client.area.send_command("CT", name, args[1])
+            message = self.client.disemvowel_message(message)
+        self.client.area.send_command("CT", name, message)
         self.client.area.send_owner_command(
-            "CT", f"[{self.client.area.id}]{name}", args[1]
+            "CT", f"[{self.client.area.id}]{name}", message
         )
 
-    def net_cmd_mc(self, args):
+    def net_cmd_mc(self, packet):
         """Play music.
 
         MC#<song_name:str>#<char_id:int>#<show_name:str_or_empty>#<effects:int>#%
@@ -1386,36 +1222,18 @@ class AOProtocol(asyncio.Protocol):
         if not self.client.is_checked:
             return
 
-        if args[0].split()[0].startswith("🌍["):
+        if packet.song.lstrip().startswith("🌍["):
             # self.client.send_ooc('Switching to the list of Hubs...')
             self.client.viewing_hub_list = True
-            preflist = self.client.server.supported_features.copy()
-            preflist.remove("arup")
-            self.client.send_command("FL", *preflist)
-            for hub in self.client.server.hub_manager.hubs:
-                count = 0
-                for c in hub.clients:
-                    if not c.area.hide_clients and not c.hidden:
-                        count = count + 1
-                hub.count = count
+            self.client.send_feature_list(False)
             self.client.send_command(
-                "FA",
-                *[
-                    "🌐 Hubs 🌐\n Double-Click me to see Areas\n  _______",
-                    *[
-                        f"[{hub.id}] {hub.name} (users: {hub.count})"
-                        for hub in self.client.server.hub_manager.hubs
-                    ],
-                ],
-            )
+                "FA", *self.client.server.hub_manager.hub_list())
             return
-        if args[0].split("\n")[0] == "🌐 Hubs 🌐":
+        if packet.song.split("\n")[0] == "🌐 Hubs 🌐":
             # self.client.send_ooc('Switching to the list of Areas...')
             self.client.viewing_hub_list = False
-            preflist = self.client.server.supported_features.copy()
-            if not self.client.area.area_manager.arup_enabled:
-                preflist.remove("arup")
-            self.client.send_command("FL", *preflist)
+            self.client.send_feature_list(
+                self.client.area.area_manager.arup_enabled)
             self.client.reload_area_list(self.client.local_area_list)
             self.client.area.area_manager.send_arup_players([self.client])
             self.client.area.area_manager.send_arup_status([self.client])
@@ -1429,25 +1247,19 @@ class AOProtocol(asyncio.Protocol):
                 called_function = "ooc_cmd_hub"
             # We can get cheeky and spoof ARUP info with normal song names
             getattr(commands, called_function)(
-                self.client, args[0].split("\n")[0])
+                self.client, packet.song.split("\n")[0])
         except AreaError:
-            if not self.validate_net_cmd(args, self.ArgType.STR, self.ArgType.INT):
-                if not self.validate_net_cmd(
-                    args, self.ArgType.STR, self.ArgType.INT, self.ArgType.STR_OR_EMPTY
-                ):
-                    if not self.validate_net_cmd(
-                        args,
-                        self.ArgType.STR,
-                        self.ArgType.INT,
-                        self.ArgType.STR_OR_EMPTY,
-                        self.ArgType.INT,
-                    ):
-                        return
-            self.client.change_music(*args)
+            if packet.cid is None:
+                return
+            # You need a character to play music
+            if self.client.char_id is None or self.client.char_id == -1:
+                return
+            self.client.change_music(
+                packet.song, packet.cid, packet.showname, packet.effects)
         except ClientError as ex:
             self.client.send_ooc(ex)
 
-    def net_cmd_rt(self, args):
+    def net_cmd_rt(self, packet):
         """Plays the Testimony/CE animation.
 
         RT#<type:string>#%
@@ -1477,15 +1289,11 @@ class AOProtocol(asyncio.Protocol):
                 "You are not on the area's invite list, and thus, you cannot use the WTCE buttons!"
             )
             return
-        if not self.validate_net_cmd(
-            args, self.ArgType.STR
-        ) and not self.validate_net_cmd(args, self.ArgType.STR, self.ArgType.INT):
-            return
-        if args[0] == "testimony1":
+        if packet.anim == "testimony1":
             sign = "WT"
-        elif args[0] == "testimony2":
+        elif packet.anim == "testimony2":
             sign = "CE"
-        elif args[0] == "judgeruling":
+        elif packet.anim == "judgeruling":
             sign = "JR"
         else:
             return
@@ -1500,13 +1308,13 @@ class AOProtocol(asyncio.Protocol):
                 a_list = ", ".join([str(a.id)
                                    for a in self.client.broadcast_list])
                 self.client.send_ooc(f"Broadcasting to areas {a_list}")
-                if len(args) == 1:
+                if packet.variant is None:
                     self.client.area.area_manager.send_remote_command(
-                        self.client.broadcast_list, "RT", args[0]
+                        self.client.broadcast_list, "RT", packet.anim
                     )
-                elif len(args) == 2:
+                else:
                     self.client.area.area_manager.send_remote_command(
-                        self.client.broadcast_list, "RT", args[0], args[1]
+                        self.client.broadcast_list, "RT", packet.anim, packet.variant
                     )
             except (AreaError, ValueError):
                 self.client.send_ooc(
@@ -1514,10 +1322,10 @@ class AOProtocol(asyncio.Protocol):
                 )
                 return
 
-        if len(args) == 1:
-            self.client.area.send_command("RT", args[0])
-        elif len(args) == 2:
-            self.client.area.send_command("RT", args[0], args[1])
+        if packet.variant is None:
+            self.client.area.send_command("RT", packet.anim)
+        else:
+            self.client.area.send_command("RT", packet.anim, packet.variant)
         self.client.area.add_to_judgelog(self.client, f"used {sign}")
         database.log_area("wtce", self.client, self.client.area, message=sign)
 
@@ -1573,7 +1381,7 @@ class AOProtocol(asyncio.Protocol):
                         # Ignore those losers with listenpos for testimony
                         c.send_command("MS", *statement)
 
-    def net_cmd_setcase(self, args):
+    def net_cmd_setcase(self, packet):
         """Sets the casing preferences of the given client.
 
         SETCASE#<cases:string>#<will_cm:int>#<will_def:int>#<will_pro:int>#<will_judge:int>#<will_jury:int>#<will_steno:int>#%
@@ -1581,17 +1389,18 @@ class AOProtocol(asyncio.Protocol):
         Note: Though all but the first arguments are ints, they technically behave as bools of 0 and 1 value.
 
         """
-        self.client.casing_cases = args[0]
-        self.client.casing_cm = args[1] == "1"
-        self.client.casing_def = args[2] == "1"
-        self.client.casing_pro = args[3] == "1"
-        self.client.casing_jud = args[4] == "1"
-        self.client.casing_jur = args[5] == "1"
-        self.client.casing_steno = args[6] == "1"
-
-    def net_cmd_casea(self, args):
+        self.client.casing_cases = packet.cases
+        self.client.casing_cm = packet.will_cm == "1"
+        self.client.casing_def = packet.will_def == "1"
+        self.client.casing_pro = packet.will_pro == "1"
+        self.client.casing_jud = packet.will_jud == "1"
+        self.client.casing_jur = packet.will_jur == "1"
+        self.client.casing_steno = packet.will_steno == "1"
+
+    def net_cmd_casea(self, packet):
         """Announces a case with a title, and specific set of people to look for.
 
+        CASEA#<casetitle:string>#<need_def:int>#<need_pro:int>#<need_judge:int>#<need_jury:int>#<need_steno:int>#%
         CASEA#<casetitle:string>#<need_cm:int>#<need_def:int>#<need_pro:int>#<need_judge:int>#<need_jury:int>#<need_steno:int>#%
 
         Note: Though all but the first arguments are ints, they technically behave as bools of 0 and 1 value.
@@ -1606,26 +1415,27 @@ class AOProtocol(asyncio.Protocol):
                 )
                 return
 
-            if (
-                not args[1] == "1"
-                and not args[2] == "1"
-                and not args[3] == "1"
-                and not args[4] == "1"
-                and not args[5] == "1"
-            ):
+            needed = (
+                packet.need_def,
+                packet.need_pro,
+                packet.need_jud,
+                packet.need_jur,
+                packet.need_steno,
+            )
+            if "1" not in needed:
                 self.client.send_ooc(
                     "You should probably announce the case to at least one person."
                 )
                 return
             msg = "=== Case Announcement ===\r\n{} [{}] is hosting {}, looking for ".format(
-                self.client.showname, self.client.id, args[0]
+                self.client.showname, self.client.id, packet.title
             )
 
             lookingfor = [
                 p
                 for p, q in zip(
                     ["defense", "prosecutor", "judge", "juror", "stenographer"],
-                    args[1:],
+                    needed,
                 )
                 if q == "1"
             ]
@@ -1633,14 +1443,17 @@ class AOProtocol(asyncio.Protocol):
             msg += ", ".join(lookingfor) + ".\r\n=================="
 
             self.client.server.send_all_cmd_pred(
-                "CASEA", msg, args[1], args[2], args[3], args[4], args[5], "1"
+                "CASEA", msg, *needed, "1"
             )
 
             self.client.set_case_call_delay()
 
             log_data = {
                 k: v
-                for k, v in zip(("message", "def", "pro", "jud", "jur", "steno"), args)
+                for k, v in zip(
+                    ("message", "def", "pro", "jud", "jur", "steno"),
+                    (packet.title, *needed),
+                )
             }
             database.log_area("case", self.client,
                               self.client.area, message=log_data)
@@ -1649,7 +1462,7 @@ class AOProtocol(asyncio.Protocol):
                 "You cannot announce a case in an area where you are not a CM!"
             )
 
-    def net_cmd_hp(self, args):
+    def net_cmd_hp(self, packet):
         """Sets the penalty bar.
 
         HP#<type:int>#<new_value:int>#%
@@ -1665,43 +1478,31 @@ class AOProtocol(asyncio.Protocol):
                 "You are not on the area's invite list, and thus, you cannot change the Confidence bars!"
             )
             return
-        if not self.validate_net_cmd(args, self.ArgType.INT, self.ArgType.INT):
-            return
         try:
-            self.client.area.change_hp(args[0], args[1])
+            self.client.area.change_hp(packet.bar, packet.value)
             self.client.area.add_to_judgelog(
                 self.client, "changed the penalties")
             database.log_area("hp", self.client, self.client.area)
         except AreaError:
             return
 
-    def net_cmd_pe(self, args):
+    def net_cmd_pe(self, packet):
         """Adds a piece of evidence.
 
         PE#<name: string>#<description: string>#<image: string>#%
 
-        :param args:
+        :param packet: a packets.PE record
 
         """
         if not self.client.is_checked:
             return
-        if not self.validate_net_cmd(
-            args,
-            self.ArgType.STR_OR_EMPTY,
-            self.ArgType.STR_OR_EMPTY,
-            self.ArgType.STR_OR_EMPTY,
-        ):
-            return
-        if len(args) < 3:
-            return
-        # evi = Evidence(args[0], args[1], args[2], self.client.pos)
         self.client.area.evi_list.add_evidence(
-            self.client, args[0], args[1], args[2], "all"
+            self.client, packet.name, packet.desc, packet.image, "all"
         )
         database.log_area("evidence.add", self.client, self.client.area)
         self.client.area.broadcast_evidence_list()
 
-    def net_cmd_de(self, args):
+    def net_cmd_de(self, packet):
         """Deletes a piece of evidence.
 
         DE#<id: int>#%
@@ -1709,13 +1510,11 @@ class AOProtocol(asyncio.Protocol):
         """
         if not self.client.is_checked:
             return
-        if not self.validate_net_cmd(args, self.ArgType.INT):
-            return
-        self.client.area.evi_list.del_evidence(self.client, int(args[0]))
+        self.client.area.evi_list.del_evidence(self.client, packet.evi_id)
         database.log_area("evidence.del", self.client, self.client.area)
         self.client.area.broadcast_evidence_list()
 
-    def net_cmd_ee(self, args):
+    def net_cmd_ee(self, packet):
         """Edits a piece of evidence.
 
         EE#<id: int>#<name: string>#<description: string>#<image: string>#%
@@ -1723,24 +1522,13 @@ class AOProtocol(asyncio.Protocol):
         """
         if not self.client.is_checked:
             return
-        if not self.validate_net_cmd(
-            args,
-            self.ArgType.INT,
-            self.ArgType.STR_OR_EMPTY,
-            self.ArgType.STR_OR_EMPTY,
-            self.ArgType.STR_OR_EMPTY,
-        ):
-            return
-        elif len(args) < 4:
-            return
-
-        evi = (args[1], args[2], args[3], "all")
+        evi = (packet.name, packet.desc, packet.image, "all")
 
-        self.client.area.evi_list.edit_evidence(self.client, int(args[0]), evi)
+        self.client.area.evi_list.edit_evidence(self.client, packet.evi_id, evi)
         database.log_area("evidence.edit", self.client, self.client.area)
         self.client.area.broadcast_evidence_list()
 
-    def net_cmd_zz(self, args):
+    def net_cmd_zz(self, packet):
         """Sent on mod call."""
         if not self.client.is_checked:
             return
@@ -1754,7 +1542,7 @@ class AOProtocol(asyncio.Protocol):
             return
 
         current_time = time.strftime("%H:%M", time.gmtime())
-        if len(args) < 1:
+        if packet.reason is None:
             self.server.send_all_cmd_pred(
                 "ZZ",
                 "[{} UTC] {} ({}) in hub {} [{}]{} without reason (not using 2.6?)".format(
@@ -1782,33 +1570,35 @@ class AOProtocol(asyncio.Protocol):
                     self.client.area.area_manager.name,
                     self.client.area.abbreviation,
                     self.client.area.name,
-                    args[0][:100],
+                    packet.reason[:100],
                 ),
                 pred=lambda c: c.is_mod,
             )
             self.client.set_mod_call_delay()
             database.log_area("modcall", self.client,
-                              self.client.area, message=args[0])
+                              self.client.area, message=packet.reason)
             self.server.webhooks.modcall(
                 char=self.client.char_name,
                 ipid=self.client.ip,
                 area=self.client.area,
-                reason=args[0][:100],
+                reason=packet.reason[:100],
             )
 
-    def net_cmd_opKICK(self, args):
+    def net_cmd_opKICK(self, packet):
         """
         Unused; kick a user from the client UI.
 
         """
-        self.net_cmd_ct(["opkick", "/kick {}".format(args[0])])
+        self.net_cmd_ct(packets.CT.make(
+            "opkick", "/kick {}".format(packet.target)))
 
-    def net_cmd_opBAN(self, args):
+    def net_cmd_opBAN(self, packet):
         """
         Unused; ban a user from the client UI.
 
         """
-        self.net_cmd_ct(["opban", "/ban {}".format(args[0])])
+        self.net_cmd_ct(packets.CT.make(
+            "opban", "/ban {}".format(packet.target)))
 
     net_cmd_dispatcher = {
         "HI": net_cmd_hi,  # handshake
@@ -1818,6 +1608,7 @@ class AOProtocol(asyncio.Protocol):
         "RC": net_cmd_rc,  # character list
         "RM": net_cmd_rm,  # music list
         "RD": net_cmd_rd,  # done request, charscheck etc.
+        "LH": net_cmd_lh,  # hashes of cached lists
         "CC": net_cmd_cc,  # select character
         "MS": net_cmd_ms,  # IC message
         "CT": net_cmd_ct,  # OOC message
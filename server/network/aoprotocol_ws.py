@@ -16,6 +16,7 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import asyncio
+from collections import deque
 
 from websockets import ConnectionClosed
 
@@ -26,10 +27,37 @@ class AOProtocolWS(AOProtocol):
     """A websocket wrapper around AOProtocol."""
 
     class TransportWrapper:
-        """A class to wrap asyncio's Transport class."""
+        """A class to wrap asyncio's Transport class.
 
-        def __init__(self, websocket):
+        Everything written is handed to a single sender task per connection,
+        which sends it in order. Once too much is waiting, the protocol is
+        paused just like a TCP transport would, so the client's outbound
+        queue holds back the rest.
+        """
+
+        # Takes str as well as bytes, see OutboundQueue.
+        accepts_text = True
+
+        def __init__(self, websocket, protocol, batch=False, max_batch=65536):
+            """
+            :param websocket: the websocket connection
+            :param protocol: protocol to pause and resume
+            :param batch: send several AO packets in a single websocket message
+            :param max_batch: largest websocket message to build when batching
+            """
             self.ws = websocket
+            self.protocol = protocol
+            self.batch = batch
+            self.max_batch = max_batch
+            self.frames = deque()
+            # characters waiting in self.frames
+            self.size = 0
+            self.high_watermark = 65536
+            self.low_watermark = 16384
+            self.paused = False
+            self.closing = False
+            self.wakeup = asyncio.Event()
+            self.sender = asyncio.ensure_future(self.send_loop())
 
         def get_extra_info(self, key):
             """Get extra info about the client.
@@ -49,48 +77,87 @@ class AOProtocolWS(AOProtocol):
             info = {"peername": remote_address}
             return info[key]
 
+        def set_write_buffer_limits(self, high, low):
+            """Set when to pause and resume the protocol."""
+            self.high_watermark = high
+            self.low_watermark = low
+
+        def get_write_buffer_size(self):
+            """Get how much is waiting to be sent."""
+            return self.size
+
         def write(self, message):
-            """Write message to the socket.
+            """Queue a message to be sent over the socket.
 
-            :param message: message in bytes
+            :param message: message as str, or in bytes
 
             """
-            message = message.decode("utf-8")
-            asyncio.ensure_future(self.ws_try_writing_message(message))
+            if self.closing:
+                return
+            if isinstance(message, bytes):
+                message = message.decode("utf-8")
+            self.frames.append(message)
+            self.size += len(message)
+            self.wakeup.set()
+            if not self.paused and self.size > self.high_watermark:
+                self.paused = True
+                self.protocol.pause_writing()
 
         def close(self):
-            """Disconnect the client by force."""
-            asyncio.ensure_future(self.ws.close())
-
-        async def ws_try_writing_message(self, message):
-            """
-            Try writing the message if the client has not already closed
-            the connection.
-            """
+            """Disconnect the client once everything queued was sent."""
+            self.closing = True
+            self.wakeup.set()
+
+        def abort(self):
+            """Disconnect the client by force, dropping anything queued."""
+            self.closing = True
+            self.frames.clear()
+            self.size = 0
+            # The sender may be stuck sending to a client that stopped reading.
+            self.sender.cancel()
+            self.ws.transport.abort()
+
+        def next_message(self):
+            """Take the next websocket message to send off the queue."""
+            if not self.batch:
+                return self.frames.popleft()
+            batch = [self.frames.popleft()]
+            length = len(batch[0])
+            while self.frames and length + len(self.frames[0]) <= self.max_batch:
+                length += len(self.frames[0])
+                batch.append(self.frames.popleft())
+            return "".join(batch)
+
+        async def send_loop(self):
+            """Send queued messages in order until the connection goes away."""
             try:
-                await self.ws.send(message)
+                while True:
+                    await self.wakeup.wait()
+                    self.wakeup.clear()
+                    while self.frames:
+                        message = self.next_message()
+                        await self.ws.send(message)
+                        self.size -= len(message)
+                        if self.paused and self.size <= self.low_watermark:
+                            self.paused = False
+                            self.protocol.resume_writing()
+                    if self.closing:
+                        await self.ws.close()
+                        return
             except ConnectionClosed:
                 return
 
     def __init__(self, server, websocket):
         super().__init__(server)
         self.ws = websocket
-        self.ws_connected = True
-
-        self.ws_on_connect()
+        self.transport = self.TransportWrapper(
+            websocket, self, batch=server.config["websocket_batching"]
+        )
+        self.connection_made(self.transport)
 
-    def ws_on_connect(self):
-        """Handle a new client connection."""
-        self.connection_made(self.TransportWrapper(self.ws))
-
-    async def ws_handle(self):
-        try:
-            data = await self.ws.recv()
-            self.data_received(data)
-        except Exception as exc:
-            # Any event handled in data_received could raise any exception
-            self.ws_connected = False
-            self.connection_lost(exc)
+    def connection_lost(self, exc):
+        super().connection_lost(exc)
+        self.transport.sender.cancel()
 
 
 def new_websocket_client(server):
@@ -102,7 +169,15 @@ def new_websocket_client(server):
 
     async def func(websocket, _):
         client = AOProtocolWS(server, websocket)
-        while client.ws_connected:
-            await client.ws_handle()
+        try:
+            async for message in websocket:
+                client.data_received(message)
+        except ConnectionClosed:
+            client.connection_lost(None)
+        except Exception as exc:
+            # Any event handled in data_received could raise any exception
+            client.connection_lost(exc)
+        else:
+            client.connection_lost(None)
 
     return func
@@ -0,0 +1,95 @@
+# KFO-Server, an Attorney Online server
+#
+# Copyright (C) 2020 Crystalwarrior <varsash@gmail.com>
+#
+# Derivative of tsuserver3, an Attorney Online server. Copyright (C) 2016 argoneus <argoneuscze@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Every AO packet ends with this. It is plain ASCII, so it can never show up
+# in the middle of a multibyte UTF-8 sequence.
+TERMINATOR = b"#%"
+
+
+class FrameBuffer:
+    """Splits a stream of bytes into complete AO packets.
+
+    Incoming data is appended to a single bytearray and only the newly
+    received bytes are scanned for the terminator, so a client pipelining
+    many packets costs linear time instead of re-copying the whole pending
+    buffer once per packet. Bytes are only decoded once the frames they
+    belong to are complete, which keeps multibyte characters split across
+    TCP segments intact.
+    """
+
+    def __init__(self, max_size=8192):
+        """
+        :param max_size: maximum amount of bytes a single packet, or the
+        incomplete data waiting for its terminator, may take up.
+        """
+        self.max_size = max_size
+        self.buffer = bytearray()
+        # Where to resume looking for the terminator on the next feed.
+        self.scan_from = 0
+        # Whether the last feed had to throw data away for being too big.
+        self.overflow = False
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def feed(self, data):
+        """
+        Add received data to the buffer.
+        :param data: bytes (TCP) or str (WebSocket) that were received
+        :returns: list of complete messages, without their terminators
+        """
+        self.overflow = False
+        if not data:
+            return []
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self.buffer += data
+
+        end = self.buffer.rfind(TERMINATOR, self.scan_from)
+        if end == -1:
+            # Keep the last byte in case it's the first half of a terminator.
+            self.scan_from = max(len(self.buffer) - 1, 0)
+            if len(self.buffer) > self.max_size:
+                self.clear()
+                self.overflow = True
+            return []
+
+        with memoryview(self.buffer) as view:
+            complete = view[:end].tobytes()
+        del self.buffer[: end + len(TERMINATOR)]
+        self.scan_from = 0
+        if len(self.buffer) > self.max_size:
+            self.clear()
+            self.overflow = True
+
+        # Complete frames always end on a character boundary, so decoding
+        # them in one go can't cut a character in half.
+        text = complete.replace(b"\0", b"").decode("utf-8", "ignore")
+        messages = []
+        for msg in text.split("#%"):
+            if len(msg) > self.max_size:
+                self.overflow = True
+                continue
+            messages.append(msg)
+        return messages
+
+    def clear(self):
+        """Throw away any incomplete data."""
+        self.buffer.clear()
+        self.scan_from = 0
@@ -0,0 +1,90 @@
+# KFO-Server, an Attorney Online server
+#
+# Copyright (C) 2020 Crystalwarrior <varsash@gmail.com>
+#
+# Derivative of tsuserver3, an Attorney Online server. Copyright (C) 2016 argoneus <argoneuscze@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import hashlib
+
+from server.constants import pack_ao_command
+
+
+class HandshakeCache:
+    """Encoded handshake packets, shared by every client that gets the same one.
+
+    SC, SM, FL and CharsCheck are big and mostly the same for everyone in a
+    hub, so each distinct one is only composed and encoded once. Keys carry
+    whatever decides the contents (list versions, area lists and so on), so a
+    changed list simply stops being looked up instead of needing to be
+    invalidated by hand.
+    """
+
+    # Distinct packets to keep before starting over
+    MAX_ENTRIES = 512
+
+    def __init__(self, metrics):
+        """
+        :param metrics: server metrics
+        """
+        self.metrics = metrics
+        # key -> [source, bytes, str or None, digest or None]
+        self.entries = {}
+
+    def payload(self, key, command, build, source=None, text=False):
+        """
+        Get an encoded packet, building it if it isn't cached.
+        :param key: hashable key deciding the packet's contents
+        :param command: packet command
+        :param build: called without arguments to get the packet arguments
+        :param source: object the key was made from the id() of, if any.
+        The entry is only used while it's still that very object.
+        :param text: get it as a str, for transports that take text
+        :returns: UTF-8 bytes, or a str if text is set
+        """
+        entry = self.entries.get(key)
+        if entry is None or entry[0] is not source:
+            self.metrics.count(f"handshake.miss.{command}")
+            if len(self.entries) >= self.MAX_ENTRIES:
+                self.entries.clear()
+            entry = self.entries[key] = [
+                source, pack_ao_command(command, build()), None, None]
+        else:
+            self.metrics.count(f"handshake.hit.{command}")
+        if not text:
+            return entry[1]
+        if entry[2] is None:
+            entry[2] = entry[1].decode("utf-8")
+        return entry[2]
+
+    def digest(self, key):
+        """
+        Get a short content hash of a cached packet, see AOProtocol.net_cmd_lh.
+        :param key: key the packet was just gotten with through payload()
+        :returns: hex string
+        """
+        entry = self.entries[key]
+        if entry[3] is None:
+            entry[3] = hashlib.blake2b(entry[1], digest_size=8).hexdigest()
+        return entry[3]
+
+    def size(self, key):
+        """Get the size in bytes of a cached packet."""
+        return len(self.entries[key][1])
+
+    def clear(self):
+        """Forget every cached packet."""
+        self.entries.clear()
@@ -0,0 +1,233 @@
+# KFO-Server, an Attorney Online server
+#
+# Copyright (C) 2020 Crystalwarrior <varsash@gmail.com>
+#
+# Derivative of tsuserver3, an Attorney Online server. Copyright (C) 2016 argoneus <argoneuscze@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import logging
+import time
+from collections import deque
+
+from server.network import packets
+
+logger = logging.getLogger("debug")
+
+ACTIONS = ("queue", "drop", "disconnect")
+
+
+class TokenBucket:
+    """Tokens trickle in at a steady rate, up to a burst, and packets spend them."""
+
+    __slots__ = ("tokens", "last")
+
+    def __init__(self, burst):
+        self.tokens = burst
+        self.last = time.monotonic()
+
+    def refill(self, now, rate, burst):
+        """
+        Add the tokens earned since the last refill.
+        :param now: current monotonic time
+        :param rate: tokens per second
+        :param burst: most tokens the bucket can hold
+        """
+        self.tokens = min(burst, self.tokens + (now - self.last) * rate)
+        self.last = now
+
+
+class IngressLimiter:
+    """Budgets for incoming packets, shared by the whole server.
+
+    Every packet costs a token from a bucket of its connection and one from a
+    bucket shared by every connection of the same IPID, each with its own
+    rate and burst per packet type. Checked before a packet is even parsed.
+    """
+
+    def __init__(self, config, metrics, timers):
+        """
+        :param config: the ingress_limit section of the server config
+        :param metrics: server metrics
+        :param timers: server timer wheel, for draining queued packets
+        """
+        self.metrics = metrics
+        self.timers = timers
+        # ipid -> [connection count, {bucket name: TokenBucket}]
+        self.ipids = {}
+        self.configure(config)
+
+    def configure(self, config):
+        """
+        Apply a (possibly reloaded) ingress_limit config. Buckets keep their tokens.
+        :param config: the ingress_limit section of the server config
+        """
+        if config["action"] not in ACTIONS:
+            raise ValueError(
+                f"ingress_limit action must be one of {', '.join(ACTIONS)}.")
+        self.enabled = config["enabled"]
+        self.action = config["action"]
+        self.queue_size = config["queue_size"]
+        self.connection_budgets = config["connection"]
+        self.ipid_budgets = config["ipid"]
+
+    def budget(self, budgets, cmd):
+        """
+        Get the budget of a packet type.
+        :param budgets: connection or ipid budgets
+        :param cmd: packet command
+        :returns: (bucket name, rate, burst). Packet types without a budget
+        of their own all share the default bucket.
+        """
+        budget = budgets.get(cmd)
+        if budget is None:
+            cmd = "default"
+            budget = budgets[cmd]
+        return cmd, budget["rate"], budget["burst"]
+
+    def connect(self, ipid):
+        """
+        Start sharing the IPID buckets with a new connection.
+        :param ipid: IPID of the connection
+        :returns: the IPID's buckets
+        """
+        entry = self.ipids.get(ipid)
+        if entry is None:
+            entry = self.ipids[ipid] = [0, {}]
+        entry[0] += 1
+        return entry[1]
+
+    def disconnect(self, ipid):
+        """
+        Forget the IPID buckets once its last connection is gone.
+        :param ipid: IPID of the connection
+        """
+        entry = self.ipids.get(ipid)
+        if entry is None:
+            return
+        entry[0] -= 1
+        if entry[0] <= 0:
+            del self.ipids[ipid]
+
+
+class ConnectionIngress:
+    """Ingress limiting for a single connection.
+
+    Packets within budget are handed to the protocol straight away. What
+    happens to the rest depends on the configured action: they're held back
+    in order until there are tokens for them, thrown away, or the client is
+    disconnected.
+    """
+
+    def __init__(self, limiter, ipid, handle, disconnect):
+        """
+        :param limiter: server-wide IngressLimiter
+        :param ipid: IPID of the connection
+        :param handle: called with each message that is let through
+        :param disconnect: called when the client goes over budget with action disconnect
+        """
+        self.limiter = limiter
+        self.ipid = ipid
+        self.handle = handle
+        self.on_disconnect = disconnect
+        self.buckets = {}
+        self.ipid_buckets = limiter.connect(ipid)
+        # messages held back for lack of tokens, oldest first
+        self.queue = deque()
+        self.drain_handle = None
+        self.closed = False
+
+    def wait(self, cmd):
+        """
+        Take the tokens for a packet if both buckets have one.
+        :param cmd: packet command
+        :returns: 0 if the packet may go, otherwise seconds until it may
+        """
+        limiter = self.limiter
+        now = time.monotonic()
+        name, rate, burst = limiter.budget(limiter.connection_budgets, cmd)
+        bucket = self.buckets.get(name)
+        if bucket is None:
+            bucket = self.buckets[name] = TokenBucket(burst)
+        bucket.refill(now, rate, burst)
+        name, ipid_rate, ipid_burst = limiter.budget(limiter.ipid_budgets, cmd)
+        ipid_bucket = self.ipid_buckets.get(name)
+        if ipid_bucket is None:
+            ipid_bucket = self.ipid_buckets[name] = TokenBucket(ipid_burst)
+        ipid_bucket.refill(now, ipid_rate, ipid_burst)
+
+        if bucket.tokens >= 1 and ipid_bucket.tokens >= 1:
+            bucket.tokens -= 1
+            ipid_bucket.tokens -= 1
+            return 0
+        return max(
+            (1 - bucket.tokens) / rate if rate > 0 else 1,
+            (1 - ipid_bucket.tokens) / ipid_rate if ipid_rate > 0 else 1,
+        )
+
+    def feed(self, msg):
+        """
+        Let a message through, or deal with it according to the configured action.
+        :param msg: decoded message without its terminator
+        """
+        limiter = self.limiter
+        if self.closed:
+            return
+        if not limiter.enabled:
+            self.handle(msg)
+            return
+        cmd = msg.split("#", 1)[0]
+        if len(self.queue) == 0 and self.wait(cmd) == 0:
+            self.handle(msg)
+            return
+
+        if cmd not in packets.schemas:
+            # Don't let made up commands fill up the metrics
+            cmd = "unknown"
+        if limiter.action == "disconnect":
+            limiter.metrics.count(f"ingress.disconnected.{cmd}")
+            logger.debug(f"Disconnecting {self.ipid} for flooding {cmd}.")
+            self.close()
+            self.on_disconnect()
+        elif limiter.action == "queue" and len(self.queue) < limiter.queue_size:
+            limiter.metrics.count(f"ingress.queued.{cmd}")
+            self.queue.append((cmd, msg))
+            if self.drain_handle is None:
+                self.drain()
+        else:
+            limiter.metrics.count(f"ingress.dropped.{cmd}")
+
+    def drain(self):
+        """Handle queued messages for as long as there are tokens for them."""
+        self.drain_handle = None
+        while self.queue and not self.closed:
+            cmd, msg = self.queue[0]
+            delay = self.wait(cmd)
+            if delay > 0:
+                self.drain_handle = self.limiter.timers.call_later(
+                    delay, self.drain)
+                return
+            self.queue.popleft()
+            self.handle(msg)
+
+    def close(self):
+        """Drop anything still queued and give up the IPID buckets."""
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.clear()
+        if self.drain_handle is not None:
+            self.drain_handle.cancel()
+            self.drain_handle = None
+        self.limiter.disconnect(self.ipid)
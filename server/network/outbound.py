@@ -0,0 +1,223 @@
+# KFO-Server, an Attorney Online server
+#
+# Copyright (C) 2020 Crystalwarrior <varsash@gmail.com>
+#
+# Derivative of tsuserver3, an Attorney Online server. Copyright (C) 2016 argoneus <argoneuscze@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import logging
+import math
+from collections import deque
+
+logger = logging.getLogger("debug")
+
+# Packet priority classes, lowest goes out first.
+URGENT = 0
+NORMAL = 1
+BULK = 2
+
+PRIORITIES = {
+    "CHECK": URGENT,
+    "MS": URGENT,
+    "KK": URGENT,
+    "KB": URGENT,
+    "BD": URGENT,
+    "SC": BULK,
+    "SM": BULK,
+    "FM": BULK,
+    "FA": BULK,
+    "LE": BULK,
+    "ARUP": BULK,
+    "CharsCheck": BULK,
+}
+
+# Packets that always carry the full current state, so only the newest
+# queued one is worth sending.
+COALESCED = {"ARUP", "FA", "FM", "LE", "CharsCheck"}
+
+# Typical TCP payload size, used to estimate how many segments corking saved.
+SEGMENT_SIZE = 1460
+
+
+class OutboundQueue:
+    """Outgoing packets of a single client.
+
+    Packets are written straight to the transport while it keeps up. Once
+    the transport reports that too much is waiting (see
+    AOProtocol.pause_writing), packets are held back here instead, urgent
+    ones ahead of bulk list refreshes, and a queued refresh is replaced by
+    a newer one of the same kind. A client that stays over the hard limit
+    for longer than the grace period is disconnected.
+
+    With corking on, everything written during one event loop iteration is
+    collected and handed to the transport in one go at the end of it.
+    """
+
+    __slots__ = (
+        "transport", "metrics", "hard_limit", "grace", "paused", "queues",
+        "pending", "size", "evict_handle", "text", "cork", "corked",
+    )
+
+    def __init__(self, transport, metrics, high_watermark=65536, low_watermark=16384,
+                 hard_limit=4194304, grace=10, cork=False):
+        """
+        :param transport: transport to write to
+        :param metrics: server metrics
+        :param high_watermark: bytes waiting in the transport before it pauses us
+        :param low_watermark: bytes waiting in the transport before it resumes us
+        :param hard_limit: bytes a client may have queued before being evicted
+        :param grace: seconds a client may stay over the hard limit
+        :param cork: collect writes until the end of the loop iteration
+        """
+        self.transport = transport
+        self.metrics = metrics
+        self.hard_limit = hard_limit
+        self.grace = grace
+        self.paused = False
+        # urgent, normal and bulk packets, only made once something is queued
+        self.queues = ()
+        # coalescing key -> queued [key, payload] entry
+        self.pending = {}
+        # bytes currently held back in the queues
+        self.size = 0
+        self.evict_handle = None
+        # Whether the transport takes str as well as bytes
+        self.text = getattr(transport, "accepts_text", False)
+        # WebSocket connections already batch in their sender task.
+        self.cork = cork and not self.text
+        # packets written during this loop iteration, if corking
+        self.corked = []
+        try:
+            transport.set_write_buffer_limits(high_watermark, low_watermark)
+        except (AttributeError, NotImplementedError):
+            pass
+
+    @property
+    def buffered(self):
+        """Bytes waiting to be sent, both here and in the transport."""
+        try:
+            return self.size + self.transport.get_write_buffer_size()
+        except (AttributeError, NotImplementedError):
+            return self.size
+
+    def write(self, payload, command=None):
+        """
+        Send a packet, or queue it if the client isn't keeping up.
+        :param payload: encoded packet, or a str if the transport takes text
+        :param command: packet command, used for priority and coalescing
+        """
+        if not self.paused and self.size == 0:
+            if not self.cork:
+                self.transport.write(payload)
+                return
+            if len(self.corked) == 0:
+                asyncio.get_running_loop().call_soon(self.uncork)
+            self.corked.append(payload)
+            return
+
+        key = None
+        if command in COALESCED:
+            key = command
+            if command == "ARUP":
+                # ARUP#<type>#... carries one of several lists
+                key = (command, payload[5:6])
+            entry = self.pending.get(key)
+            if entry is not None:
+                self.size += len(payload) - len(entry[1])
+                entry[1] = payload
+                self.metrics.count("outbound.coalesced")
+                return
+        entry = [key, payload]
+        if key is not None:
+            self.pending[key] = entry
+        if not self.queues:
+            self.queues = (deque(), deque(), deque())
+        self.queues[PRIORITIES.get(command, NORMAL)].append(entry)
+        self.size += len(payload)
+        self.metrics.count("outbound.queued")
+        if self.size > self.hard_limit and self.evict_handle is None:
+            self.evict_handle = asyncio.get_running_loop().call_later(
+                self.grace, self.check_evict
+            )
+
+    def uncork(self):
+        """Write everything collected during the last loop iteration."""
+        corked = self.corked
+        if len(corked) == 0:
+            return
+        self.corked = []
+        self.transport.writelines(corked)
+        if len(corked) > 1:
+            segments = math.ceil(sum(len(p) for p in corked) / SEGMENT_SIZE)
+            self.metrics.count("outbound.cork_writes_saved", len(corked) - 1)
+            self.metrics.count(
+                "outbound.cork_segments_saved", max(len(corked) - segments, 0)
+            )
+
+    def close(self):
+        """Write what is still corked and close the transport once it's sent."""
+        # uncork would run after the connection is gone otherwise
+        self.uncork()
+        self.transport.close()
+
+    def pause(self):
+        """Stop writing to the transport."""
+        self.paused = True
+
+    def resume(self):
+        """Start writing to the transport again, oldest urgent packets first."""
+        self.paused = False
+        self.flush()
+
+    def flush(self):
+        """Write queued packets until the transport pauses us again."""
+        for queue in self.queues:
+            while queue and not self.paused:
+                key, payload = queue.popleft()
+                if key is not None:
+                    del self.pending[key]
+                self.size -= len(payload)
+                # This might call pause() right away.
+                self.transport.write(payload)
+        if self.size <= self.hard_limit and self.evict_handle is not None:
+            self.evict_handle.cancel()
+            self.evict_handle = None
+
+    def check_evict(self):
+        """Disconnect the client if it's still over the hard limit."""
+        self.evict_handle = None
+        if self.size <= self.hard_limit:
+            return
+        logger.debug(
+            f"Evicting slow client with {self.size} bytes queued.")
+        self.metrics.count("outbound.evicted")
+        self.clear()
+        try:
+            # Don't wait for the buffer to drain, it won't.
+            self.transport.abort()
+        except AttributeError:
+            self.transport.close()
+
+    def clear(self):
+        """Throw away everything that is queued."""
+        for queue in self.queues:
+            queue.clear()
+        self.pending.clear()
+        self.corked = []
+        self.size = 0
+        if self.evict_handle is not None:
+            self.evict_handle.cancel()
+            self.evict_handle = None
@@ -0,0 +1,417 @@
+# KFO-Server, an Attorney Online server
+#
+# Copyright (C) 2020 Crystalwarrior <varsash@gmail.com>
+#
+# Derivative of tsuserver3, an Attorney Online server. Copyright (C) 2016 argoneus <argoneuscze@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from collections import namedtuple
+from enum import Enum
+
+
+class ArgType(Enum):
+    """Represents the data type of an argument for a network command."""
+
+    STR = (1,)
+    STR_OR_EMPTY = (2,)
+    INT = (3,)
+    INT_OR_STR = 3
+
+
+class PacketSchema:
+    """Describes every argument layout a network command can come in.
+
+    Layouts are told apart by their argument count, so picking one is a
+    single dict lookup. Each argument is checked and converted once, and the
+    result is handed to the handler as a namedtuple with the fields filled
+    in, using the defaults for anything the layout doesn't carry.
+    """
+
+    def __init__(self, name, fields=(), layouts=(), needs_auth=True, passthrough=False):
+        """
+        :param name: the command this schema is for, e.g. MS
+        :param fields: list of (field name, default value) for the record
+        :param layouts: list of layouts, each a list of (field name, type),
+        where type is an ArgType or a callable converting the raw string
+        :param needs_auth: whether you need to have chosen a character
+        :param passthrough: accept any arguments and ignore them
+        """
+        self.name = name
+        self.needs_auth = needs_auth
+        self.passthrough = passthrough
+        names = [field for field, _ in fields]
+        self.record = namedtuple(f"{name}Packet", names)
+        self.defaults = [default for _, default in fields]
+        self.empty = self.record._make(self.defaults)
+        self.layouts = {}
+        for layout in layouts:
+            if len(layout) in self.layouts:
+                raise ValueError(
+                    f"{name} has two layouts with {len(layout)} arguments")
+            self.layouts[len(layout)] = [
+                self._compile(names.index(field), kind) for field, kind in layout
+            ]
+
+    @staticmethod
+    def _compile(index, kind):
+        """Turn a field type into (index, allow_empty, converter)."""
+        if kind == ArgType.STR_OR_EMPTY:
+            return index, True, None
+        if kind == ArgType.INT:
+            return index, False, int
+        if kind in (ArgType.STR, ArgType.INT_OR_STR):
+            return index, False, None
+        return index, False, kind
+
+    def parse(self, args):
+        """
+        Validate and convert the arguments of a network command.
+        :param args: list of raw string arguments
+        :returns: a record of this schema, or None if they don't fit any layout
+        """
+        if self.passthrough:
+            return self.empty
+        layout = self.layouts.get(len(args))
+        if layout is None:
+            return None
+        values = self.defaults.copy()
+        for (index, allow_empty, convert), arg in zip(layout, args):
+            if not allow_empty and arg == "":
+                return None
+            if convert is not None:
+                try:
+                    arg = convert(arg)
+                except ValueError:
+                    return None
+            values[index] = arg
+        return self.record._make(values)
+
+    def make(self, *args, **kwargs):
+        """Build a record directly, e.g. for packets made up by the server."""
+        return self.empty._replace(**dict(zip(self.record._fields, args)), **kwargs)
+
+
+def dro_ding(arg):
+    """DRO 1.1.0 sends all sorts of values for the ding, anything but 1 means no ding."""
+    return 1 if int(arg) == 1 else 0
+
+
+# Fields shared by every IC message layout.
+_MS_BASE = (
+    ("msg_type", ArgType.STR),
+    ("pre", ArgType.STR_OR_EMPTY),
+    ("folder", ArgType.STR),
+    ("anim", ArgType.STR_OR_EMPTY),
+    ("text", ArgType.STR_OR_EMPTY),
+    ("pos", ArgType.STR),
+    ("sfx", ArgType.STR),
+    ("emote_mod", ArgType.INT),
+    ("cid", ArgType.INT),
+    ("sfx_delay", ArgType.INT),
+    ("button", ArgType.INT_OR_STR),
+    ("evidence", ArgType.INT),
+    ("flip", ArgType.INT),
+    ("ding", ArgType.INT),
+    ("color", ArgType.INT),
+)
+
+HI = PacketSchema(
+    "HI",
+    fields=(("hdid", ""),),
+    layouts=((("hdid", ArgType.STR),),),
+    needs_auth=False,
+)
+ID = PacketSchema(
+    "ID",
+    fields=(("software", ""), ("version", "")),
+    layouts=(
+        (("software", ArgType.STR_OR_EMPTY), ("version", ArgType.STR_OR_EMPTY)),
+    ),
+    needs_auth=False,
+)
+# Clients add all sorts of things to these, none of which we look at.
+CH = PacketSchema("CH", needs_auth=False, passthrough=True)
+askchaa = PacketSchema("askchaa", needs_auth=False, passthrough=True)
+RC = PacketSchema("RC", needs_auth=False, passthrough=True)
+RM = PacketSchema("RM", needs_auth=False, passthrough=True)
+RD = PacketSchema("RD", needs_auth=False, passthrough=True)
+# Hashes of the SC and SM the client still has from last time, empty if none.
+# Only sent by clients that got list_cache in FL.
+LH = PacketSchema(
+    "LH",
+    fields=(("sc_hash", ""), ("sm_hash", "")),
+    layouts=(
+        (("sc_hash", ArgType.STR_OR_EMPTY), ("sm_hash", ArgType.STR_OR_EMPTY)),
+    ),
+    needs_auth=False,
+)
+CC = PacketSchema(
+    "CC",
+    fields=(("client_id", 0), ("char_id", -1), ("hdid", "")),
+    layouts=(
+        (
+            ("client_id", ArgType.INT),
+            ("char_id", ArgType.INT),
+            ("hdid", ArgType.STR),
+        ),
+    ),
+    needs_auth=False,
+)
+MS = PacketSchema(
+    "MS",
+    fields=(
+        ("msg_type", None),
+        ("pre", None),
+        ("folder", None),
+        ("anim", None),
+        ("text", None),
+        ("pos", None),
+        ("sfx", None),
+        ("emote_mod", None),
+        ("cid", None),
+        ("sfx_delay", None),
+        ("button", None),
+        ("evidence", None),
+        ("flip", None),
+        ("ding", None),
+        ("color", None),
+        ("showname", ""),
+        ("charid_pair", -1),
+        ("offset_pair", 0),
+        ("nonint_pre", 0),
+        ("sfx_looping", "0"),
+        ("screenshake", 0),
+        ("frames_shake", ""),
+        ("frames_realization", ""),
+        ("frames_sfx", ""),
+        ("additive", 0),
+        ("effect", ""),
+        ("video", ""),
+        ("hide_character", 0),
+    ),
+    layouts=(
+        # Pre-2.6
+        _MS_BASE,
+        # DRO 1.1.0
+        _MS_BASE[:13]
+        + (
+            ("ding", dro_ding),
+            ("color", ArgType.INT),
+            ("showname", ArgType.STR_OR_EMPTY),
+            ("video", ArgType.STR_OR_EMPTY),
+            ("hide_character", ArgType.INT),
+        ),
+        # 2.6
+        _MS_BASE
+        + (
+            ("showname", ArgType.STR_OR_EMPTY),
+            ("charid_pair", ArgType.INT),
+            ("offset_pair", ArgType.INT),
+            ("nonint_pre", ArgType.INT),
+        ),
+        # 2.8 (rip 2.7)
+        _MS_BASE
+        + (
+            ("showname", ArgType.STR_OR_EMPTY),
+            ("charid_pair", ArgType.STR),
+            ("offset_pair", ArgType.STR),
+            ("nonint_pre", ArgType.INT),
+            ("sfx_looping", ArgType.STR),
+            ("screenshake", ArgType.INT),
+            ("frames_shake", ArgType.STR),
+            ("frames_realization", ArgType.STR),
+            ("frames_sfx", ArgType.STR),
+            ("additive", ArgType.INT),
+            ("effect", ArgType.STR),
+        ),
+    ),
+)
+CT = PacketSchema(
+    "CT",
+    fields=(("name", ""), ("message", "")),
+    layouts=((("name", ArgType.STR_OR_EMPTY), ("message", ArgType.STR)),),
+    needs_auth=False,
+)
+MC = PacketSchema(
+    "MC",
+    fields=(("song", ""), ("cid", None), ("showname", ""), ("effects", 0)),
+    layouts=(
+        # Only good for picking an area or hub, not for playing music.
+        (("song", ArgType.STR),),
+        (("song", ArgType.STR), ("cid", ArgType.INT)),
+        (
+            ("song", ArgType.STR),
+            ("cid", ArgType.INT),
+            ("showname", ArgType.STR_OR_EMPTY),
+        ),
+        (
+            ("song", ArgType.STR),
+            ("cid", ArgType.INT),
+            ("showname", ArgType.STR_OR_EMPTY),
+            ("effects", ArgType.INT),
+        ),
+    ),
+    # Spectators may still use the music list to move between areas and hubs,
+    # the handler checks for a character before actually playing anything.
+    needs_auth=False,
+)
+RT = PacketSchema(
+    "RT",
+    fields=(("anim", ""), ("variant", None)),
+    layouts=(
+        (("anim", ArgType.STR),),
+        (("anim", ArgType.STR), ("variant", ArgType.INT)),
+    ),
+)
+SETCASE = PacketSchema(
+    "SETCASE",
+    fields=(
+        ("cases", ""),
+        ("will_cm", "0"),
+        ("will_def", "0"),
+        ("will_pro", "0"),
+        ("will_jud", "0"),
+        ("will_jur", "0"),
+        ("will_steno", "0"),
+    ),
+    layouts=(
+        (
+            ("cases", ArgType.STR_OR_EMPTY),
+            ("will_cm", ArgType.STR_OR_EMPTY),
+            ("will_def", ArgType.STR_OR_EMPTY),
+            ("will_pro", ArgType.STR_OR_EMPTY),
+            ("will_jud", ArgType.STR_OR_EMPTY),
+            ("will_jur", ArgType.STR_OR_EMPTY),
+            ("will_steno", ArgType.STR_OR_EMPTY),
+        ),
+    ),
+    needs_auth=False,
+)
+CASEA = PacketSchema(
+    "CASEA",
+    fields=(
+        ("title", ""),
+        ("need_cm", "0"),
+        ("need_def", "0"),
+        ("need_pro", "0"),
+        ("need_jud", "0"),
+        ("need_jur", "0"),
+        ("need_steno", "0"),
+    ),
+    layouts=(
+        (
+            ("title", ArgType.STR_OR_EMPTY),
+            ("need_def", ArgType.STR_OR_EMPTY),
+            ("need_pro", ArgType.STR_OR_EMPTY),
+            ("need_jud", ArgType.STR_OR_EMPTY),
+            ("need_jur", ArgType.STR_OR_EMPTY),
+            ("need_steno", ArgType.STR_OR_EMPTY),
+        ),
+        (
+            ("title", ArgType.STR_OR_EMPTY),
+            ("need_cm", ArgType.STR_OR_EMPTY),
+            ("need_def", ArgType.STR_OR_EMPTY),
+            ("need_pro", ArgType.STR_OR_EMPTY),
+            ("need_jud", ArgType.STR_OR_EMPTY),
+            ("need_jur", ArgType.STR_OR_EMPTY),
+            ("need_steno", ArgType.STR_OR_EMPTY),
+        ),
+    ),
+    needs_auth=False,
+)
+HP = PacketSchema(
+    "HP",
+    fields=(("bar", 0), ("value", 0)),
+    layouts=((("bar", ArgType.INT), ("value", ArgType.INT)),),
+)
+PE = PacketSchema(
+    "PE",
+    fields=(("name", ""), ("desc", ""), ("image", "")),
+    layouts=(
+        (
+            ("name", ArgType.STR_OR_EMPTY),
+            ("desc", ArgType.STR_OR_EMPTY),
+            ("image", ArgType.STR_OR_EMPTY),
+        ),
+    ),
+)
+DE = PacketSchema(
+    "DE",
+    fields=(("evi_id", 0),),
+    layouts=((("evi_id", ArgType.INT),),),
+)
+EE = PacketSchema(
+    "EE",
+    fields=(("evi_id", 0), ("name", ""), ("desc", ""), ("image", "")),
+    layouts=(
+        (
+            ("evi_id", ArgType.INT),
+            ("name", ArgType.STR_OR_EMPTY),
+            ("desc", ArgType.STR_OR_EMPTY),
+            ("image", ArgType.STR_OR_EMPTY),
+        ),
+    ),
+)
+ZZ = PacketSchema(
+    "ZZ",
+    fields=(("reason", None), ("target", "")),
+    layouts=(
+        # Pre-2.6 clients can't give a reason.
+        (),
+        (("reason", ArgType.STR_OR_EMPTY),),
+        (("reason", ArgType.STR_OR_EMPTY), ("target", ArgType.STR_OR_EMPTY)),
+    ),
+    needs_auth=False,
+)
+opKICK = PacketSchema(
+    "opKICK",
+    fields=(("target", ""),),
+    layouts=((("target", ArgType.STR_OR_EMPTY),),),
+    needs_auth=False,
+)
+opBAN = PacketSchema(
+    "opBAN",
+    fields=(("target", ""),),
+    layouts=((("target", ArgType.STR_OR_EMPTY),),),
+    needs_auth=False,
+)
+
+schemas = {
+    schema.name: schema
+    for schema in (
+        HI,
+        ID,
+        CH,
+        askchaa,
+        RC,
+        RM,
+        RD,
+        LH,
+        CC,
+        MS,
+        CT,
+        MC,
+        RT,
+        SETCASE,
+        CASEA,
+        HP,
+        PE,
+        DE,
+        EE,
+        ZZ,
+        opKICK,
+        opBAN,
+    )
+}
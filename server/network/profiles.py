@@ -0,0 +1,114 @@
+# KFO-Server, an Attorney Online server
+#
+# Copyright (C) 2020 Crystalwarrior <varsash@gmail.com>
+#
+# Derivative of tsuserver3, an Attorney Online server. Copyright (C) 2016 argoneus <argoneuscze@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+class ClientProfile:
+    """What a client software and version can handle.
+
+    Worked out once, when the client sends its version, instead of on every
+    packet. Clients reporting the same software and version share a single
+    profile, so packets adapted for one of them can be reused for the rest.
+    """
+
+    __slots__ = (
+        "software",
+        "version",
+        "multilayer_audio",
+        "dro",
+        "legacy_sfx",
+        "features",
+        "features_no_arup",
+    )
+
+    # (software, version, features) -> profile
+    _profiles = {}
+    # Clients choose their own version string, don't let them fill us up.
+    MAX_PROFILES = 256
+
+    def __init__(self, software, version, features):
+        """
+        :param software: client software, e.g. AO2
+        :param version: client version, e.g. 2.10.0
+        :param features: features the server supports, sent with FL
+        """
+        self.software = software
+        self.version = version
+
+        ver = version.split(".")
+        release = int(ver[0]) if ver[0].isnumeric() else None
+        major = int(ver[1]) if len(ver) > 1 and ver[1].isnumeric() else None
+
+        # Clients 2.8 and above can hear ambience
+        self.multilayer_audio = (
+            len(ver) == 3
+            and release is not None
+            and major is not None
+            and release >= 2
+            and major >= 8
+        )
+        # The DRO 1.1.0 client has no video or hiding support, and wants
+        # to be told its own ID in MS packets.
+        self.dro = version.startswith("1.1.0")
+        # Client versions 2.9 or less need to get their SFX corrected due to 2.10 changes
+        self.legacy_sfx = (
+            release is not None and major is not None and release <= 2 and major <= 9
+        )
+
+        self.features = tuple(features)
+        self.features_no_arup = tuple(f for f in features if f != "arup")
+
+    @classmethod
+    def get(cls, software, version, features):
+        """
+        Get the profile shared by every client with this software and version.
+        :param software: client software
+        :param version: client version
+        :param features: features the server supports
+        """
+        key = (software, version, tuple(features))
+        profile = cls._profiles.get(key)
+        if profile is None:
+            profile = cls(software, version, features)
+            if len(cls._profiles) < cls.MAX_PROFILES:
+                cls._profiles[key] = profile
+        return profile
+
+    def feature_list(self, arup=True):
+        """
+        Get the feature list to send with FL.
+        :param arup: whether the ARUP area list is currently in use
+        """
+        if arup:
+            return self.features
+        return self.features_no_arup
+
+    def adapt_ms(self, args, client_id):
+        """
+        Adapt an MS packet to this profile.
+        :param args: tuple of MS arguments
+        :param client_id: ID of the client it is sent to
+        :returns: args itself if nothing had to change, or a new tuple
+        """
+        if self.dro:
+            lst = list(args)
+            lst[16] = ""  # No video support :(
+            lst[17] = 0  # no hiding character
+            lst[18] = client_id  # sender character id
+            args = tuple(lst)
+        return args
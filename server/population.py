@@ -0,0 +1,150 @@
+# KFO-Server, an Attorney Online server
+#
+# Copyright (C) 2020 Crystalwarrior <varsash@gmail.com>
+#
+# Derivative of tsuserver3, an Attorney Online server. Copyright (C) 2016 argoneus <argoneuscze@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+class Population:
+    """Head counts of an area or a hub.
+
+    Updated as clients join and leave areas, hide, change character or go
+    AFK, so nobody has to go through the clients to count them. An area's
+    counts also go towards those of its hub.
+    """
+
+    __slots__ = ("total", "visible", "hidden", "spectators", "afk", "parent",
+                 "occupancy")
+
+    def __init__(self, parent=None, occupancy=None):
+        """
+        :param parent: population this one is part of, if any
+        :param occupancy: Occupancy to keep up to date as well, if any
+        """
+        self.total = 0
+        # Not hidden, see Client.hidden
+        self.visible = 0
+        self.hidden = 0
+        self.spectators = 0
+        self.afk = 0
+        self.parent = parent
+        self.occupancy = occupancy
+
+    def add(self, client, sign=1):
+        """
+        Count a client in.
+        :param client: client to count
+        :param sign: -1 to count them back out instead
+        """
+        if self.occupancy is not None:
+            self.occupancy.add(client.char_id, sign)
+        pop = self
+        hidden = client.hidden
+        spectator = client.char_id == -1
+        while pop is not None:
+            pop.total += sign
+            if hidden:
+                pop.hidden += sign
+            else:
+                pop.visible += sign
+            if spectator:
+                pop.spectators += sign
+            pop = pop.parent
+
+    def remove(self, client):
+        """
+        Count a client out.
+        :param client: client that was counted in
+        """
+        self.add(client, -1)
+
+    def count_afk(self, sign=1):
+        """
+        Count a client going AFK.
+        :param sign: -1 for a client coming back
+        """
+        pop = self
+        while pop is not None:
+            pop.afk += sign
+            pop = pop.parent
+
+
+class Occupancy:
+    """Which characters are taken in an area, indexed by character ID.
+
+    Kept up to date by the area's Population, so checking a character or
+    building CharsCheck never has to go through the clients.
+    """
+
+    __slots__ = ("counts", "version", "_check")
+
+    def __init__(self):
+        # character ID -> clients playing it
+        self.counts = []
+        # bumped whenever a character is taken or freed
+        self.version = 0
+        self._check = None
+
+    def add(self, char_id, sign=1):
+        """
+        Count a client playing a character.
+        :param char_id: character ID, anything below 0 or None is ignored
+        :param sign: -1 to count them back out instead
+        """
+        if char_id is None or char_id < 0:
+            return
+        counts = self.counts
+        if char_id >= len(counts):
+            if sign < 0:
+                return
+            counts.extend([0] * (char_id + 1 - len(counts)))
+        counts[char_id] += sign
+        # Only taking a free character or freeing one changes anything
+        if counts[char_id] == (1 if sign > 0 else 0):
+            self.version += 1
+            self._check = None
+
+    def is_free(self, char_id):
+        """
+        Whether nobody is playing a character.
+        :param char_id: character ID, anything below 0 or None is always free
+        """
+        if char_id is None or char_id < 0:
+            return True
+        return char_id >= len(self.counts) or self.counts[char_id] <= 0
+
+    def chars_check(self, size):
+        """
+        Get the CharsCheck list, 0 for free characters and -1 for taken ones.
+        :param size: length of the character list
+        :returns: tuple, the same one until a character is taken or freed
+        """
+        check = self._check
+        if check is None or len(check) != size:
+            counts = self.counts
+            known = min(size, len(counts))
+            check = self._check = tuple(
+                -1 if counts[i] > 0 else 0 for i in range(known)
+            ) + (0,) * (size - known)
+        return check
+
+    def free(self, size):
+        """
+        Get the free characters.
+        :param size: length of the character list
+        :returns: list of character IDs
+        """
+        return [i for i, taken in enumerate(self.chars_check(size)) if taken == 0]
@@ -0,0 +1,169 @@
+# KFO-Server, an Attorney Online server
+#
+# Copyright (C) 2020 Crystalwarrior <varsash@gmail.com>
+#
+# Derivative of tsuserver3, an Attorney Online server. Copyright (C) 2016 argoneus <argoneuscze@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import logging
+import math
+
+logger = logging.getLogger("debug")
+
+
+class TimerHandle:
+    """A callback scheduled on a TimerWheel.
+
+    Quacks like asyncio.TimerHandle, so code that only calls cancel(),
+    cancelled() and when() doesn't care which one it holds.
+    """
+
+    __slots__ = ("wheel", "callback", "args", "deadline", "tick", "_cancelled")
+
+    def __init__(self, wheel, callback, args):
+        self.wheel = wheel
+        self.callback = callback
+        self.args = args
+        self.deadline = 0
+        self.tick = None
+        self._cancelled = False
+
+    def cancel(self):
+        """Stop the callback from being called."""
+        if not self._cancelled:
+            self._cancelled = True
+            self.wheel._unlink(self)
+
+    def cancelled(self):
+        return self._cancelled
+
+    def when(self):
+        """Loop time at which the callback is due."""
+        return self.deadline
+
+    def reschedule(self, delay):
+        """
+        Move the deadline to delay seconds from now.
+        Also brings back a handle that was cancelled or has already fired.
+        :param delay: seconds from now
+        """
+        self._cancelled = False
+        self.wheel._unlink(self)
+        self.wheel._link(self, delay)
+
+
+class TimerWheel:
+    """Hashed timer wheel for the server's many coarse timeouts.
+
+    Every timer lands in the slot its deadline tick hashes to, so adding,
+    moving and cancelling one is O(1), and each tick only looks at a single
+    slot. Timers further away than one turn of the wheel share slots with
+    nearer ones and are skipped until their turn comes.
+
+    Callbacks fire at most one tick late. The wheel only ticks while it has
+    timers pending.
+    """
+
+    def __init__(self, tick=0.05, slots=512):
+        """
+        :param tick: seconds per tick
+        :param slots: number of slots, one turn of the wheel is tick * slots
+        """
+        self.tick = tick
+        self.slots = [dict() for _ in range(slots)]
+        self.pending = 0
+        # loop time of tick 0
+        self.epoch = None
+        # last tick that has been processed
+        self.current = 0
+        self.ticker = None
+        # how late the last tick ran, in seconds
+        self.lag = 0
+        self.max_lag = 0
+
+    def time(self):
+        """Current loop time, the clock that when() is measured against."""
+        return asyncio.get_running_loop().time()
+
+    def call_later(self, delay, callback, *args):
+        """
+        Call callback(*args) in delay seconds.
+        :param delay: seconds from now
+        :param callback: function to call
+        :returns: TimerHandle
+        """
+        handle = TimerHandle(self, callback, args)
+        self._link(handle, delay)
+        return handle
+
+    def _link(self, handle, delay):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        if self.epoch is None:
+            self.epoch = now
+        if self.pending == 0:
+            # Idle wheels don't tick, catch up to now without looking back.
+            self.current = int((now - self.epoch) / self.tick)
+        handle.deadline = now + max(delay, 0)
+        tick = max(math.ceil((handle.deadline - self.epoch) / self.tick),
+                   self.current + 1)
+        handle.tick = tick
+        self.slots[tick % len(self.slots)][handle] = None
+        self.pending += 1
+        if self.ticker is None:
+            self._schedule_tick(loop)
+
+    def _unlink(self, handle):
+        if handle.tick is None:
+            return
+        del self.slots[handle.tick % len(self.slots)][handle]
+        handle.tick = None
+        self.pending -= 1
+
+    def _schedule_tick(self, loop):
+        self.ticker = loop.call_at(
+            self.epoch + (self.current + 1) * self.tick, self._on_tick
+        )
+
+    def _on_tick(self):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        self.ticker = None
+        target = int((now - self.epoch) / self.tick)
+        self.lag = now - (self.epoch + target * self.tick)
+        if self.lag > self.max_lag:
+            self.max_lag = self.lag
+        # Every slot gets looked at at most once, however far behind we are.
+        first = max(self.current + 1, target - len(self.slots) + 1)
+        self.current = target
+        due = []
+        for tick in range(first, target + 1):
+            slot = self.slots[tick % len(self.slots)]
+            for handle in slot:
+                if handle.tick <= target:
+                    due.append(handle)
+        due.sort(key=lambda h: h.deadline)
+        for handle in due:
+            # An earlier callback might have cancelled or moved this one.
+            if handle.tick is None or handle.tick > target:
+                continue
+            self._unlink(handle)
+            try:
+                handle.callback(*handle.args)
+            except Exception:
+                logger.exception("Exception in timer callback")
+        if self.pending > 0 and self.ticker is None:
+            self._schedule_tick(loop)
@@ -24,8 +24,14 @@ from server.discordbot import Bridgebot
 from server.exceptions import ClientError, ServerError
 from server.network.aoprotocol import AOProtocol
 from server.network.aoprotocol_ws import new_websocket_client
+from server.network.handshake import HandshakeCache
+from server.network.ingress import IngressLimiter
 from server.network.masterserverclient import MasterServerClient
 from server.network.webhooks import Webhooks
+from server.metrics import Metrics
+from server.music_catalog import EMPTY, MusicCatalog
+from server.timer_wheel import TimerWheel
+from server.ui_sync import UISync
 from server.constants import remove_URL, dezalgo
 
 import server.logger
@@ -58,7 +64,8 @@ class TsuServer3:
         self.allowed_iniswaps = []
         self.char_list = None
         self.char_emotes = None
-        self.music_list = []
+        self.music_catalog = MusicCatalog()
+        self.music_list = EMPTY
         self.backgrounds = None
         self.zalgo_tolerance = None
         self.ipRange_bans = []
@@ -70,6 +77,7 @@ class TsuServer3:
             "prezoom",
             "flipping",
             "fastloading",
+            "list_cache",
             "noencryption",
             "deskmod",
             "evidence",
@@ -84,6 +92,15 @@ class TsuServer3:
             "y_offset",
         ]
         self.command_aliases = {}
+        self.metrics = Metrics()
+        self.timers = TimerWheel()
+        self.handshake_cache = HandshakeCache(self.metrics)
+        self.ui_sync = UISync(self)
+        self.metrics.gauge("timers.pending", lambda: self.timers.pending)
+        self.metrics.gauge(
+            "timers.tick_lag_ms",
+            lambda: f"{self.timers.lag * 1000:.1f} (max {self.timers.max_lag * 1000:.1f})",
+        )
 
         try:
             self.geoIpReader = geoip2.database.Reader(
@@ -104,6 +121,11 @@ class TsuServer3:
             self.load_music()
             self.load_backgrounds()
             self.load_ipranges()
+            # Areas broadcast through the client manager, even while loading
+            self.client_manager = ClientManager(self)
+            self.ingress = IngressLimiter(
+                self.config["ingress_limit"], self.metrics, self.timers
+            )
             self.hub_manager = HubManager(self)
         except yaml.YAMLError as exc:
             print("There was a syntax error parsing a configuration file:")
@@ -120,7 +142,6 @@ class TsuServer3:
             print("Please check sample config files for the correct format.")
             sys.exit(1)
 
-        self.client_manager = ClientManager(self)
         server.logger.setup_logger(debug=self.config["debug"])
 
         self.webhooks = Webhooks(self)
@@ -253,9 +274,8 @@ class TsuServer3:
     @property
     def player_count(self):
         """Get the number of non-spectating clients."""
-        return len(
-            [client for client in self.client_manager.clients if client.char_id != -1]
-        )
+        spectators = self.client_manager.registry.with_char_id(-1)
+        return len(self.client_manager.clients) - len(spectators)
 
     def load_config(self):
         """Load the main server configuration from a YAML file."""
@@ -304,6 +324,44 @@ class TsuServer3:
             self.config["block_relative"] = False
         if "global_chat" not in self.config:
             self.config["global_chat"] = True
+        if "websocket_batching" not in self.config:
+            self.config["websocket_batching"] = False
+        if "chars_check_delay" not in self.config:
+            self.config["chars_check_delay"] = 0.25
+        self.config["outbound_buffer"] = {
+            "high_watermark": 65536,
+            "low_watermark": 16384,
+            "hard_limit": 4194304,
+            "grace": 10,
+            "cork": False,
+            **self.config.get("outbound_buffer", {}),
+        }
+        ingress_limit = self.config.get("ingress_limit", {})
+        self.config["ingress_limit"] = {
+            "enabled": True,
+            "action": "queue",
+            "queue_size": 32,
+            **ingress_limit,
+            # Budgets are rate (tokens per second) and burst (bucket size)
+            "connection": {
+                "default": {"rate": 20, "burst": 60},
+                "MS": {"rate": 3, "burst": 10},
+                "CT": {"rate": 3, "burst": 10},
+                "MC": {"rate": 2, "burst": 5},
+                "RT": {"rate": 1, "burst": 3},
+                "ZZ": {"rate": 0.2, "burst": 2},
+                **ingress_limit.get("connection", {}),
+            },
+            "ipid": {
+                "default": {"rate": 60, "burst": 180},
+                "MS": {"rate": 6, "burst": 20},
+                "CT": {"rate": 6, "burst": 20},
+                "MC": {"rate": 4, "burst": 10},
+                "RT": {"rate": 2, "burst": 6},
+                "ZZ": {"rate": 0.2, "burst": 2},
+                **ingress_limit.get("ipid", {}),
+            },
+        }
 
     def load_command_aliases(self):
         """Load a list of alternative command names."""
@@ -356,7 +414,8 @@ class TsuServer3:
     def load_music_list(self):
         try:
             with open("config/music.yaml", "r", encoding="utf-8") as music:
-                self.music_list = yaml.safe_load(music)
+                self.music_list = self.music_catalog.compile(
+                    yaml.safe_load(music))
         except Exception:
             logger.debug("Cannot find music.yaml")
         try:
@@ -366,58 +425,42 @@ class TsuServer3:
             logger.debug("Cannot find url.txt")
 
     def build_music_list(self, music_list):
-        song_list = []
-        for item in music_list:
-            if "category" not in item:  # skip settings n stuff
-                continue
-            song_list.append(item["category"])
-            for song in item["songs"]:
-                song_list.append(song["name"])
-        return song_list
+        """
+        Get the categories and song names of a music list, in order.
+        :param music_list: MusicList or MusicView
+        """
+        return music_list.names
 
     def get_song_data(self, music_list, music):
         """
         Get information about a track, if exists.
-        :param music_list: music list to search
+        :param music_list: MusicList or MusicView to search
         :param music: track name
         :returns: tuple (name, length or -1)
         :raises: ServerError if track not found
         """
-        for item in music_list:
-            if "category" not in item:  # skip settings n stuff
-                continue
-            if item["category"] == music:
-                return item["category"], 0
-            for song in item["songs"]:
-                if song["name"] == music:
-                    try:
-                        return song["name"], song["length"]
-                    except KeyError:
-                        return song["name"], -1
-        raise ServerError("Music not found.")
+        song = music_list.get(music)
+        if song is None:
+            raise ServerError("Music not found.")
+        return song
 
     def get_song_is_category(self, music_list, music):
         """
         Get whether a track is a category.
-        :param music_list: music list to search
+        :param music_list: MusicList or MusicView to search
         :param music: track name
         :returns: bool
         """
-        for item in music_list:
-            if "category" not in item:  # skip settings n stuff
-                continue
-            if item["category"] == music:
-                return True
-        return False
+        return music_list.is_category(music)
 
     def send_all_cmd_pred(self, cmd, *args, pred=lambda x: True):
         """
         Broadcast an AO-compatible command to all clients that satisfy
         a predicate.
         """
-        for client in self.client_manager.clients:
-            if pred(client):
-                client.send_command(cmd, *args)
+        self.client_manager.broadcast(
+            [c for c in self.client_manager.clients if pred(c)], cmd, *args
+        )
 
     def broadcast_global(self, client, msg, as_mod=False):
         """
@@ -573,6 +616,8 @@ class TsuServer3:
             self.config["modpass"] = cfg_yaml["modpass"]
 
         self.load_config()
+        self.ingress.configure(self.config["ingress_limit"])
+        self.handshake_cache.clear()
         self.load_command_aliases()
         self.load_censors()
         self.load_iniswaps()
@@ -0,0 +1,148 @@
+# KFO-Server, an Attorney Online server
+#
+# Copyright (C) 2020 Crystalwarrior <varsash@gmail.com>
+#
+# Derivative of tsuserver3, an Attorney Online server. Copyright (C) 2016 argoneus <argoneuscze@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import asyncio
+
+from server.arup import PLAYERS, STATUS, CMS, LOCK
+
+
+class UISync:
+    """List refreshes that clients are due, sent at the end of the loop iteration.
+
+    Moving around, changing owners, locks or evidence only marks who needs
+    which list. However many changes one packet or command makes, everyone
+    then gets at most one FA, FM, LE and ARUP of each type, built from the
+    state as it is by then. FA goes out before ARUP, as it clears the ARUP
+    info of the client.
+
+    CharsCheck has its own, longer window, see Area.broadcast_chars_check.
+    """
+
+    def __init__(self, server):
+        """
+        :param server: server instance
+        """
+        self.server = server
+        self.handle = None
+        # client -> whether to send the area list even if it didn't change
+        self.area_lists = {}
+        self.music = set()
+        self.evidence = set()
+        # hub -> ARUP type -> set of clients, or None for everyone in the hub
+        self.arup = {}
+        self.hub_list = False
+
+    def schedule(self):
+        """Flush at the end of this loop iteration, unless that's already due."""
+        if self.handle is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Still loading, go out once the server starts
+            loop = asyncio.get_event_loop_policy().get_event_loop()
+        self.handle = loop.call_soon(self.flush)
+
+    def mark_area_list(self, client, refresh=False):
+        """
+        Mark a client's area list as possibly out of date.
+        :param client: client to update
+        :param refresh: send it even if it didn't change
+        """
+        self.area_lists[client] = refresh or self.area_lists.get(client, False)
+        self.schedule()
+
+    def mark_music(self, client):
+        """Mark a client's music list as possibly out of date."""
+        self.music.add(client)
+        self.schedule()
+
+    def mark_evidence(self, client):
+        """Mark a client's evidence list as out of date."""
+        self.evidence.add(client)
+        self.schedule()
+
+    def mark_arup(self, hub, kind, clients=None):
+        """
+        Mark one type of ARUP of a hub as out of date.
+        :param hub: hub whose areas changed
+        :param kind: ARUP type
+        :param clients: clients to update, everyone in the hub by default
+        """
+        kinds = self.arup.setdefault(hub, {})
+        if clients is None:
+            kinds[kind] = None
+        elif kind not in kinds:
+            kinds[kind] = set(clients)
+        elif kinds[kind] is not None:
+            kinds[kind].update(clients)
+        self.schedule()
+
+    def mark_hub_list(self):
+        """Mark the hub list as out of date for everyone viewing it."""
+        self.hub_list = True
+        self.schedule()
+
+    def flush(self):
+        """Send everything marked since the last flush."""
+        try:
+            self.send_marked()
+        finally:
+            self.handle = None
+            # Anything marked while sending waits for the next iteration
+            if self.area_lists or self.music or self.arup or self.evidence or self.hub_list:
+                self.schedule()
+
+    def send_marked(self):
+        client_manager = self.server.client_manager
+        registry = client_manager.registry
+        if self.hub_list:
+            self.hub_list = False
+            client_manager.broadcast(
+                [c for c in client_manager.clients if c.viewing_hub_list],
+                "FA",
+                *self.server.hub_manager.hub_list(),
+            )
+
+        area_lists, self.area_lists = self.area_lists, {}
+        for client, refresh in area_lists.items():
+            if registry.get(client.id) is not client:
+                continue
+            if client.sync_area_list(refresh):
+                for kind in (PLAYERS, STATUS, CMS, LOCK):
+                    self.mark_arup(client.area.area_manager, kind, (client,))
+
+        music, self.music = self.music, set()
+        for client in music:
+            if registry.get(client.id) is client:
+                client.refresh_music()
+
+        arup, self.arup = self.arup, {}
+        for hub, kinds in arup.items():
+            for kind in sorted(kinds):
+                clients = kinds[kind]
+                if clients is not None:
+                    clients = [c for c in clients if c in hub.members]
+                hub.arup.send(kind, clients)
+
+        evidence, self.evidence = self.evidence, set()
+        for client in evidence:
+            if registry.get(client.id) is client:
+                client.send_command("LE", *client.area.get_evidence_list(client))
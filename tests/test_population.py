@@ -0,0 +1,18 @@
+import unittest
+
+from server.population import Occupancy
+
+
+class OccupancyTest(unittest.TestCase):
+    def test_is_free_without_character(self):
+        occupancy = Occupancy()
+        occupancy.add(0)
+        # None before the first RD, -1 in character select
+        self.assertTrue(occupancy.is_free(None))
+        self.assertTrue(occupancy.is_free(-1))
+        self.assertFalse(occupancy.is_free(0))
+        self.assertTrue(occupancy.is_free(1))
+
+
+if __name__ == "__main__":
+    unittest.main()